@@ -0,0 +1,570 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qs
+import pandas as pd
+from ConversationState import ConversationState
+from DataContext import GOAL_DATA_PATH, get_data_context
+from GoalCalculationN import prepare_goal_baseline
+from IntentExtractor import (
+    ASK_BASELINE, ASK_EXCLUDE, ASK_GOAL_FIELDS, ASK_WEIGHTS, BASELINE_PERIOD_ERROR,
+    coerce_baseline_period, extraction_prompt, get_intent_extractor,
+)
+from LLMGateway import IncrementalJSONParser, get_llm_gateway
+from Pipeline import get_goal_pipeline
+from WorkbookCache import CACHE_DIR
+
+AGENT_MAX_WORKERS = int(os.getenv("AGENT_MAX_WORKERS", min(os.cpu_count() or 1, 4)))
+AGENT_MAX_QUEUE = int(os.getenv("AGENT_MAX_QUEUE", 32))
+AGENT_MAX_SESSIONS = int(os.getenv("AGENT_MAX_SESSIONS", 512))
+AGENT_MAX_BODY_BYTES = int(os.getenv("AGENT_MAX_BODY_BYTES", 50 * 1024 * 1024))
+AGENT_MAX_MESSAGES = 50
+UPLOAD_DIR = os.path.join(CACHE_DIR, "uploads")
+_DATASET_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ServiceBusy(Exception):
+    """
+    Raised when the worker pool queue is full; the request is answered with 503.
+    """
+
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+# ---------------------------------------------------------------------------
+# Worker process: CPU-bound anomaly and goal steps against warm, per-process data
+# ---------------------------------------------------------------------------
+
+def _init_worker():
+    # Build the DataContext and the default goal baseline once per worker, not per request
+    context = get_data_context()
+    prepare_goal_baseline(GOAL_DATA_PATH, loader=context)
+    # The worker is already a process: its pipeline runs "process" stages on threads
+    get_goal_pipeline(processes=0)
+    print(f"🧵 Agent worker {os.getpid()} ready")
+
+
+def _warm_worker() -> int:
+    return os.getpid()
+
+
+def run_goal_pipeline(request: dict) -> dict:
+    """
+    Anomaly detection → FEMA verification → goals for one confirmed request, through the
+    goal Pipeline (the baseline is built while anomalies are verified). Runs in a pool worker.
+
+    Parameters:
+    - request: goal, min_growth, max_growth, product_weights, baseline_period,
+      exclude_disaster_months and optional dataset_path (goal workbook layout)
+
+    Returns:
+    - dict with status "needs_exclusion" (plus disaster_summary HTML) when disaster
+      months were found and the user has not decided yet, else status "ok" and goals
+      as records; seconds is the time spent in the worker, stages the per-stage times
+    """
+    start = time.perf_counter()
+    params = dict(request)
+    dataset_path = params.pop("dataset_path", None)
+    pipeline = get_goal_pipeline()
+    inputs = {
+        "context": get_data_context(),
+        "sales_file_path": dataset_path or GOAL_DATA_PATH,
+        "dataset_path": dataset_path,
+        "output_sink": None,
+        "params": params,
+    }
+
+    run = pipeline.run(inputs, ["verified_anomalies", "goal_baseline"])
+    if run["verified_anomalies"]["Disaster Match"].any() and params.get("exclude_disaster_months") is None:
+        run = pipeline.run(inputs, ["disaster_summary"])
+        return {
+            "status": "needs_exclusion",
+            "disaster_summary": run["disaster_summary"],
+            "stages": run.stage_ms(),
+            "seconds": time.perf_counter() - start,
+        }
+
+    run = pipeline.run(inputs, ["goals"])
+    exclude_months = run["exclude_months"]
+    return {
+        "status": "ok",
+        "goals": json.loads(run["goals"].to_json(orient="records")),
+        "excluded_months": 0 if exclude_months is None else len(exclude_months),
+        "stages": run.stage_ms(),
+        "critical_path": run.critical_path(),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+class WorkerPool:
+    """
+    Process pool for the CPU-bound steps with a bounded queue: at most
+    max_workers + max_queue requests are admitted, the rest get ServiceBusy.
+
+    Parameters:
+    - max_workers: worker processes (each keeps its own warm DataContext)
+    - max_queue: requests allowed to wait for a free worker
+    """
+
+    def __init__(self, max_workers: int = AGENT_MAX_WORKERS, max_queue: int = AGENT_MAX_QUEUE):
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_queue
+        self.executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker)
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def warm(self):
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*[loop.run_in_executor(self.executor, _warm_worker) for _ in range(self.max_workers)])
+        print(f"🔥 Agent worker pool warm: {self.max_workers} workers ({len(set(pids))} answered)")
+
+    async def run(self, fn, request: dict) -> dict:
+        if self.pending >= self.capacity:
+            self.rejected += 1
+            raise ServiceBusy(f"{self.pending} requests already queued")
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, fn, request)
+        finally:
+            self.pending -= 1
+        total = time.perf_counter() - start
+        self.completed += 1
+        self.run_seconds += result["seconds"]
+        self.queue_seconds += max(total - result["seconds"], 0.0)
+        result["queue_seconds"] = max(total - result["seconds"], 0.0)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "capacity": self.capacity,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_queue_ms": self.queue_seconds / self.completed * 1000 if self.completed else None,
+            "avg_run_ms": self.run_seconds / self.completed * 1000 if self.completed else None,
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+# ---------------------------------------------------------------------------
+# Request parsing
+# ---------------------------------------------------------------------------
+
+def parse_form(content_type: str, body: bytes) -> tuple:
+    """
+    Parses a POST body into (fields, files).
+
+    multipart/form-data is parsed with the standard library email parser;
+    application/x-www-form-urlencoded and application/json bodies give fields only.
+
+    Returns:
+    - (dict of field name -> str, dict of field name -> (filename, bytes))
+    """
+    fields, files = {}, {}
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    if media_type == "multipart/form-data":
+        message = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+        if not message.is_multipart():
+            raise RequestError(400, "Malformed multipart body")
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name is None:
+                continue
+            payload = part.get_payload(decode=True) or b""
+            filename = part.get_filename()
+            if filename is None:
+                fields[name] = payload.decode(part.get_content_charset() or "utf-8")
+            else:
+                files[name] = (filename, payload)
+    elif media_type == "application/x-www-form-urlencoded":
+        fields = {k: v[-1] for k, v in parse_qs(body.decode("utf-8"), keep_blank_values=True).items()}
+    elif media_type == "application/json":
+        try:
+            fields = json.loads(body or b"{}")
+        except ValueError as e:
+            raise RequestError(400, f"Invalid JSON body: {e}")
+    elif body:
+        raise RequestError(415, f"Unsupported content type: {media_type}")
+    return fields, files
+
+
+def dataset_id_for(data: bytes) -> str:
+    """
+    Content hash used as dataset ID; clients can compute it before uploading.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def dataset_path(dataset_id: str) -> str:
+    """
+    Returns the stored workbook for a dataset ID, or None if it was never uploaded.
+    """
+    if not _DATASET_ID_RE.match(dataset_id or ""):
+        return None
+    path = os.path.join(UPLOAD_DIR, f"{dataset_id}.xlsx")
+    return path if os.path.exists(path) else None
+
+
+def save_dataset(data: bytes) -> str:
+    """
+    Stores an uploaded workbook under its content hash (once) and returns the dataset
+    ID, so later messages reference it instead of uploading the file again.
+    """
+    dataset_id = dataset_id_for(data)
+    path = os.path.join(UPLOAD_DIR, f"{dataset_id}.xlsx")
+    if not os.path.exists(path):
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return dataset_id
+
+
+# ---------------------------------------------------------------------------
+# Conversation handling
+# ---------------------------------------------------------------------------
+
+@dataclass
+class AgentSession:
+    """
+    Chat state for one client: slot state, the (sender, text) history the extractor
+    reads, and the dataset the client uploaded.
+    """
+    session_id: str
+    state: ConversationState = field(default_factory=ConversationState)
+    messages: list = field(default_factory=list)
+    dataset_path: str = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def append(self, sender: str, text: str):
+        self.messages.append((sender, text))
+        del self.messages[:-AGENT_MAX_MESSAGES]
+
+
+def _parse_llm_json(text: str) -> dict:
+    parser = IncrementalJSONParser()
+    if not parser.feed(text):
+        raise json.JSONDecodeError("No complete JSON object in response", text, len(text))
+    return parser.value
+
+
+def _goal_summary(parsed: dict, result: dict) -> str:
+    name = parsed.get("name") or "User"
+    weights = ", ".join(f"{k}: {v}%" for k, v in parsed["product_weights"].items())
+    return (
+        f"✅ Hi **{name}**, I've calculated your goals for **{parsed['quarter']}**.\n\n"
+        f"- 🏆 **National Goal:** {float(parsed['goal']):,}\n"
+        f"- 📈 **Territory Growth Range:** {parsed['min_territory_growth']}% – {parsed['max_territory_growth']}%\n"
+        f"- 🧮 **Product Weights:** {weights}\n"
+        f"- 🕒 **Baseline Period:** {parsed['baseline_period']} months\n\n"
+        f"📊 {len(result['goals'])} territory goals are included in this response."
+    )
+
+
+class AgentService:
+    """
+    Headless goal-setting agent behind POST /agent.
+
+    Intent extraction runs on a thread (rules first, LLM gateway as fallback); anomaly
+    detection, FEMA verification and calculate_goals run on the WorkerPool. Sessions
+    are kept in memory, least recently used first out.
+    """
+
+    def __init__(self, max_workers: int = AGENT_MAX_WORKERS, max_queue: int = AGENT_MAX_QUEUE, max_sessions: int = AGENT_MAX_SESSIONS):
+        self.pool = WorkerPool(max_workers, max_queue)
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.requests = 0
+        self.errors = 0
+
+    def session(self, session_id: str = None) -> AgentSession:
+        session = self.sessions.get(session_id) if session_id else None
+        if session is None:
+            session = AgentSession(session_id or uuid.uuid4().hex)
+            self.sessions[session.session_id] = session
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        self.sessions.move_to_end(session.session_id)
+        return session
+
+    def _extract(self, session: AgentSession) -> dict:
+        known_fields, recent_turns = session.state.context(session.messages)
+        prompt = extraction_prompt(known_fields, recent_turns)
+
+        def extract_with_llm():
+            text = get_llm_gateway().complete(
+                model="claude-3-haiku-20240307",
+                max_tokens=512,
+                temperature=0,
+                messages=[{"role": "user", "content": prompt}]
+            )
+            return _parse_llm_json(text)
+
+        data = get_intent_extractor().extract(session.messages, extract_with_llm, known=session.state.known_slots())
+        session.state.update(data)
+        data.update(session.state.known_slots())
+        return data
+
+    async def handle(self, fields: dict, files: dict) -> dict:
+        """
+        Runs one chat turn.
+
+        Parameters:
+        - fields: "goal" (the user's message), optional "session_id" and optional
+          "dataset_id" of a workbook stored through POST /datasets
+        - files: optional "file" upload (goal workbook layout), for clients that send
+          the workbook with the message
+
+        Returns:
+        - JSON-serialisable response; "response" holds the reply as markdown
+        """
+        text = (fields.get("goal") or fields.get("message") or "").strip()
+        if not text:
+            raise RequestError(400, "Missing 'goal' field")
+
+        session = self.session(fields.get("session_id"))
+        async with session.lock:
+            if fields.get("dataset_id"):
+                path = dataset_path(fields["dataset_id"])
+                if path is None:
+                    raise RequestError(404, f"Unknown dataset_id: {fields['dataset_id']}")
+                session.dataset_path = path
+            elif "file" in files and files["file"][1]:
+                session.dataset_path = dataset_path(await asyncio.to_thread(save_dataset, files["file"][1]))
+
+            timings = {}
+            start = time.perf_counter()
+            session.append("user", text)
+            try:
+                parsed = await asyncio.to_thread(self._extract, session)
+            except json.JSONDecodeError as e:
+                parsed, reply = None, f"❌ Claude response could not be parsed: {e}"
+            timings["extraction_ms"] = (time.perf_counter() - start) * 1000
+
+            result = None
+            if parsed is not None:
+                reply, result = await self._respond(session, parsed)
+            slots = session.state.known_slots()
+            if result is not None and result["status"] == "ok":
+                # The goal is done: the next request starts from a clean slate
+                session.state.reset()
+            if result is not None:
+                timings["queue_ms"] = result["queue_seconds"] * 1000
+                timings["pipeline_ms"] = result["seconds"] * 1000
+                timings["stages_ms"] = result["stages"]
+            timings["total_ms"] = (time.perf_counter() - start) * 1000
+            session.append("bot", reply)
+
+        return {
+            "response": reply,
+            "session_id": session.session_id,
+            "intent": parsed.get("intent") if parsed else None,
+            "slots": slots,
+            "goals": result.get("goals") if result else None,
+            "disaster_summary": result.get("disaster_summary") if result else None,
+            "timings": timings,
+        }
+
+    async def _respond(self, session: AgentSession, parsed: dict) -> tuple:
+        intent = parsed.get("intent")
+        if intent == "general_greeting":
+            name = parsed.get("name") or "User"
+            return f"👋 Hello {name}! Would you like to calculate goals for Q3 or Q4?\n{ASK_GOAL_FIELDS}", None
+        required = ("quarter", "goal", "min_territory_growth", "max_territory_growth")
+        if intent != "goal_calculation" or not all(parsed.get(k) is not None for k in required):
+            return parsed.get("suggestion") or ASK_GOAL_FIELDS, None
+
+        try:
+            baseline = coerce_baseline_period(parsed.get("baseline_period"))
+        except ValueError:
+            session.state.clear("baseline_period")
+            return BASELINE_PERIOD_ERROR, None
+        if parsed.get("product_weights") is None:
+            return parsed.get("suggestion") or ASK_WEIGHTS, None
+        if baseline is None:
+            return parsed.get("suggestion") or ASK_BASELINE, None
+
+        request = {
+            "goal": pd.to_numeric(parsed["goal"], errors="coerce"),
+            "min_growth": pd.to_numeric(parsed["min_territory_growth"], errors="coerce"),
+            "max_growth": pd.to_numeric(parsed["max_territory_growth"], errors="coerce"),
+            "product_weights": parsed["product_weights"],
+            "baseline_period": baseline,
+            "exclude_disaster_months": parsed.get("exclude_disaster_months"),
+            "dataset_path": session.dataset_path,
+        }
+        try:
+            result = await self.pool.run(run_goal_pipeline, request)
+        except ServiceBusy:
+            raise
+        except Exception as e:
+            return f"❌ Error during goal calculation: {e}", None
+
+        if result["status"] == "needs_exclusion":
+            return f"{ASK_EXCLUDE}\n\nSome territories show sales drops that match FEMA disaster declarations (see disaster_summary).", result
+        return _goal_summary(parsed, result), result
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "sessions": len(self.sessions),
+            "pool": self.pool.stats(),
+            "intent_extraction": get_intent_extractor().stats(),
+            "llm": get_llm_gateway().metrics.snapshot(),
+        }
+
+    def close(self):
+        self.pool.close()
+
+
+# ---------------------------------------------------------------------------
+# ASGI application
+# ---------------------------------------------------------------------------
+
+_service = None
+
+
+def get_agent_service() -> AgentService:
+    global _service
+    if _service is None:
+        _service = AgentService()
+    return _service
+
+
+async def _read_body(receive) -> bytes:
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise RequestError(400, "Client disconnected")
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > AGENT_MAX_BODY_BYTES:
+            raise RequestError(413, f"Request body larger than {AGENT_MAX_BODY_BYTES} bytes")
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _upload_dataset(content_type: str, body: bytes) -> dict:
+    # multipart "file" field, or the workbook bytes as the raw body
+    if content_type.split(";", 1)[0].strip().lower() == "multipart/form-data":
+        _, files = parse_form(content_type, body)
+        if "file" not in files:
+            raise RequestError(400, "Missing 'file' upload")
+        body = files["file"][1]
+    if not body:
+        raise RequestError(400, "Empty dataset upload")
+    existed = dataset_path(dataset_id_for(body)) is not None
+    dataset_id = await asyncio.to_thread(save_dataset, body)
+    return {"dataset_id": dataset_id, "bytes": len(body), "created": not existed}
+
+
+async def _send_json(send, status: int, payload: dict, headers: list = ()):
+    body = json.dumps(payload, default=str).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await get_agent_service().pool.warm()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _service is not None:
+                _service.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    ASGI entry point: POST /agent (form fields goal, session_id, dataset_id or file),
+    POST /datasets (upload a workbook once), GET /datasets/<id> and GET /health.
+    """
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    service = get_agent_service()
+    path, method = scope["path"].rstrip("/") or "/", scope["method"]
+    try:
+        if path == "/health" and method == "GET":
+            await _send_json(send, 200, service.stats())
+        elif path == "/agent" and method == "POST":
+            service.requests += 1
+            headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+            fields, files = parse_form(headers.get("content-type", ""), await _read_body(receive))
+            await _send_json(send, 200, await service.handle(fields, files))
+        elif path == "/datasets" and method == "POST":
+            headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+            await _send_json(send, 200, await _upload_dataset(headers.get("content-type", ""), await _read_body(receive)))
+        elif path.startswith("/datasets/") and method == "GET":
+            dataset_id = path[len("/datasets/"):]
+            stored = dataset_path(dataset_id)
+            if stored is None:
+                raise RequestError(404, f"Unknown dataset_id: {dataset_id}")
+            await _send_json(send, 200, {"dataset_id": dataset_id, "bytes": os.path.getsize(stored)})
+        elif path in ("/agent", "/health", "/datasets"):
+            await _send_json(send, 405, {"error": f"{method} not allowed"})
+        else:
+            await _send_json(send, 404, {"error": f"Not found: {path}"})
+    except RequestError as e:
+        service.errors += 1
+        await _send_json(send, e.status, {"error": str(e)})
+    except ServiceBusy as e:
+        service.errors += 1
+        await _send_json(send, 503, {"error": f"Service busy: {e}"}, [(b"retry-after", b"1")])
+    except Exception as e:
+        service.errors += 1
+        print(f"❌ Agent request failed: {e}")
+        await _send_json(send, 500, {"error": str(e)})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the goal-setting agent service (POST /agent).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,72 @@
+import hashlib
+import os
+import threading
+import numpy as np
 import pandas as pd
+from WorkbookCache import CACHE_DIR, file_fingerprint, read_excel_cached
+from TerritoryTable import R12_MONTHS, TerritoryTable, sales_column_products
+
+TARGET_MONTHS = R12_MONTHS
+
+
+def flag_low_zscores(values: np.ndarray, z_thresh: float = -2.0):
+    """
+    Flags values whose per-column z-score is below z_thresh.
+
+    Parameters:
+    - values: 2-D array of shape (territories, months)
+    - z_thresh: float, the z-score below which a value is flagged
+
+    Returns:
+    - (territory_idx, month_idx, z_scores) for the flagged cells, ordered month by month
+    """
+    mean = np.nanmean(values, axis=0)
+    std = np.nanstd(values, axis=0, ddof=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (values - mean) / std
+    month_idx, territory_idx = np.nonzero(z.T < z_thresh)
+    return territory_idx, month_idx, z[territory_idx, month_idx]
+
+
+def _as_territory_table(sales_df, products: list = None, months: list = None) -> TerritoryTable:
+    # Accept either a wide sales frame or an already-built TerritoryTable
+    if isinstance(sales_df, TerritoryTable):
+        return sales_df
+    return TerritoryTable.from_frame(sales_df, products=products, months=months)
+
+
+def detect_anomalies_wide(sales_df, product: str = "Product 1", months: list = None, z_thresh: float = -2.0) -> pd.DataFrame:
+    """
+    Detects low-sales anomalies for one product directly on the wide "{product} R12 {month}" block.
+
+    Parameters:
+    - sales_df: TerritoryTable, or wide pd.DataFrame with Territory, Territory Name and the R12 month columns
+    - product: product prefix of the sales columns (default "Product 1")
+    - months: months to scan (default Jan–Jun)
+    - z_thresh: float, the z-score below which a value is flagged as anomaly (default -2.0)
+
+    Returns:
+    - pd.DataFrame with ['Territory', 'Territory Name', 'Month', 'Sales', 'z_score'] for flagged cells only
+    """
+    months = list(months or TARGET_MONTHS)
+    table = _as_territory_table(sales_df, [product], months)
+
+    sales = table.product_matrix(product, months).astype(float)
+    territory_idx, month_idx, z_scores = flag_low_zscores(sales, z_thresh)
+    # Report sales in the source dtype (integer cartons stay integers)
+    flagged_sales = sales[territory_idx, month_idx]
+    if np.issubdtype(table.sales_dtype, np.integer):
+        flagged_sales = flagged_sales.astype(table.sales_dtype)
+
+    return pd.DataFrame({
+        "Territory": table.territory_ids.astype(np.int64)[territory_idx],
+        "Territory Name": table.territory_names(territory_idx),
+        "Month": np.asarray(months, dtype=object)[month_idx],
+        "Sales": flagged_sales,
+        "z_score": z_scores,
+    })
+
+
 def detect_product1_anomalies_dynamic(sales_df: pd.DataFrame, z_thresh: float = -2.0) -> pd.DataFrame:
     """
     Detects anomalies in Product 1 sales (Jan–Jun) using z-score thresholding.
@@ -10,87 +78,415 @@ def detect_product1_anomalies_dynamic(sales_df: pd.DataFrame, z_thresh: float =
     Returns:
     - pd.DataFrame with anomalies including z-score
     """
-    target_months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun"]
-    product1_cols = [f"Product 1 R12 {m}" for m in target_months]
-
-    # Check for missing columns
-    missing = [col for col in product1_cols if col not in sales_df.columns]
-    if missing:
-        raise ValueError(f"Missing columns: {missing}")
-    
-    # Melt to long format
-    df_long = sales_df.melt(
-        id_vars=["Territory", "Territory Name"],
-        value_vars=product1_cols,
-        var_name="Month",
-        value_name="Sales"
-    )
-    df_long["Month"] = df_long["Month"].str.extract(r'R12 (\w+)', expand=False)
-
-    # Compute z-scores by month
-    stats = df_long.groupby("Month")["Sales"].agg(["mean", "std"]).reset_index()
-    df_merged = df_long.merge(stats, on="Month")
-    df_merged["z_score"] = (df_merged["Sales"] - df_merged["mean"]) / df_merged["std"]
-
-    # Flag anomalies below z-score threshold
-    anomalies = df_merged[df_merged["z_score"] < z_thresh].copy()
-    anomalies = anomalies[["Territory", "Territory Name", "Month", "Sales", "z_score"]].reset_index(drop=True)
-    
-    return anomalies
-
-def cross_verify_anomalies_with_fema(anomalies_df: pd.DataFrame, fema_df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Matches anomalies to FEMA disasters by comparing territory and month.
+    return detect_anomalies_wide(sales_df, "Product 1", TARGET_MONTHS, z_thresh)
+
+def sales_products(sales_df) -> list:
+    """
+    Returns the product prefixes that have "{product} R12 {month}" columns, in column order.
+    """
+    if isinstance(sales_df, TerritoryTable):
+        return list(sales_df.products)
+    return sales_column_products(sales_df.columns)
+
+
+def build_sales_cube(sales_df, products: list = None, months: list = None) -> np.ndarray:
+    """
+    Returns the R12 month sales as one float array of shape (products, territories, months).
+    """
+    products = list(products or sales_products(sales_df))
+    months = list(months or TARGET_MONTHS)
+    table = _as_territory_table(sales_df, products, months)
+    return np.stack([table.product_matrix(product, months) for product in products]).astype(float)
+
+
+def _scaled(deviation: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    # A flat series has zero spread: leave it unscored (NaN) instead of dividing by zero
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(scale > 0, deviation / scale, np.nan)
+
+
+def _zscore_scores(cube: np.ndarray) -> np.ndarray:
+    # Each month against all territories in that month
+    mean = np.nanmean(cube, axis=1, keepdims=True)
+    std = np.nanstd(cube, axis=1, ddof=1, keepdims=True)
+    return _scaled(cube - mean, std)
+
+
+def _rolling_zscore_scores(cube: np.ndarray, window: int = 3) -> np.ndarray:
+    # Each month against the trailing `window` months of the same territory
+    padded = np.concatenate([np.zeros(cube.shape[:2] + (1,)), cube], axis=2)
+    csum = np.cumsum(padded, axis=2)
+    csum_sq = np.cumsum(padded ** 2, axis=2)
+    scores = np.full(cube.shape, np.nan)
+    if cube.shape[2] <= window:
+        return scores
+    total = csum[:, :, window:-1] - csum[:, :, :-window - 1]
+    total_sq = csum_sq[:, :, window:-1] - csum_sq[:, :, :-window - 1]
+    mean = total / window
+    std = np.sqrt(np.maximum(total_sq - window * mean ** 2, 0) / (window - 1))
+    scores[:, :, window:] = _scaled(cube[:, :, window:] - mean, std)
+    return scores
+
+
+def _mad_scores(cube: np.ndarray) -> np.ndarray:
+    # Robust z-score per territory: distance from the median in scaled MADs
+    median = np.nanmedian(cube, axis=2, keepdims=True)
+    mad = np.nanmedian(np.abs(cube - median), axis=2, keepdims=True) * 1.4826
+    return _scaled(cube - median, mad)
+
+
+def _seasonal_scores(cube: np.ndarray) -> np.ndarray:
+    # Additive territory level + month (seasonal) effect; score the standardized residual
+    territory_level = np.nanmean(cube, axis=2, keepdims=True)
+    month_effect = np.nanmean(cube, axis=1, keepdims=True)
+    grand_mean = np.nanmean(cube, axis=(1, 2), keepdims=True)
+    residual = cube - territory_level - month_effect + grand_mean
+    return _scaled(residual, np.nanstd(residual, axis=(1, 2), ddof=1, keepdims=True))
+
+
+def _iqr_scores(cube: np.ndarray) -> np.ndarray:
+    # Distance below the territory's first quartile, in IQRs (Tukey fence at -1.5)
+    # np.nanpercentile loops per territory, so only use it when there are gaps
+    percentile = np.nanpercentile if np.isnan(cube).any() else np.percentile
+    q1, q3 = percentile(cube, [25, 75], axis=2, keepdims=True)
+    return _scaled(cube - q1, q3 - q1)
+
+
+# name -> (score function, default threshold); a cell is flagged when its score is below the threshold
+ANOMALY_DETECTORS = {
+    "zscore": (_zscore_scores, -2.0),
+    "rolling_zscore": (_rolling_zscore_scores, -2.0),
+    "mad": (_mad_scores, -3.0),
+    "seasonal": (_seasonal_scores, -2.0),
+    "iqr": (_iqr_scores, -1.5),
+}
+
+ANOMALY_RESULT_COLUMNS = ["Detector", "Product", "Territory", "Territory Name", "Month", "Sales", "Score"]
+
+
+def run_anomaly_engine(sales_df, detectors: list = None, products: list = None, months: list = None, thresholds: dict = None) -> pd.DataFrame:
+    """
+    Runs one or more vectorized anomaly detectors over every product in a single pass.
+
+    Parameters:
+    - sales_df: TerritoryTable, or wide pd.DataFrame with Territory, Territory Name and "{product} R12 {month}" columns
+    - detectors: names from ANOMALY_DETECTORS (default: all)
+    - products: product prefixes to scan (default: every product found in sales_df)
+    - months: months to scan (default Jan–Jun)
+    - thresholds: optional {detector name: threshold} overriding the defaults
+
+    Returns:
+    - pd.DataFrame with ANOMALY_RESULT_COLUMNS, one row per flagged (detector, product, territory, month)
+    """
+    detectors = list(detectors or ANOMALY_DETECTORS)
+    unknown = [name for name in detectors if name not in ANOMALY_DETECTORS]
+    if unknown:
+        raise ValueError(f"Unknown anomaly detectors: {unknown}. Available: {list(ANOMALY_DETECTORS)}")
+
+    products = list(products or sales_products(sales_df))
+    months = list(months or TARGET_MONTHS)
+    thresholds = thresholds or {}
+    table = _as_territory_table(sales_df, products, months)
+    cube = build_sales_cube(table, products, months)
+
+    territories = table.territory_ids.astype(np.int64)
+    territory_names = table.territory_names()
+    products_arr = np.asarray(products, dtype=object)
+    months_arr = np.asarray(months, dtype=object)
+
+    frames = []
+    for name in detectors:
+        score_fn, default_threshold = ANOMALY_DETECTORS[name]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = score_fn(cube)
+        product_idx, territory_idx, month_idx = np.nonzero(scores < thresholds.get(name, default_threshold))
+        frames.append(pd.DataFrame({
+            "Detector": name,
+            "Product": products_arr[product_idx],
+            "Territory": territories[territory_idx],
+            "Territory Name": territory_names[territory_idx],
+            "Month": months_arr[month_idx],
+            "Sales": cube[product_idx, territory_idx, month_idx],
+            "Score": scores[product_idx, territory_idx, month_idx],
+        }))
+
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=ANOMALY_RESULT_COLUMNS)
+
+
+MONTH_NAMES = {
+    "Jan": "January", "Feb": "February", "Mar": "March",
+    "Apr": "April", "May": "May", "Jun": "June",
+    "Jul": "July", "Aug": "August", "Sep": "September",
+    "Oct": "October", "Nov": "November", "Dec": "December"
+}
+MONTH_NUMBERS = {abbr: i for i, abbr in enumerate(MONTH_NAMES, start=1)}
+
+
+class FemaIndex:
+    """
+    FEMA incidents indexed by territory as sorted [begin, end] day intervals.
+
+    Incidents are sorted by (territory, begin date) and addressed through one composite
+    int64 key, so overlap lookups for any number of (territory, period) queries are two
+    searchsorted calls plus a vectorized filter.
+    """
+    __slots__ = ("territories", "begin", "end", "incident_type", "title", "max_duration", "_unique_territories", "_keys")
+
+    # Composite key = territory rank * _SPAN + days since _EPOCH_DAY
+    _EPOCH_DAY = np.datetime64("1900-01-01", "D").astype(np.int64)
+    _SPAN = 1 << 20
+
+    def __init__(self, territories, begin, end, incident_type, title):
+        self.territories = np.asarray(territories, dtype=np.int64)
+        self.begin = np.asarray(begin, dtype="datetime64[D]")
+        self.end = np.asarray(end, dtype="datetime64[D]")
+        self.incident_type = np.asarray(incident_type, dtype=str)
+        self.title = np.asarray(title, dtype=str)
+        self.max_duration = int((self.end - self.begin).astype(np.int64).max()) if len(self.begin) else 0
+        self._unique_territories = np.unique(self.territories)
+        self._keys = self._key(self.territories, self.begin)
+
+    def _key(self, territories: np.ndarray, days: np.ndarray) -> np.ndarray:
+        rank = np.searchsorted(self._unique_territories, territories)
+        offset = np.clip(days.astype("datetime64[D]").astype(np.int64) - self._EPOCH_DAY, 0, self._SPAN - 1)
+        return rank.astype(np.int64) * self._SPAN + offset
+
+    @classmethod
+    def from_frame(cls, fema_df: pd.DataFrame) -> "FemaIndex":
+        """
+        Builds the index from the FEMA sheet (['TS Territory ID', 'IncidentBeginDate',
+        'IncidentEndDate', 'IncidentType', 'DeclarationTitle']). ZIP-level duplicates are dropped.
+        """
+        incidents = pd.DataFrame({
+            "territory": pd.to_numeric(fema_df["TS Territory ID"], errors="coerce"),
+            "begin": pd.to_datetime(fema_df["IncidentBeginDate"], errors="coerce"),
+            "end": pd.to_datetime(fema_df["IncidentEndDate"], errors="coerce"),
+            "type": fema_df["IncidentType"].fillna("Unknown").astype(str),
+            "title": fema_df["DeclarationTitle"].fillna("Unknown").astype(str),
+        }).dropna(subset=["territory", "begin"])
+        incidents["end"] = incidents["end"].fillna(incidents["begin"])
+        incidents = incidents.drop_duplicates().sort_values(["territory", "begin"], kind="stable")
+
+        return cls(
+            incidents["territory"].to_numpy(dtype=np.int64),
+            incidents["begin"].to_numpy(dtype="datetime64[D]"),
+            incidents["end"].to_numpy(dtype="datetime64[D]"),
+            incidents["type"].to_numpy(),
+            incidents["title"].to_numpy(),
+        )
+
+    def save(self, path: str):
+        np.savez(path, territories=self.territories, begin=self.begin, end=self.end,
+                 incident_type=self.incident_type, title=self.title)
+
+    @classmethod
+    def load(cls, path: str) -> "FemaIndex":
+        with np.load(path) as data:
+            return cls(data["territories"], data["begin"], data["end"], data["incident_type"], data["title"])
+
+    def __len__(self):
+        return len(self.territories)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.territories, self.begin, self.end, self.incident_type, self.title, self._keys))
+
+    @staticmethod
+    def _no_overlaps() -> pd.DataFrame:
+        return pd.DataFrame({
+            "IncidentBeginDate": pd.Series(dtype="datetime64[ns]"),
+            "IncidentEndDate": pd.Series(dtype="datetime64[ns]"),
+            "IncidentType": pd.Series(dtype=object),
+            "DeclarationTitle": pd.Series(dtype=object),
+        })
+
+    def overlaps(self, territories, period_start, period_end) -> pd.DataFrame:
+        """
+        Finds incidents overlapping each query period.
+
+        Parameters:
+        - territories: territory ID per query
+        - period_start / period_end: inclusive datetime64 bounds per query
+
+        Returns:
+        - pd.DataFrame indexed by query position with IncidentBeginDate (earliest), IncidentEndDate
+          (latest), IncidentType and DeclarationTitle (of the earliest incident); queries without
+          an overlapping incident are omitted
+        """
+        territories = np.asarray(territories, dtype=np.int64)
+        period_start = np.asarray(period_start, dtype="datetime64[D]")
+        period_end = np.asarray(period_end, dtype="datetime64[D]")
+
+        queries = np.flatnonzero(np.isin(territories, self._unique_territories))
+        if len(queries) == 0:
+            return self._no_overlaps()
+
+        # Candidates begin within [period_start - longest incident, period_end]
+        lo = np.searchsorted(self._keys, self._key(territories[queries], period_start[queries] - self.max_duration), "left")
+        hi = np.searchsorted(self._keys, self._key(territories[queries], period_end[queries]), "right")
+        counts = hi - lo
+        query_of = np.repeat(queries, counts)
+        candidate = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+        hit = self.end[candidate] >= period_start[query_of]
+        query_of, candidate = query_of[hit], candidate[hit]
+        if len(candidate) == 0:
+            return self._no_overlaps()
+
+        # Candidates are sorted by begin within a query, so the first one is the earliest
+        first_queries, first = np.unique(query_of, return_index=True)
+        latest_end = pd.Series(self.end[candidate]).groupby(query_of).max().to_numpy()
+
+        return pd.DataFrame({
+            "IncidentBeginDate": pd.to_datetime(self.begin[candidate[first]]),
+            "IncidentEndDate": pd.to_datetime(latest_end),
+            "IncidentType": self.incident_type[candidate[first]],
+            "DeclarationTitle": self.title[candidate[first]],
+        }, index=first_queries)
+
+
+_fema_index_lock = threading.Lock()
+_fema_indexes = {}
+
+
+def load_fema_index(fema_file_path: str, sheet_name: str = "2025_ZIP_to_Territory") -> FemaIndex:
+    """
+    Returns the FemaIndex for a FEMA workbook, built once per file version.
+
+    The index is kept in memory and persisted next to the workbook cache, so new
+    processes load it without parsing the workbook.
+    """
+    content_hash = file_fingerprint(fema_file_path)
+    key = (os.path.abspath(fema_file_path), sheet_name, content_hash)
+    with _fema_index_lock:
+        if key in _fema_indexes:
+            return _fema_indexes[key]
+
+    sheet_slot = hashlib.sha1(sheet_name.encode("utf-8")).hexdigest()[:8]
+    index_path = os.path.join(CACHE_DIR, f"fema-index-{content_hash[:16]}-{sheet_slot}.npz")
+    index = None
+    if os.path.exists(index_path):
+        try:
+            index = FemaIndex.load(index_path)
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable FEMA index {index_path}: {e}")
+    if index is None:
+        index = FemaIndex.from_frame(read_excel_cached(fema_file_path, sheet_name=sheet_name))
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            index.save(index_path)
+        except Exception as e:
+            print(f"⚠️ Could not persist FEMA index: {e}")
+
+    with _fema_index_lock:
+        _fema_indexes[key] = index
+    return index
+
+
+def cross_verify_anomalies_with_fema(anomalies_df: pd.DataFrame, fema_df, year: int = None) -> pd.DataFrame:
+    """
+    Matches anomalies to FEMA disasters whose incident period overlaps the anomaly month.
 
     Parameters:
     - anomalies_df: DataFrame with at least ['Territory', 'Territory Name', 'Month', 'Sales', 'z_score']
-    - fema_df: FEMA DataFrame with at least ['TS Territory ID', 'IncidentBeginDate', 'IncidentEndDate', 'IncidentType', 'DeclarationTitle']
+    - fema_df: FemaIndex (preferred, see load_fema_index) or the FEMA DataFrame with at least
+      ['TS Territory ID', 'IncidentBeginDate', 'IncidentEndDate', 'IncidentType', 'DeclarationTitle']
+    - year: calendar year of the anomaly months (default: year of the latest FEMA incident)
 
     Returns:
     - pd.DataFrame with FEMA match results and a 'Disaster Match' flag
     """
+    fema_index = fema_df if isinstance(fema_df, FemaIndex) else FemaIndex.from_frame(fema_df)
+    if year is None:
+        year = int(fema_index.begin.max().astype("datetime64[Y]").astype(int) + 1970) if len(fema_index) else pd.Timestamp.now().year
+
+    merged = anomalies_df.reset_index(drop=True)
+    merged["IncidentMonth"] = merged["Month"].map(MONTH_NAMES)
+
+    # Anomaly month as an inclusive day interval
+    month_start = pd.to_datetime({
+        "year": year, "month": merged["Month"].map(MONTH_NUMBERS), "day": 1
+    }).to_numpy(dtype="datetime64[D]")
+    month_end = (month_start.astype("datetime64[M]") + 1).astype("datetime64[D]") - 1
+
+    matches = fema_index.overlaps(merged["Territory"].to_numpy(), month_start, month_end)
+    merged = merged.join(matches)
 
-    # 1. Normalize month format in anomalies
-    month_map = {
-        "Jan": "January", "Feb": "February", "Mar": "March",
-        "Apr": "April", "May": "May", "Jun": "June",
-        "Jul": "July", "Aug": "August", "Sep": "September",
-        "Oct": "October", "Nov": "November", "Dec": "December"
-    }
-    anomalies_df = anomalies_df.copy()
-    anomalies_df["IncidentMonth"] = anomalies_df["Month"].map(month_map)
-
-    # 2. Prepare FEMA data
-    fema_df = fema_df.copy()
-    fema_df["IncidentBeginDate"] = pd.to_datetime(fema_df["IncidentBeginDate"], errors="coerce")
-    fema_df["IncidentEndDate"] = pd.to_datetime(fema_df["IncidentEndDate"], errors="coerce")
-    fema_df["IncidentMonth"] = fema_df["IncidentBeginDate"].dt.strftime("%B")
-    fema_df["TS Territory ID"] = pd.to_numeric(fema_df["TS Territory ID"], errors="coerce").astype("Int64")
-
-    # 3. Group FEMA incidents by Territory and Month, and get min/max dates + type/title
-    fema_grouped = fema_df.groupby(["TS Territory ID", "IncidentMonth"]).agg({
-        "IncidentBeginDate": "min",
-        "IncidentEndDate": "max",
-        "IncidentType":"first",
-        "DeclarationTitle":"first"
-    }).reset_index()
-
-    # 4. Merge with anomalies
-    merged = anomalies_df.merge(
-        fema_grouped,
-        how="left",
-        left_on=["Territory", "IncidentMonth"],
-        right_on=["TS Territory ID", "IncidentMonth"]
-    )
-
-    # 5. Flag match
     merged["Disaster Match"] = ~merged["IncidentType"].isna()
+    merged["TS Territory ID"] = merged["Territory"].astype("Int64").where(merged["Disaster Match"])
     merged.drop_duplicates(inplace=True)
     merged["DisasterDuration"] = (merged["IncidentEndDate"] - merged["IncidentBeginDate"]).dt.days
     merged = merged[merged["DisasterDuration"] > 12]
 
     return merged
-def format_disaster_impact_summary_html(verified_anomalies_df: pd.DataFrame, sales_df: pd.DataFrame) -> str:
+
+
+_DISASTER_SUMMARY_HEADER = """
+    <div style='
+        display: flex;
+        align-items: flex-start;
+        background-color: #fff8dc;
+        border-radius: 2rem;
+        padding: 1rem 1.5rem;
+        max-width: 100%;
+        margin: 1rem 0;
+    '>
+        
+        <div>
+            <p>⚠️ <strong>While analyzing your sales data, we detected FEMA-confirmed disasters that likely impacted performance.</strong></p>
+            <h4>🧾 Impact Summary:</h4>
+    """
+
+_DISASTER_SUMMARY_ITEM = """
+            <div style='margin-bottom: 1.2rem; padding-left: 1rem;'>
+                <p><strong>📍 Territory:</strong> {territory_name}</p>
+                <ul style='margin: 0.2rem 0 0.2rem 1rem;'>
+                    <li>📅 <strong>Month:</strong> {month}</li>
+                    <li>🎯 <strong>Anomalous Goal:</strong> {anomalous}</li>
+                    <li>📊 <strong>Average of Other Months:</strong> {avg_other:.1f}</li>
+                    <li>📉 <strong>Drop from Trend:</strong> {drop_units:.1f} units (⬇️ {drop_pct})</li>
+                    <li>🌪️ <strong>Disaster Impact:</strong> {disaster}</li>
+                    <li>🗓️ <strong>Disaster Period:</strong> {begin}–{end}</li>
+                </ul>
+                <p style='margin-top: 0.5rem;'>📊 <em>We may exclude {month} from baseline calculations to ensure fair, achievable goals.</em></p>
+            </div>
+        """
+
+_DISASTER_SUMMARY_FOOTER = """
+            <hr style='margin: 1.5rem 0;' />
+            <p><strong>✅ Would you like to exclude these disaster-affected months ({joined_months}) from the baseline to proceed with a fair goal calculation?</strong></p>
+        </div>
+    </div>
+    """
+
+
+def peer_month_average(sales_df, territories, months, product: str = "Product 1", all_months: list = None) -> np.ndarray:
+    """
+    Average sales of each territory over all other months, for many (territory, month) pairs at once.
+
+    Uses total-minus-self over the (territories x months) sales matrix instead of filtering per pair.
+    Pairs with an unknown territory or month get NaN.
+    """
+    all_months = list(all_months or TARGET_MONTHS)
+    table = _as_territory_table(sales_df, [product], all_months)
+    values = table.product_matrix(product, all_months).astype(float)
+    row = table.rows_for(territories)
+    col = pd.Index(all_months).get_indexer(months)
+    known = (row >= 0) & (col >= 0)
+    if not len(table):
+        return np.full(len(row), np.nan)
+    # -1 would wrap to the last territory / month: index a valid cell and mask the result
+    row, col = np.where(known, row, 0), np.where(known, col, 0)
+
+    totals = np.nansum(values, axis=1)
+    counts = np.sum(~np.isnan(values), axis=1)
+    own = values[row, col]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        average = (totals[row] - np.nan_to_num(own)) / (counts[row] - ~np.isnan(own))
+    return np.where(known, average, np.nan)
+
+
+def format_disaster_impact_summary_html(verified_anomalies_df: pd.DataFrame, sales_df) -> str:
     """
     Generate a detailed HTML summary of anomalies with disaster impact,
     inside a fully-rounded, oval-styled container consistent with bot messages.
@@ -126,80 +522,33 @@ def format_disaster_impact_summary_html(verified_anomalies_df: pd.DataFrame, sal
         </div>
         """
 
-    # Melt sales data into long format
-    target_months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun"]
-    product1_cols = [f"Product 1 R12 {m}" for m in target_months]
-
-    df_long = sales_df.melt(
-        id_vars=["Territory", "Territory Name"],
-        value_vars=product1_cols,
-        var_name="Month",
-        value_name="Sales"
-    )
-    df_long["Month"] = df_long["Month"].str.extract(r'R12 (\w+)', expand=False)
-
-    # Message container with fully rounded edge
-    message = """
-    <div style='
-        display: flex;
-        align-items: flex-start;
-        background-color: #fff8dc;
-        border-radius: 2rem;
-        padding: 1rem 1.5rem;
-        max-width: 100%;
-        margin: 1rem 0;
-    '>
-        
-        <div>
-            <p>⚠️ <strong>While analyzing your sales data, we detected FEMA-confirmed disasters that likely impacted performance.</strong></p>
-            <h4>🧾 Impact Summary:</h4>
-    """
+    # Peer-month average, drop units and drop percent for every row in one pass
+    anomalous = disaster_rows["Sales"].to_numpy()
+    avg_other = peer_month_average(sales_df, disaster_rows["Territory"], disaster_rows["Month"])
+    drop_units = anomalous - avg_other
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drop_pct = np.where(avg_other > 0, drop_units / avg_other * 100, np.nan)
 
-    impacted_months = []
+    begin = pd.to_datetime(disaster_rows["IncidentBeginDate"]).dt.strftime("%B %d").fillna("Unknown")
+    end = pd.to_datetime(disaster_rows["IncidentEndDate"]).dt.strftime("%d, %Y").fillna("Unknown")
+    incident_type = disaster_rows.get("IncidentType", pd.Series("Unknown", index=disaster_rows.index)).fillna("Unknown")
+    title = disaster_rows.get("DeclarationTitle", pd.Series("Unknown", index=disaster_rows.index)).fillna("Unknown")
+    disaster = (incident_type.astype(str) + " — " + title.astype(str)).to_numpy()
 
-    for _, row in disaster_rows.iterrows():
-        territory = row["Territory"]
-        territory_name = row["Territory Name"]
-        month = row["Month"]
-        anomalous = row["Sales"]
-
-        peer_sales = df_long[
-            (df_long["Territory"] == territory) & (df_long["Month"] != month)
-        ]["Sales"]
-        avg_other = peer_sales.mean()
-        drop_units = anomalous - avg_other
-        drop_pct = (drop_units / avg_other * 100) if avg_other > 0 else None
-
-        disaster = f"{row.get('IncidentType', 'Unknown')} — {row.get('DeclarationTitle', 'Unknown')}"
-        begin = pd.to_datetime(row.get("IncidentBeginDate")).strftime("%B %d") if pd.notnull(row.get("IncidentBeginDate")) else "Unknown"
-        end = pd.to_datetime(row.get("IncidentEndDate")).strftime("%d, %Y") if pd.notnull(row.get("IncidentEndDate")) else "Unknown"
-
-        message += f"""
-            <div style='margin-bottom: 1.2rem; padding-left: 1rem;'>
-                <p><strong>📍 Territory:</strong> {territory_name}</p>
-                <ul style='margin: 0.2rem 0 0.2rem 1rem;'>
-                    <li>📅 <strong>Month:</strong> {month}</li>
-                    <li>🎯 <strong>Anomalous Goal:</strong> {anomalous}</li>
-                    <li>📊 <strong>Average of Other Months:</strong> {avg_other:.1f}</li>
-                    <li>📉 <strong>Drop from Trend:</strong> {drop_units:.1f} units (⬇️ {drop_pct:.1f}%)</li>
-                    <li>🌪️ <strong>Disaster Impact:</strong> {disaster}</li>
-                    <li>🗓️ <strong>Disaster Period:</strong> {begin}–{end}</li>
-                </ul>
-                <p style='margin-top: 0.5rem;'>📊 <em>We may exclude {month} from baseline calculations to ensure fair, achievable goals.</em></p>
-            </div>
-        """
-
-        impacted_months.append(month)
-
-    joined_months = ", ".join(sorted(set(impacted_months)))
-    message += f"""
-            <hr style='margin: 1.5rem 0;' />
-            <p><strong>✅ Would you like to exclude these disaster-affected months ({joined_months}) from the baseline to proceed with a fair goal calculation?</strong></p>
-        </div>
-    </div>
-    """
+    items = [
+        _DISASTER_SUMMARY_ITEM.format(
+            territory_name=name, month=month, anomalous=sales, avg_other=avg, drop_units=drop,
+            drop_pct=f"{pct:.1f}%" if not np.isnan(pct) else "n/a",
+            disaster=impact, begin=b, end=e,
+        )
+        for name, month, sales, avg, drop, pct, impact, b, e in zip(
+            disaster_rows["Territory Name"], disaster_rows["Month"], anomalous, avg_other, drop_units,
+            drop_pct, disaster, begin, end
+        )
+    ]
 
-    return message
+    joined_months = ", ".join(sorted(set(disaster_rows["Month"])))
+    return "".join([_DISASTER_SUMMARY_HEADER, *items, _DISASTER_SUMMARY_FOOTER.format(joined_months=joined_months)])
 
 
 
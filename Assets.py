@@ -0,0 +1,143 @@
+import base64
+import mimetypes
+import os
+import threading
+from dataclasses import dataclass
+from WorkbookCache import file_fingerprint
+
+STATIC_DIR = "static"
+STATIC_URL_PREFIX = "app/static"
+ASSET_PREFIX = "asset:"
+
+# DQ images shown in the chat, with the caption rendered above each
+IMAGE_CAPTIONS = {
+    "TimeSeriesDia.png": "<p><strong>📈 DQ Summary Visual:</strong> Here's a recent trend analysis for Brand2.</p>",
+    "UnknownUnknown.png": "",
+}
+
+IMAGE_MESSAGE_TEMPLATE = """
+<div class="bot-msg">
+    <div>
+        {caption}<img src="{src}" width="1000" style="border-radius:10px; margin-top:10px;" />
+    </div>
+</div>
+"""
+
+
+@dataclass(frozen=True)
+class Asset:
+    """
+    A static file loaded once per process.
+
+    - digest: content hash; static_name embeds it, so published URLs never go stale
+    - base64: encoded contents, for data URIs when static serving is off
+    """
+    path: str
+    content_type: str
+    digest: str
+    base64: str
+
+    @property
+    def static_name(self) -> str:
+        stem, extension = os.path.splitext(os.path.basename(self.path))
+        return f"{stem}-{self.digest[:12]}{extension}"
+
+    @property
+    def data_uri(self) -> str:
+        return f"data:{self.content_type};base64,{self.base64}"
+
+
+_asset_lock = threading.Lock()
+_assets = {}
+_image_html = {}
+
+
+def load_asset(path: str) -> Asset:
+    """
+    Returns the Asset for path, reading and encoding the file only when its contents change.
+    """
+    key = (os.path.abspath(path), file_fingerprint(path))
+    with _asset_lock:
+        asset = _assets.get(key[0])
+        if asset is not None and asset.digest == key[1]:
+            return asset
+
+    with open(path, "rb") as f:
+        encoded = base64.b64encode(f.read()).decode("utf-8")
+    asset = Asset(
+        path=path,
+        content_type=mimetypes.guess_type(path)[0] or "application/octet-stream",
+        digest=key[1],
+        base64=encoded,
+    )
+    with _asset_lock:
+        _assets[key[0]] = asset
+    return asset
+
+
+def static_serving_enabled() -> bool:
+    try:
+        import streamlit as st
+        return bool(st.get_option("server.enableStaticServing"))
+    except Exception:
+        return False
+
+
+def publish_static(asset: Asset, static_dir: str = STATIC_DIR) -> str:
+    """
+    Copies the asset to static_dir under its content-addressed name (once) and returns
+    its URL. Streamlit serves the folder with ETag and Last-Modified headers.
+    """
+    target = os.path.join(static_dir, asset.static_name)
+    if not os.path.exists(target):
+        os.makedirs(static_dir, exist_ok=True)
+        stem, extension = os.path.splitext(os.path.basename(asset.path))
+        # Drop earlier versions of the same file
+        for name in os.listdir(static_dir):
+            if name.startswith(f"{stem}-") and name.endswith(extension):
+                os.remove(os.path.join(static_dir, name))
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(base64.b64decode(asset.base64))
+        os.replace(tmp_path, target)
+    return f"{STATIC_URL_PREFIX}/{asset.static_name}"
+
+
+def asset_src(path: str) -> str:
+    """
+    Returns an img src for path: a static URL when Streamlit static serving is enabled,
+    otherwise the process-wide data URI.
+    """
+    asset = load_asset(path)
+    if static_serving_enabled():
+        return publish_static(asset)
+    return asset.data_uri
+
+
+def image_reference(path: str) -> str:
+    """
+    The value stored in st.session_state.messages for an image message.
+    """
+    return f"{ASSET_PREFIX}{path}"
+
+
+def is_asset_reference(message: str) -> bool:
+    return isinstance(message, str) and message.startswith(ASSET_PREFIX)
+
+
+def image_message_html(reference: str) -> str:
+    """
+    Resolves an image reference to its chat HTML. The string is built once per asset
+    version and shared by every session.
+    """
+    path = reference[len(ASSET_PREFIX):]
+    src = asset_src(path)
+    key = (path, src)
+    with _asset_lock:
+        cached = _image_html.get(key)
+    if cached is None:
+        caption = IMAGE_CAPTIONS.get(os.path.basename(path), "")
+        cached = IMAGE_MESSAGE_TEMPLATE.format(caption=f"{caption}\n        " if caption else "", src=src)
+        with _asset_lock:
+            _image_html[key] = cached
+    return cached
@@ -0,0 +1,296 @@
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from WorkbookCache import WorkbookLoader
+from Anomaly import ANOMALY_DETECTORS, TARGET_MONTHS, detect_anomalies_wide, format_disaster_impact_summary_html, run_anomaly_engine
+from GoalCalculationN import GoalBaseline, calculate_goals_batch, solve_capped_allocation
+from TerritoryTable import TerritoryTable
+from Pipeline import build_goal_pipeline
+
+GOAL_DATA_PATH = "Goal Setting sanitized Data.xlsx"
+
+
+def _best_of(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def benchmark_workbook_loader(sales_file_path: str = GOAL_DATA_PATH, repeats: int = 3) -> pd.DataFrame:
+    """
+    Compares the per-request workbook reads of the goal path against a shared WorkbookLoader.
+
+    Returns:
+    - pd.DataFrame with the best wall time (seconds) per strategy
+    """
+    def repeated_read_excel():
+        # Mirrors the anomaly step, calculate_goals and previous_quarter_sales
+        pd.read_excel(sales_file_path, sheet_name='Input Sales_Anomaly_Introduced')
+        pd.read_excel(sales_file_path, sheet_name='Input Sales_Anomaly_Introduced')
+        pd.read_excel(sales_file_path, sheet_name='1c. Inputs - Mappings', skiprows=5, usecols="C:D")
+        pd.read_excel(sales_file_path, sheet_name='Input Sales')
+
+    def shared_loader(use_cache):
+        def run():
+            with WorkbookLoader(sales_file_path, use_cache=use_cache) as loader:
+                loader.read('Input Sales_Anomaly_Introduced')
+                loader.read('Input Sales_Anomaly_Introduced')
+                loader.read('1c. Inputs - Mappings', skiprows=5, usecols="C:D")
+                loader.read('Input Sales')
+        return run
+
+    shared_loader(True)()  # warm the on-disk cache
+    results = [
+        ("repeated pd.read_excel", _best_of(repeated_read_excel, repeats)),
+        ("WorkbookLoader (single open, no cache)", _best_of(shared_loader(False), repeats)),
+        ("WorkbookLoader (warm cache)", _best_of(shared_loader(True), repeats)),
+    ]
+    return pd.DataFrame(results, columns=["Strategy", "Seconds"])
+
+
+def synthetic_goal_baseline(n_territories: int, seed: int = 0) -> GoalBaseline:
+    """
+    Builds a GoalBaseline with random R12 totals for benchmarking at scale.
+    """
+    rng = np.random.default_rng(seed)
+    totals = rng.gamma(shape=4.0, scale=120.0, size=(3, n_territories))
+    frame = pd.DataFrame({"Territory": np.arange(n_territories), "Baseline Goal": totals[0] / 2})
+    product_indexes = {
+        product: np.round(totals[i] / totals[i].sum() * 100, 1)
+        for i, product in enumerate(["Product 2", "Product 3"], start=1)
+    }
+    return GoalBaseline(
+        frame=frame,
+        baseline_goal=totals[0] / 2,
+        product_indexes=product_indexes,
+        products=("Product 1", "Product 2", "Product 3"),
+    )
+
+
+def benchmark_goal_scenarios(n_scenarios: int = 10_000, n_territories: int = 2_000) -> pd.DataFrame:
+    """
+    Measures calculate_goals_batch throughput over a random scenario sweep.
+    """
+    baseline = synthetic_goal_baseline(n_territories)
+    rng = np.random.default_rng(1)
+    baseline_total = baseline.baseline_goal.sum()
+    national_goals = baseline_total * rng.uniform(0.95, 1.15, n_scenarios)
+    min_growths = rng.uniform(0.0, 1.0, n_scenarios)
+    max_growths = min_growths + rng.uniform(0.5, 2.0, n_scenarios)
+    product_2 = rng.integers(0, 101, n_scenarios)
+    weights = np.column_stack([product_2, 100 - product_2])
+
+    seconds = _best_of(lambda: calculate_goals_batch(baseline, national_goals, min_growths, max_growths, weights), 1)
+    return pd.DataFrame([{
+        "Scenarios": n_scenarios,
+        "Territories": n_territories,
+        "Seconds": seconds,
+        "Scenarios/s": n_scenarios / seconds,
+    }])
+
+
+def benchmark_capped_allocation(sizes=(10_000, 30_000, 100_000), repeats: int = 3) -> pd.DataFrame:
+    """
+    Measures solve_capped_allocation at increasing territory counts; time per territory
+    should stay flat if the solver scales linearly.
+    """
+    rows = []
+    for n_territories in sizes:
+        rng = np.random.default_rng(n_territories)
+        baseline = rng.gamma(shape=4.0, scale=60.0, size=n_territories)
+        preliminary = baseline * rng.uniform(0.8, 1.4, n_territories)
+        lower, upper = baseline * 1.01, baseline * 1.10
+        total = baseline.sum() * 1.05
+
+        result = solve_capped_allocation(preliminary, lower, upper, total)
+        seconds = _best_of(lambda: solve_capped_allocation(preliminary, lower, upper, total), repeats)
+        rows.append({
+            "Territories": n_territories,
+            "Seconds": seconds,
+            "us/territory": seconds / n_territories * 1e6,
+            "Iterations": int(result.iterations[0]),
+            "Converged": bool(result.converged[0]),
+            "Residual": float(result.residual[0]),
+        })
+    return pd.DataFrame(rows)
+
+
+def _peak_memory(fn) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def synthetic_sales_frame(n_territories: int, products=("Product 1", "Product 2", "Product 3"), seed: int = 0) -> pd.DataFrame:
+    """
+    Builds a wide sales frame shaped like 'Input Sales_Anomaly_Introduced' with random sales.
+    """
+    rng = np.random.default_rng(seed)
+    data = {
+        "Territory": np.arange(100000, 100000 + n_territories),
+        "Territory Name": [f"Territory {i}" for i in range(n_territories)],
+    }
+    for product in products:
+        level = rng.gamma(shape=4.0, scale=20.0, size=n_territories)
+        for month in TARGET_MONTHS:
+            data[f"{product} R12 {month}"] = np.maximum(0, rng.normal(level, level * 0.15)).round().astype(np.int64)
+    return pd.DataFrame(data)
+
+
+def _melt_detector(sales_df: pd.DataFrame, z_thresh: float = -2.0) -> pd.DataFrame:
+    # Reference copy of the previous melt/groupby/merge implementation
+    product1_cols = [f"Product 1 R12 {m}" for m in TARGET_MONTHS]
+    df_long = sales_df.melt(
+        id_vars=["Territory", "Territory Name"],
+        value_vars=product1_cols,
+        var_name="Month",
+        value_name="Sales"
+    )
+    df_long["Month"] = df_long["Month"].str.extract(r'R12 (\w+)', expand=False)
+    stats = df_long.groupby("Month")["Sales"].agg(["mean", "std"]).reset_index()
+    df_merged = df_long.merge(stats, on="Month")
+    df_merged["z_score"] = (df_merged["Sales"] - df_merged["mean"]) / df_merged["std"]
+    anomalies = df_merged[df_merged["z_score"] < z_thresh].copy()
+    return anomalies[["Territory", "Territory Name", "Month", "Sales", "z_score"]].reset_index(drop=True)
+
+
+def benchmark_anomaly_detector(sizes=(1_000, 10_000, 100_000), repeats: int = 3) -> pd.DataFrame:
+    """
+    Compares runtime and peak traced memory of the wide detector against the melt/merge one.
+    """
+    rows = []
+    for n_territories in sizes:
+        sales_df = synthetic_sales_frame(n_territories)
+        for name, detector in [("melt/merge", _melt_detector), ("wide NumPy", detect_anomalies_wide)]:
+            rows.append({
+                "Territories": n_territories,
+                "Detector": name,
+                "Seconds": _best_of(lambda: detector(sales_df), repeats),
+                "Peak MB": _peak_memory(lambda: detector(sales_df)) / 1e6,
+            })
+    return pd.DataFrame(rows)
+
+
+def benchmark_anomaly_engine(sizes=(1_000, 10_000, 100_000), repeats: int = 3) -> pd.DataFrame:
+    """
+    Times run_anomaly_engine with every detector over all three products.
+    """
+    rows = []
+    for n_territories in sizes:
+        sales_df = synthetic_sales_frame(n_territories)
+        for detectors in [[name] for name in ANOMALY_DETECTORS] + [list(ANOMALY_DETECTORS)]:
+            rows.append({
+                "Territories": n_territories,
+                "Detectors": "+".join(detectors) if len(detectors) == 1 else "all",
+                "Seconds": _best_of(lambda: run_anomaly_engine(sales_df, detectors), repeats),
+            })
+    return pd.DataFrame(rows)
+
+
+def benchmark_disaster_summary(sizes=(100, 1_000, 5_000), repeats: int = 3) -> pd.DataFrame:
+    """
+    Times format_disaster_impact_summary_html for increasing numbers of disaster-matched rows.
+    """
+    rows = []
+    sales_df = synthetic_sales_frame(max(sizes))
+    rng = np.random.default_rng(2)
+    for n_rows in sizes:
+        picked = rng.choice(len(sales_df), n_rows, replace=False)
+        months = rng.choice(TARGET_MONTHS, n_rows)
+        verified = pd.DataFrame({
+            "Territory": sales_df["Territory"].to_numpy()[picked],
+            "Territory Name": sales_df["Territory Name"].to_numpy()[picked],
+            "Month": months,
+            "Sales": sales_df.to_numpy()[picked, 2],
+            "IncidentBeginDate": pd.Timestamp("2025-03-01"),
+            "IncidentEndDate": pd.Timestamp("2025-03-20"),
+            "IncidentType": "Flood",
+            "DeclarationTitle": "Severe Storms",
+            "Disaster Match": True,
+        })
+        rows.append({
+            "Flagged rows": n_rows,
+            "Seconds": _best_of(lambda: format_disaster_impact_summary_html(verified, sales_df), repeats),
+        })
+    return pd.DataFrame(rows)
+
+
+def benchmark_territory_table(sizes=(1_000, 10_000, 100_000), repeats: int = 3) -> pd.DataFrame:
+    """
+    Compares the memory of the wide sales frame against the TerritoryTable and times
+    anomaly detection on each.
+    """
+    rows = []
+    for n_territories in sizes:
+        sales_df = synthetic_sales_frame(n_territories)
+        table = TerritoryTable.from_frame(sales_df)
+        rows.append({
+            "Territories": n_territories,
+            "Frame MB": sales_df.memory_usage(deep=True).sum() / 1e6,
+            "Table MB": table.nbytes / 1e6,
+            "Frame detect s": _best_of(lambda: detect_anomalies_wide(sales_df), repeats),
+            "Table detect s": _best_of(lambda: detect_anomalies_wide(table), repeats),
+        })
+    return pd.DataFrame(rows)
+
+
+def benchmark_goal_pipeline(repeats: int = 3) -> pd.DataFrame:
+    """
+    Times a goal request through the goal Pipeline with an empty memo (anomaly stages and
+    goal baseline run concurrently) and as a what-if on a warm memo, where only the goal
+    stage reruns. Needs the goal and FEMA workbooks.
+    """
+    from DataContext import get_data_context
+    context = get_data_context()
+
+    def request(goal: float) -> dict:
+        params = {"goal": goal, "min_growth": 1.0, "max_growth": 2.0, "product_weights": None, "baseline_period": 6, "exclude_disaster_months": True}
+        return {"context": context, "sales_file_path": GOAL_DATA_PATH, "dataset_path": None, "output_sink": None, "params": params}
+
+    def empty_memo():
+        pipeline = build_goal_pipeline()
+        try:
+            return pipeline.run(request(5600.0), ["goals"])
+        finally:
+            pipeline.close()
+
+    pipeline = build_goal_pipeline()
+    pipeline.run(request(5600.0), ["goals"])
+    goals = iter(np.linspace(5000, 7000, repeats + 1))
+
+    def what_if():
+        return pipeline.run(request(float(next(goals))), ["goals"])
+
+    rows = []
+    for name, fn in [("empty memo", empty_memo), ("memoized what-if", what_if)]:
+        run = fn()
+        rows.append({"Run": name, "Seconds": _best_of(fn, repeats), "Critical path": " → ".join(run.critical_path())})
+    pipeline.close()
+    return pd.DataFrame(rows)
+
+
+BENCHMARKS = {
+    "loader": benchmark_workbook_loader,
+    "scenarios": benchmark_goal_scenarios,
+    "capping": benchmark_capped_allocation,
+    "anomalies": benchmark_anomaly_detector,
+    "anomaly_engine": benchmark_anomaly_engine,
+    "disaster_summary": benchmark_disaster_summary,
+    "territory_table": benchmark_territory_table,
+    "goal_pipeline": benchmark_goal_pipeline,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"📊 {name}")
+        print(BENCHMARKS[name]().to_string(index=False))
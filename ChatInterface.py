@@ -1,26 +1,62 @@
 import streamlit as st
 import requests
 import pandas as pd
+import hashlib
 import io
 
+AGENT_URL = "http://localhost:8000"
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+UNKNOWN_DATASET_ERROR = "Unknown dataset_id"  # error prefix of AgentService for a dataset it does not hold
+
 st.set_page_config(page_title="Pharma IC Agent Chat", layout="wide")
 st.title("💊 Pharma IC Agent Chat")
 
 # Initialize session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
-if "uploaded_data" not in st.session_state:
-    st.session_state.uploaded_data = None
+if "dataset" not in st.session_state:
+    st.session_state.dataset = None  # {"name", "sha256", "bytes"} of the uploaded workbook
+if "dataset_ids" not in st.session_state:
+    st.session_state.dataset_ids = {}  # sha256 -> dataset_id on the backend
+if "session_id" not in st.session_state:
+    st.session_state.session_id = None
+
+
+@st.cache_data(show_spinner=False)
+def preview_workbook(sha256: str, _data: bytes) -> pd.DataFrame:
+    # Parsed once per file contents, only for the sidebar preview
+    return pd.read_excel(io.BytesIO(_data), nrows=5)
+
+
+def upload_dataset(dataset: dict) -> str:
+    # The original bytes go to the backend once; later messages send only the dataset_id
+    response = requests.post(f"{AGENT_URL}/datasets", files={"file": (dataset["name"], dataset["bytes"], XLSX_MIME)})
+    response.raise_for_status()
+    return response.json()["dataset_id"]
+
+
+def dataset_unknown(response) -> bool:
+    # Only the backend's "Unknown dataset_id" 404 means the upload is gone; other 404s are not retried
+    if response.status_code != 404:
+        return False
+    try:
+        error = response.json().get("error") or ""
+    except ValueError:
+        return False
+    return error.startswith(UNKNOWN_DATASET_ERROR)
+
 
 # Sidebar for uploading data
 st.sidebar.header("📂 Upload Historical Sales Data")
 uploaded_file = st.sidebar.file_uploader("Upload Excel (.xlsx)", type=["xlsx"])
 
 if uploaded_file:
-    df = pd.read_excel(uploaded_file)
-    st.session_state.uploaded_data = df
+    data = uploaded_file.getvalue()
+    digest = hashlib.sha256(data).hexdigest()
+    if st.session_state.dataset is None or st.session_state.dataset["sha256"] != digest:
+        st.session_state.dataset = {"name": uploaded_file.name, "sha256": digest, "bytes": data}
     st.sidebar.success("✅ File uploaded successfully!")
-    st.sidebar.write(df.head())  # Preview
+    st.sidebar.write(preview_workbook(digest, data))  # Preview
 
 # Chat display
 for message in st.session_state.messages:
@@ -33,23 +69,25 @@ if prompt := st.chat_input("Set a goal (e.g., 'Analyze Q2 drop in sales')..."):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # Prepare file content to send to backend
-    if st.session_state.uploaded_data is not None:
-        buffer = io.BytesIO()
-        st.session_state.uploaded_data.to_excel(buffer, index=False)
-        buffer.seek(0)
-        files = {"file": ("data.xlsx", buffer, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")}
-    else:
-        files = {}
-
-    # Send goal + file to CrewAI backend
+    # Send goal + dataset reference to the agent backend
     try:
-        response = requests.post(
-            "http://localhost:8000/agent",
-            data={"goal": prompt},
-            files=files if files else None,
-        )
-        result = response.json()["response"]
+        form = {"goal": prompt}
+        if st.session_state.session_id:
+            form["session_id"] = st.session_state.session_id
+        dataset = st.session_state.dataset
+        if dataset is not None:
+            if dataset["sha256"] not in st.session_state.dataset_ids:
+                st.session_state.dataset_ids[dataset["sha256"]] = upload_dataset(dataset)
+            form["dataset_id"] = st.session_state.dataset_ids[dataset["sha256"]]
+
+        response = requests.post(f"{AGENT_URL}/agent", data=form)
+        if dataset is not None and dataset_unknown(response):
+            # The backend no longer has the dataset (e.g. restarted with a clean cache): upload again
+            form["dataset_id"] = st.session_state.dataset_ids[dataset["sha256"]] = upload_dataset(dataset)
+            response = requests.post(f"{AGENT_URL}/agent", data=form)
+        payload = response.json()
+        st.session_state.session_id = payload.get("session_id", st.session_state.session_id)
+        result = payload["response"] if "response" in payload else f"⚠️ Error: {payload.get('error')}"
     except Exception as e:
         result = f"⚠️ Error: {e}"
 
@@ -0,0 +1,129 @@
+import html
+import json
+import re
+from collections import deque
+
+SLOT_FIELDS = (
+    "name", "quarter", "goal", "min_territory_growth", "max_territory_growth",
+    "product_weights", "baseline_period", "exclude_disaster_months",
+)
+# Kept across goals: everything else is cleared when a goal completes or a new one starts
+PERSISTENT_FIELDS = ("name",)
+CONTEXT_MAX_TURNS = 6
+CONTEXT_TOKEN_BUDGET = 600
+CONTEXT_MAX_TURN_CHARS = 400
+CHARS_PER_TOKEN = 4
+
+_TAG_RE = re.compile(r"<(style|script)\b.*?</\1>|<[^>]+>", re.IGNORECASE | re.DOTALL)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def strip_html(text: str) -> str:
+    """
+    Reduces an HTML chat message to its visible text on one line.
+    """
+    return _SPACE_RE.sub(" ", html.unescape(_TAG_RE.sub(" ", text or ""))).strip()
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class ConversationState:
+    """
+    Slot state for the goal chat. Confirmed fields are carried forward between turns,
+    so the extraction prompt only needs a compact state summary and the last few
+    plain-text turns instead of the whole HTML history.
+
+    Parameters:
+    - max_turns: recent turns sent with the prompt
+    - token_budget: approximate token cap for state summary plus turns (oldest turns dropped first)
+    - max_turn_chars: each turn is cut to this many characters
+    """
+
+    def __init__(self, max_turns: int = CONTEXT_MAX_TURNS, token_budget: int = CONTEXT_TOKEN_BUDGET, max_turn_chars: int = CONTEXT_MAX_TURN_CHARS):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.max_turn_chars = max_turn_chars
+        self.slots = dict.fromkeys(SLOT_FIELDS)
+        self.prompt_sizes = deque(maxlen=200)
+
+    def update(self, data: dict):
+        """
+        Merges an extraction result; null fields keep their previous value. A quarter
+        different from the current one starts a new goal, so the slots confirmed for
+        the old one are reset first.
+        """
+        quarter, current = data.get("quarter"), self.slots["quarter"]
+        if quarter is not None and current is not None and str(quarter).strip().upper() != str(current).strip().upper():
+            self.reset()
+        for field in SLOT_FIELDS:
+            if data.get(field) is not None:
+                self.slots[field] = data[field]
+
+    def clear(self, *fields):
+        """
+        Forgets the given slots, e.g. clear("baseline_period") to ask for it again.
+        """
+        for field in fields:
+            if field not in self.slots:
+                raise KeyError(f"Unknown slot: {field}")
+            self.slots[field] = None
+
+    def reset(self):
+        """
+        Clears the goal slots once a goal is calculated, keeping PERSISTENT_FIELDS.
+        """
+        self.clear(*(field for field in SLOT_FIELDS if field not in PERSISTENT_FIELDS))
+
+    def known_slots(self) -> dict:
+        return {k: v for k, v in self.slots.items() if v is not None}
+
+    def summary(self) -> str:
+        return json.dumps(self.known_slots(), separators=(",", ":"))
+
+    def recent_turns(self, messages) -> list:
+        """
+        Returns the last max_turns chat turns as {"role", "content"} with HTML stripped,
+        trimmed so the summary plus turns fit the token budget.
+        """
+        turns = []
+        for sender, text in messages:
+            if sender in ("DQ", "image"):
+                continue
+            content = strip_html(text)
+            if len(content) > self.max_turn_chars:
+                content = content[:self.max_turn_chars] + "…"
+            turns.append({"role": "user" if sender == "user" else "assistant", "content": content})
+        turns = turns[-self.max_turns:]
+
+        budget = self.token_budget - estimate_tokens(self.summary())
+        while len(turns) > 1 and estimate_tokens(json.dumps(turns)) > budget:
+            turns.pop(0)
+        return turns
+
+    def context(self, messages) -> tuple:
+        """
+        Returns (state summary JSON, recent turns JSON) for the extraction prompt and
+        records the prompt size against the size of the full history.
+        """
+        summary = self.summary()
+        turns = json.dumps(self.recent_turns(messages), indent=1)
+        full_history_chars = sum(len(text) for sender, text in messages if sender not in ("DQ", "image"))
+        self.prompt_sizes.append({
+            "turn": len(self.prompt_sizes) + 1,
+            "context_tokens": estimate_tokens(summary) + estimate_tokens(turns),
+            "full_history_tokens": (full_history_chars + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN,
+        })
+        return summary, turns
+
+    def metrics(self) -> dict:
+        if not self.prompt_sizes:
+            return {"turns": 0}
+        last = self.prompt_sizes[-1]
+        return {
+            "turns": len(self.prompt_sizes),
+            "last_context_tokens": last["context_tokens"],
+            "last_full_history_tokens": last["full_history_tokens"],
+            "max_context_tokens": max(s["context_tokens"] for s in self.prompt_sizes),
+        }
@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from types import MappingProxyType
+import pandas as pd
+from WorkbookCache import WorkbookLoader, file_fingerprint
+from Anomaly import FemaIndex, load_fema_index
+from TerritoryTable import TerritoryTable
+from GoalCalculationN import REGION_NAMES
+from Assets import load_asset
+
+GOAL_DATA_PATH = "Goal Setting sanitized Data.xlsx"
+FEMA_DATA_PATH = "ZIP_to_Territory_with_FEMA_Data.xlsx"
+FEMA_SHEET = "2025_ZIP_to_Territory"
+IMAGE_PATHS = ("TimeSeriesDia.png", "UnknownUnknown.png")
+
+# Sheets every goal request needs, as (sheet_name, read_kwargs)
+GOAL_SHEETS = (
+    ("Input Sales_Anomaly_Introduced", {}),
+    ("Input Sales", {}),
+    ("1c. Inputs - Mappings", {"skiprows": 5, "usecols": "C:D"}),
+)
+
+
+def _sheet_key(sheet_name: str, read_kwargs: dict) -> tuple:
+    return (sheet_name, json.dumps(read_kwargs, sort_keys=True, default=str))
+
+
+@dataclass(frozen=True)
+class DataContext:
+    """
+    Immutable, process-wide bundle of the data every session reads: goal workbook
+    sheets, the FEMA interval index, the encoded DQ images and compact
+    TerritoryTable views of the two sales sheets.
+
+    Built once per source-file version and shared by all Streamlit sessions, so
+    frames must be treated as read-only (copy before modifying). It can be passed
+    anywhere a WorkbookLoader is accepted.
+    """
+    sheets: MappingProxyType
+    fema_index: FemaIndex
+    images: MappingProxyType
+    fingerprints: tuple = field(default=())
+    territory_table: TerritoryTable = None
+    input_sales_table: TerritoryTable = None
+
+    @property
+    def sales_df(self) -> pd.DataFrame:
+        return self.read("Input Sales_Anomaly_Introduced")
+
+    @property
+    def input_sales_df(self) -> pd.DataFrame:
+        return self.read("Input Sales")
+
+    @property
+    def mapping_df(self) -> pd.DataFrame:
+        return self.read("1c. Inputs - Mappings", skiprows=5, usecols="C:D")
+
+    def read(self, sheet_name: str, **read_kwargs) -> pd.DataFrame:
+        key = _sheet_key(sheet_name, read_kwargs)
+        if key not in self.sheets:
+            raise KeyError(f"Sheet not preloaded in data context: {sheet_name} {read_kwargs}")
+        return self.sheets[key]
+
+    def size_report(self) -> pd.DataFrame:
+        """
+        Returns the memory held by each item of the context, in bytes.
+        """
+        rows = [(f"sheet: {key[0]}", int(df.memory_usage(deep=True).sum())) for key, df in self.sheets.items()]
+        for name, table in [("territory table", self.territory_table), ("input sales table", self.input_sales_table)]:
+            if table is not None:
+                rows.append((name, table.nbytes))
+        if self.fema_index is not None:
+            rows.append(("fema index", self.fema_index.nbytes))
+        rows += [(f"image: {name}", len(encoded)) for name, encoded in self.images.items()]
+        return pd.DataFrame(rows, columns=["Item", "Bytes"])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.size_report()["Bytes"].sum())
+
+
+_context_lock = threading.Lock()
+_context = None
+_reload_hooks = []
+
+
+def _source_paths() -> tuple:
+    return (GOAL_DATA_PATH, FEMA_DATA_PATH) + IMAGE_PATHS
+
+
+def _current_fingerprints() -> tuple:
+    return tuple(
+        (path, file_fingerprint(path) if os.path.exists(path) else None)
+        for path in _source_paths()
+    )
+
+
+def _load_fema() -> FemaIndex:
+    if not os.path.exists(FEMA_DATA_PATH):
+        return None
+    return load_fema_index(FEMA_DATA_PATH, FEMA_SHEET)
+
+
+def _build_context(fingerprints: tuple) -> DataContext:
+    with WorkbookLoader(GOAL_DATA_PATH) as loader:
+        sheets = {
+            _sheet_key(sheet_name, read_kwargs): loader.read(sheet_name, **read_kwargs)
+            for sheet_name, read_kwargs in GOAL_SHEETS
+        }
+
+    mapping_df = sheets[_sheet_key("1c. Inputs - Mappings", {"skiprows": 5, "usecols": "C:D"})]
+    territory_table = TerritoryTable.from_frame(
+        sheets[_sheet_key("Input Sales_Anomaly_Introduced", {})], mapping_df, REGION_NAMES
+    )
+    input_sales_table = TerritoryTable.from_frame(sheets[_sheet_key("Input Sales", {})], mapping_df, REGION_NAMES)
+
+    images = {os.path.basename(path): load_asset(path).base64 for path in IMAGE_PATHS}
+
+    return DataContext(
+        sheets=MappingProxyType(sheets),
+        fema_index=_load_fema(),
+        images=MappingProxyType(images),
+        fingerprints=fingerprints,
+        territory_table=territory_table,
+        input_sales_table=input_sales_table,
+    )
+
+
+def register_reload_hook(hook):
+    """
+    Registers a callable invoked with the new DataContext whenever it is rebuilt.
+    """
+    with _context_lock:
+        if hook not in _reload_hooks:
+            _reload_hooks.append(hook)
+
+
+def get_data_context(force_reload: bool = False) -> DataContext:
+    """
+    Returns the shared DataContext, rebuilding it only when a source file changed.
+
+    Parameters:
+    - force_reload: rebuild even if the source files are unchanged
+
+    Returns:
+    - DataContext shared by every session in this process
+    """
+    global _context
+    fingerprints = _current_fingerprints()
+
+    with _context_lock:
+        if _context is not None and not force_reload and _context.fingerprints == fingerprints:
+            return _context
+        reloaded = _context is not None
+        _context = _build_context(fingerprints)
+        context = _context
+        hooks = list(_reload_hooks)
+
+    print(f"📦 Data context {'reloaded' if reloaded else 'built'}: {context.nbytes / 1e6:.1f} MB")
+    for hook in hooks:
+        hook(context)
+    return context
@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from itertools import product as cartesian
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from GoalCalculationN import DEFAULT_PRODUCT_WEIGHTS, PRODUCTS, apply_goal_parameters, goal_baseline_from_table, prepare_goal_baseline, product_weight_row
+from OutputSinks import make_sink
+from TerritoryTable import TerritoryTable
+
+GOAL_DATA_PATH = "Goal Setting sanitized Data.xlsx"
+DEFAULT_BATCH_OUTPUT = os.path.join("output", "batch_goals.xlsx")
+SHARED_ARRAYS = ("territory_ids", "name_codes", "region_ids", "region_codes", "sales")
+
+
+@dataclass(frozen=True)
+class GoalJob:
+    """
+    One goal run: the goal product under one scenario.
+
+    quarters only labels the output rows. The workbook holds a single R12 history, so
+    every quarter shares the same baseline window and goals; the job is computed once
+    and its rows are repeated per quarter label.
+    """
+    product: str
+    scenario: int
+    national_goal: float
+    min_growth: float
+    max_growth: float
+    product_weights: dict = field(default_factory=lambda: dict(DEFAULT_PRODUCT_WEIGHTS))
+    baseline_months: int = None
+    quarters: tuple = ()
+
+
+def job_weights(product_weights: dict, goal_product: str, all_products: list = None) -> dict:
+    """
+    Picks and validates the index product weights for one goal product.
+
+    Parameters:
+    - product_weights: weight dict per goal product, e.g.
+      {"Product 2": {"Product 1": 50, "Product 3": 50}}; None uses DEFAULT_PRODUCT_WEIGHTS,
+      which only applies when the goal product is Product 1
+    - goal_product: the product the goals are set for
+    - all_products: every loaded product (default PRODUCTS)
+
+    Returns:
+    - weight dict naming exactly the index products of goal_product
+
+    Raises:
+    - ValueError if goal_product has no weights, or they don't name exactly its index
+      products or don't sum to 100
+    """
+    all_products = list(all_products or PRODUCTS)
+    if product_weights is None:
+        product_weights = {PRODUCTS[0]: DEFAULT_PRODUCT_WEIGHTS}
+    if goal_product not in product_weights:
+        raise ValueError(f"No product weights given for goal product {goal_product}")
+    weights = product_weights[goal_product]
+    index_products = [p for p in all_products if p != goal_product]
+    product_weight_row(weights, index_products)
+    return dict(weights)
+
+
+def build_jobs(products: list, quarters: list, national_goals: list, min_growths: list, max_growths: list, product_weights: dict = None, baseline_months: int = None, all_products: list = None) -> list:
+    """
+    Expands product x scenario into GoalJobs, where the scenarios are every combination
+    of national goal, min growth and max growth. Quarters are attached as labels only
+    (see GoalJob), so they don't multiply the work.
+
+    product_weights is keyed by goal product (see job_weights); it is validated here so a
+    bad weight set fails before the pool starts.
+    """
+    scenarios = list(cartesian(national_goals, min_growths, max_growths))
+    weights = {product: job_weights(product_weights, product, all_products) for product in products}
+    return [
+        GoalJob(
+            product=product,
+            scenario=i,
+            national_goal=float(goal),
+            min_growth=float(min_growth),
+            max_growth=float(max_growth),
+            product_weights=weights[product],
+            baseline_months=baseline_months,
+            quarters=tuple(quarters),
+        )
+        for product in products
+        for i, (goal, min_growth, max_growth) in enumerate(scenarios, start=1)
+    ]
+
+
+class SharedTerritoryTable:
+    """
+    Copies the arrays of a TerritoryTable into shared memory once, so pool workers map
+    them instead of receiving a pickled copy or re-reading the workbook.
+
+    spec is small and picklable; pass it to attach_shared_table in the worker.
+    """
+
+    def __init__(self, table: TerritoryTable):
+        self._blocks = []
+        self.spec = {
+            "names": table.names,
+            "region_names": table.region_names,
+            "products": table.products,
+            "months": table.months,
+            "sales_dtype": table.sales_dtype.str,
+            "arrays": {},
+        }
+        try:
+            for attr in SHARED_ARRAYS:
+                array = getattr(table, attr)
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._blocks.append(block)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                self.spec["arrays"][attr] = (block.name, array.shape, array.dtype.str)
+        except BaseException:
+            # Don't leak the blocks already created
+            self.close()
+            raise
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach_shared_table(spec: dict) -> tuple:
+    """
+    Rebuilds a TerritoryTable over the shared blocks described by spec (zero-copy).
+
+    Returns:
+    - (TerritoryTable, list of SharedMemory handles that must stay referenced while the table is used)
+    """
+    blocks, arrays = [], {}
+    for attr, (name, shape, dtype) in spec["arrays"].items():
+        # Pool workers share the parent's resource tracker, so attaching doesn't hand
+        # ownership to this process; the parent unlinks the blocks in close()
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        arrays[attr] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+    table = TerritoryTable(
+        arrays["territory_ids"], arrays["name_codes"], spec["names"], arrays["region_ids"],
+        arrays["region_codes"], spec["region_names"], spec["products"], spec["months"], arrays["sales"],
+        spec["sales_dtype"],
+    )
+    return table, blocks
+
+
+_worker_table = None
+_worker_blocks = []
+_worker_baselines = {}
+
+
+def _init_worker(spec: dict):
+    global _worker_table, _worker_blocks
+    _worker_table, _worker_blocks = attach_shared_table(spec)
+
+
+def _run_job(job: GoalJob) -> tuple:
+    start = time.perf_counter()
+    products = [job.product] + [p for p in _worker_table.products if p != job.product]
+
+    # Baselines depend only on product order and window, so workers reuse them across scenarios
+    key = (tuple(products), job.baseline_months)
+    baseline = _worker_baselines.get(key)
+    if baseline is None:
+        baseline = goal_baseline_from_table(_worker_table, products, job.baseline_months)
+        _worker_baselines[key] = baseline
+    baseline_seconds = time.perf_counter() - start
+
+    df = apply_goal_parameters(baseline, job.national_goal, job.min_growth, job.max_growth, job.product_weights)
+    capping = df.attrs["capping"]
+    df.insert(0, "Product", job.product)
+    df.insert(1, "Scenario", job.scenario)
+    df.insert(2, "National Goal", job.national_goal)
+    # Quarters are labels on one computed result (see GoalJob)
+    df = pd.concat([df.assign(Quarter=quarter) for quarter in job.quarters or (None,)], ignore_index=True)
+    df.insert(1, "Quarter", df.pop("Quarter"))
+
+    timing = {
+        "Product": job.product,
+        "Quarters": ", ".join(job.quarters),
+        "Scenario": job.scenario,
+        "Worker PID": os.getpid(),
+        "Baseline Seconds": baseline_seconds,
+        "Total Seconds": time.perf_counter() - start,
+        "Solver Iterations": capping["iterations"],
+        "Solver Converged": capping["converged"],
+    }
+    return df, timing
+
+
+def run_goal_batch(jobs: list, sales_file_path: str = GOAL_DATA_PATH, max_workers: int = None, products: list = None) -> tuple:
+    """
+    Runs goal jobs in parallel on a process pool.
+
+    The workbook is read once in this process; its TerritoryTable is shared with the
+    workers through shared memory.
+
+    Parameters:
+    - jobs: list of GoalJob (see build_jobs)
+    - sales_file_path: goal workbook
+    - max_workers: pool size (default: CPU count)
+    - products: every product to load (goal and index products, default PRODUCTS)
+
+    Returns:
+    - (consolidated goals pd.DataFrame, per-job timings pd.DataFrame)
+    """
+    table = prepare_goal_baseline(sales_file_path, products=products or PRODUCTS).table
+
+    frames, timings = [], []
+    with SharedTerritoryTable(table) as shared:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(shared.spec,)) as pool:
+            futures = [pool.submit(_run_job, job) for job in jobs]
+            for future in as_completed(futures):
+                df, timing = future.result()
+                frames.append(df)
+                timings.append(timing)
+
+    results = pd.concat(frames, ignore_index=True).sort_values(["Product", "Quarter", "Scenario"], kind="stable", ignore_index=True)
+    timings = pd.DataFrame(timings).sort_values(["Product", "Scenario"], ignore_index=True)
+    return results, timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run goal setting for several products, quarters and scenarios in parallel.")
+    parser.add_argument("--workbook", default=GOAL_DATA_PATH)
+    parser.add_argument("--products", nargs="+", default=["Product 1"], help="Goal products to run")
+    parser.add_argument("--quarters", nargs="+", default=["Q3", "Q4"],
+                        help="Quarter labels for the output rows; every quarter uses the same R12 baseline, so goals are computed once and repeated per label")
+    parser.add_argument("--national-goals", nargs="+", type=float, required=True)
+    parser.add_argument("--min-growth", nargs="+", type=float, default=[1.0])
+    parser.add_argument("--max-growth", nargs="+", type=float, default=[2.0])
+    parser.add_argument("--weights", type=json.loads, default=None,
+                        help='Index product weights per goal product, e.g. \'{"Product 1": {"Product 2": 60, "Product 3": 40}}\'; required for goal products other than Product 1')
+    parser.add_argument("--baseline-months", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=DEFAULT_BATCH_OUTPUT, help=".xlsx, .csv or .parquet")
+    args = parser.parse_args(argv)
+
+    jobs = build_jobs(
+        args.products, args.quarters, args.national_goals, args.min_growth, args.max_growth,
+        product_weights=args.weights, baseline_months=args.baseline_months,
+    )
+    print(f"🚀 Running {len(jobs)} goal jobs for {len(args.quarters)} quarter label(s)")
+    start = time.perf_counter()
+    results, timings = run_goal_batch(jobs, args.workbook, max_workers=args.workers)
+    elapsed = time.perf_counter() - start
+
+    make_sink(args.output).write(results)
+    stem, extension = os.path.splitext(args.output)
+    make_sink(f"{stem}_timings{extension}").write(timings)
+
+    print(timings.to_string(index=False))
+    print(f"✅ {len(jobs)} jobs in {elapsed:.2f}s, {len(results)} goal rows written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
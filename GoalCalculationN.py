@@ -2,6 +2,11 @@ import pandas as pd
 import numpy as np
 import logging
 import os
+import threading
+from dataclasses import dataclass
+from WorkbookCache import WorkbookLoader, file_fingerprint, read_territory_sales_streaming
+from OutputSinks import OutputSink, write_async
+from TerritoryTable import R12_MONTHS, TerritoryTable
 # import plotly.express as px
 # import plotly.io as pio
 
@@ -25,13 +30,588 @@ import os
     
 #     return df
 
-def calculate_goals(national_goal: int, sales_file_path: str, min_growth: int, max_growth: int,product_weights: dict = None) -> pd.DataFrame:
+PRODUCTS = ["Product 1", "Product 2", "Product 3"]
+DEFAULT_PRODUCT_WEIGHTS = {"Product 2": 60, "Product 3": 40}
+MONTHS_PER_QUARTER = 3
+REGION_NAMES = {
+    101: "East Division",
+    201: "West Division",
+    301: "Central Division"
+}
+
+
+@dataclass(frozen=True)
+class GoalBaseline:
+    """
+    Parameter-independent stage of the goal calculation: the merged territory frame,
+    R12 totals, baseline goals and per-product share indexes, plus the compact
+    TerritoryTable they were computed from.
+
+    products[0] is the goal product; the remaining products drive the market index.
+    baseline_months is the trailing window the baseline was taken over and
+    excluded_cells the number of (territory, month) cells masked out of it.
+    """
+    frame: pd.DataFrame
+    baseline_goal: np.ndarray
+    product_indexes: dict
+    products: tuple
+    table: TerritoryTable = None
+    baseline_months: int = len(R12_MONTHS)
+    excluded_cells: int = 0
+
+
+_baseline_lock = threading.Lock()
+_baseline_cache = {}
+
+
+def baseline_month_mask(table: TerritoryTable, baseline_months: int = None, exclude_months=None) -> np.ndarray:
+    """
+    Returns the (territories x months) boolean mask of sales months that count towards the baseline.
+
+    Args:
+        table (TerritoryTable): Territory sales table.
+        baseline_months (int): Trailing window length, 1 to len(table.months) (default: all months).
+        exclude_months: Months to leave out of the window, given as month names (all territories),
+            a DataFrame of Territory / Month pairs (per territory, e.g. disaster-matched anomalies),
+            or a boolean array of shape (months,) or (territories, months).
+
+    Returns:
+        np.ndarray: Mask of shape (territories, months). Territories whose whole window is
+        excluded keep the full window.
+    """
+    n_territories, n_months = len(table), len(table.months)
+    baseline_months = n_months if baseline_months is None else int(baseline_months)
+    if not 1 <= baseline_months <= n_months:
+        raise ValueError(f"baseline_months must be between 1 and {n_months}, got {baseline_months}")
+
+    window = np.arange(n_months) >= n_months - baseline_months
+    if exclude_months is None:
+        return np.broadcast_to(window, (n_territories, n_months))
+
+    excluded = np.zeros((n_territories, n_months), dtype=bool)
+    if isinstance(exclude_months, pd.DataFrame):
+        rows = table.rows_for(exclude_months["Territory"])
+        cols = pd.Index(table.months).get_indexer(exclude_months["Month"])
+        known = (rows >= 0) & (cols >= 0)
+        excluded[rows[known], cols[known]] = True
+    elif np.asarray(exclude_months).dtype == bool:
+        excluded |= np.asarray(exclude_months)
+    else:
+        excluded |= np.isin(table.months, list(exclude_months))
+
+    mask = window & ~excluded
+    return np.where(mask.any(axis=1, keepdims=True), mask, window)
+
+
+def _goal_baseline_from_table(table: TerritoryTable, frame: pd.DataFrame, baseline_months: int = None, exclude_months=None) -> GoalBaseline:
+    # Masked window totals for every product in one reduction over the (products x territories x months)
+    # cube, rescaled to the full window length where months were excluded, so shares stay comparable
+    mask = baseline_month_mask(table, baseline_months, exclude_months)
+    window_length = len(table.months) if baseline_months is None else int(baseline_months)
+    window_totals = np.where(mask, table.sales, 0).sum(axis=2, dtype=np.float64)
+    window_totals *= window_length / mask.sum(axis=1)
+
+    products = table.products
+    baseline_goal = window_totals[0] * (MONTHS_PER_QUARTER / window_length)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        indexes = np.round(window_totals[1:] / window_totals[1:].sum(axis=1, keepdims=True) * 100, 1)
+    product_indexes = dict(zip(products[1:], indexes))
+
+    frame = frame.assign(**{
+        "Baseline Goal": baseline_goal,
+        **{f"{product} Index": index for product, index in product_indexes.items()},
+    })
+    return GoalBaseline(
+        frame=frame,
+        baseline_goal=baseline_goal,
+        product_indexes=product_indexes,
+        products=products,
+        table=table,
+        baseline_months=window_length,
+        excluded_cells=int(window_length * len(table) - mask.sum()),
+    )
+
+
+def _build_goal_baseline(loader, sales_file_path: str = None, streaming: bool = False, products: tuple = None) -> GoalBaseline:
+    products = list(products or PRODUCTS)
+    if streaming:
+        # Only territory and R12 month columns are read, in bounded chunks with compact dtypes
+        df_sales = read_territory_sales_streaming(
+            sales_file_path, 'Input Sales_Anomaly_Introduced', products, R12_MONTHS
+        )
+    else:
+        df_sales = loader.read('Input Sales_Anomaly_Introduced')
+    df_mapping = loader.read('1c. Inputs - Mappings', skiprows=5, usecols="C:D")
+
+    table = TerritoryTable.from_frame(df_sales, df_mapping, REGION_NAMES, products, R12_MONTHS)
+    return goal_baseline_from_table(table)
+
+
+def goal_baseline_from_table(table: TerritoryTable, products: list = None, baseline_months: int = None, exclude_months=None) -> GoalBaseline:
+    """
+    Builds the goal baseline straight from an in-memory TerritoryTable (no workbook read).
+
+    Args:
+        table (TerritoryTable): Territory sales table with region mapping.
+        products (list): Goal product followed by the index products (default: table.products).
+        baseline_months (int): Trailing baseline window in months (default: all months).
+        exclude_months: Months to drop from the baseline window (see baseline_month_mask).
+
+    Returns:
+        GoalBaseline: Merged territory frame, baseline goals and product indexes.
+    """
+    if products is not None and tuple(products) != table.products:
+        table = table.select_products(products)
+    r12_totals = table.r12_totals()
+
+    df = pd.DataFrame({
+        "Region": table.region_ids.astype(np.int64),
+        "Region Name": table.region_labels(),
+        "Territory": table.territory_ids.astype(np.int64),
+        "Territory Name": table.territory_names(),
+    })
+    for i, product in enumerate(table.products):
+        df[f"{product} R12 Total"] = r12_totals[i]
+
+    return _goal_baseline_from_table(table, df, baseline_months, exclude_months)
+
+
+def rebase_goal_baseline(baseline: GoalBaseline, baseline_months: int = None, exclude_months=None) -> GoalBaseline:
+    """
+    Recomputes baseline goals and product indexes for another baseline window from the
+    cached TerritoryTable, without re-reading the workbook.
+
+    The baseline goal is the average monthly sales of the goal product over the included
+    months, times 3 (a 6-month window gives R12 Total / 2).
+
+    Args:
+        baseline (GoalBaseline): Output of prepare_goal_baseline.
+        baseline_months (int): Trailing window length in months (default: all R12 months).
+        exclude_months: Months to drop from the window (see baseline_month_mask).
+
+    Returns:
+        GoalBaseline: Baseline for the requested window.
+    """
+    if baseline_months is None and exclude_months is None:
+        return baseline
+    return _goal_baseline_from_table(baseline.table, baseline.frame, baseline_months, exclude_months)
+
+
+def prepare_goal_baseline(sales_file_path: str, loader: WorkbookLoader = None, streaming: bool = False, products: list = None, baseline_months: int = None, exclude_months=None) -> GoalBaseline:
+    """
+    Returns the cached parameter-independent goal stage for a workbook, rebuilding it
+    only when the workbook contents change.
+
+    Args:
+        sales_file_path (str): Path to the input Excel file.
+        loader (WorkbookLoader): Optional shared loader so the workbook is opened once per request.
+        streaming (bool): Read the sales sheet in chunks with compact dtypes, keeping only the
+            territory columns and R12 totals (see WorkbookCache.read_territory_sales_streaming).
+        products (list): Goal product followed by the index products (default PRODUCTS).
+        baseline_months (int): Trailing baseline window in months (default: all R12 months).
+        exclude_months: Months to drop from the baseline window (see baseline_month_mask).
+
+    Returns:
+        GoalBaseline: Merged territory frame, baseline goals and product indexes.
+    """
+    products = tuple(products or PRODUCTS)
+    key = (os.path.abspath(sales_file_path), file_fingerprint(sales_file_path), streaming, products)
+    with _baseline_lock:
+        baseline = _baseline_cache.get(key)
+
+    if baseline is None:
+        if loader is None:
+            with WorkbookLoader(sales_file_path) as loader:
+                baseline = _build_goal_baseline(loader, sales_file_path, streaming, products)
+        else:
+            baseline = _build_goal_baseline(loader, sales_file_path, streaming, products)
+
+        with _baseline_lock:
+            # Keep only the current version of each workbook
+            for stale in [k for k in _baseline_cache if k[0] == key[0] and k[1] != key[1]]:
+                del _baseline_cache[stale]
+            _baseline_cache[key] = baseline
+
+    return rebase_goal_baseline(baseline, baseline_months, exclude_months)
+
+
+def product_weight_row(product_weights: dict, index_products, fill_missing: bool = False) -> list:
+    """
+    Orders a weight dict by index_products.
+
+    Args:
+        product_weights (dict): Weight per index product, e.g. {"Product 2": 60, "Product 3": 40}.
+        index_products: The index products of the goal, in baseline order.
+        fill_missing (bool): Give index products missing from product_weights a weight of 0.
+
+    Returns:
+        list: One weight per index product.
+
+    Raises:
+        ValueError: If a weight names a product that is not an index product, an index
+            product has no weight (unless fill_missing), or the weights do not sum to 100.
+    """
+    index_products = list(index_products)
+    unknown = sorted(set(product_weights) - set(index_products))
+    if unknown:
+        raise ValueError(f"Weights given for {unknown}, which are not index products of {index_products}")
+    missing = [p for p in index_products if p not in product_weights]
+    if missing and not fill_missing:
+        raise ValueError(f"Missing weights for index products {missing}")
+    row = [product_weights.get(p, 0) for p in index_products]
+    _check_weight_totals(np.asarray(row, dtype=float)[np.newaxis, :])
+    return row
+
+
+def _check_weight_totals(weights: np.ndarray):
+    totals = weights.sum(axis=1)
+    if not np.allclose(totals, 100):
+        raise ValueError(f"Product weights must sum to 100, got {totals[~np.isclose(totals, 100)][0]:g}")
+
+
+def _weight_matrix(baseline: GoalBaseline, product_weights, n_scenarios: int, fill_missing: bool = False) -> np.ndarray:
+    # Accepts one dict, a list of dicts, or an array of shape (scenarios, index products)
+    index_products = baseline.products[1:]
+    if product_weights is None:
+        product_weights = DEFAULT_PRODUCT_WEIGHTS
+    if isinstance(product_weights, dict):
+        product_weights = [product_weights]
+    if len(product_weights) and isinstance(product_weights[0], dict):
+        product_weights = [product_weight_row(w, index_products, fill_missing) for w in product_weights]
+    weights = np.asarray(product_weights, dtype=float).reshape(-1, len(index_products))
+    _check_weight_totals(weights)
+    return np.broadcast_to(weights, (n_scenarios, weights.shape[1]))
+
+
+@dataclass(frozen=True)
+class CappedAllocation:
+    """
+    Output of solve_capped_allocation. Arrays have one row per scenario.
+    """
+    goals: np.ndarray
+    scale: np.ndarray
+    iterations: np.ndarray
+    converged: np.ndarray
+    residual: np.ndarray
+
+
+def solve_capped_allocation(weights: np.ndarray, lower: np.ndarray, upper: np.ndarray, totals, tol: float = 1e-6, max_iter: int = 100) -> CappedAllocation:
+    """
+    Water-fills totals across territories: goal = clip(scale * weight, lower, upper), with one
+    scale per scenario chosen so the goals sum to the total.
+
+    The scale is found for all scenarios at once by safeguarded Newton iteration inside a
+    bisection bracket: O(territories) per iteration, and the iteration count is bounded by
+    max_iter and typically a handful, independent of the territory count.
+
+    Args:
+        weights (np.ndarray): Non-negative allocation weights, shape (territories,) or (scenarios, territories).
+        lower (np.ndarray): Per-territory minimum goal, broadcastable to weights.
+        upper (np.ndarray): Per-territory maximum goal, broadcastable to weights (may be inf).
+        totals: Target total per scenario.
+        tol (float): Allowed absolute gap between the allocated sum and the total.
+        max_iter (int): Maximum solver iterations.
+
+    Returns:
+        CappedAllocation: Goals plus scale, iterations taken, convergence flag and residual
+        per scenario. Scenarios whose total lies outside [sum(lower), sum(upper)] are
+        returned at the nearest bound with converged=False.
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    lower = np.broadcast_to(np.asarray(lower, dtype=float), weights.shape)
+    upper = np.broadcast_to(np.asarray(upper, dtype=float), weights.shape)
+    totals = np.broadcast_to(np.asarray(totals, dtype=float), (weights.shape[0],))[:, np.newaxis]
+
+    def allocate(scale):
+        return np.clip(scale * weights, lower, upper)
+
+    # Bracket the scale: f(0) is the floor, then double until the total is reached
+    scale_lo = np.zeros_like(totals)
+    weight_sum = weights.sum(axis=1, keepdims=True)
+    scale_hi = np.where(weight_sum > 0, np.maximum(totals, 1.0) / np.where(weight_sum > 0, weight_sum, 1), 1.0)
+    for _ in range(64):
+        short = allocate(scale_hi).sum(axis=1, keepdims=True) < totals
+        if not short.any():
+            break
+        scale_hi = np.where(short, scale_hi * 2, scale_hi)
+
+    # Safeguarded Newton: f(scale) is piecewise linear with slope = weight of the uncapped
+    # territories, so the Newton step is exact once the capped set is right; steps that
+    # leave the bracket fall back to bisection.
+    scale = np.clip(1.0, scale_lo, scale_hi)
+    iterations = np.zeros(len(totals), dtype=np.int64)
+    active = np.ones(len(totals), dtype=bool)
+    for i in range(max_iter):
+        rows = np.flatnonzero(active)
+        s, w, lo, hi, target = scale[rows], weights[rows], lower[rows], upper[rows], totals[rows]
+        scaled = s * w
+        allocated = np.clip(scaled, lo, hi).sum(axis=1, keepdims=True)
+        slope = np.where((scaled > lo) & (scaled < hi), w, 0).sum(axis=1, keepdims=True)
+
+        below = allocated < target
+        scale_lo[rows] = np.where(below, s, scale_lo[rows])
+        scale_hi[rows] = np.where(below, scale_hi[rows], s)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            newton = s + (target - allocated) / slope
+        bisect = (scale_lo[rows] + scale_hi[rows]) / 2
+        in_bracket = (slope > 0) & (newton > scale_lo[rows]) & (newton < scale_hi[rows])
+
+        iterations[rows] = i + 1
+        # Infeasible totals collapse the bracket without meeting the tolerance
+        stalled = scale_hi[rows] - scale_lo[rows] <= 1e-12 * np.maximum(scale_hi[rows], 1.0)
+        done = ((np.abs(allocated - target) <= tol) | stalled)[:, 0]
+        scale[rows] = np.where(done[:, np.newaxis], s, np.where(in_bracket, newton, bisect))
+        active[rows[done]] = False
+        if not active.any():
+            break
+
+    goals = allocate(scale)
+    residual = np.abs(goals.sum(axis=1, keepdims=True) - totals)[:, 0]
+    return CappedAllocation(
+        goals=goals,
+        scale=scale[:, 0],
+        iterations=iterations,
+        converged=residual <= tol,
+        residual=residual,
+    )
+
+
+def _goal_arrays(baseline: GoalBaseline, national_goals: np.ndarray, min_growths: np.ndarray, max_growths: np.ndarray, weights: np.ndarray) -> dict:
+    """
+    Goal math for a block of scenarios. Scenario inputs are column vectors of shape
+    (scenarios, 1) and every territory-level result has shape (scenarios, territories).
+    """
+    baseline_goal = baseline.baseline_goal[np.newaxis, :]
+    baseline_total = baseline_goal.sum()
+    index_matrix = np.vstack([baseline.product_indexes[p] for p in baseline.products[1:]])
+
+    market_index = np.round((weights @ index_matrix) / 100, 1)
+    growth_goal = np.round(np.abs(baseline_total - national_goals) * market_index / 100, 1)
+    preliminary_goal = baseline_goal + growth_goal
+    adjusted_goal = np.round((preliminary_goal / preliminary_goal.sum(axis=1, keepdims=True)) * national_goals, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth_pct = (adjusted_goal / baseline_goal - 1) * 100
+
+    national_growth = (adjusted_goal.sum(axis=1, keepdims=True) / baseline_total) - 1
+    cap_min_terr_growth = national_growth * min_growths * 100
+    cap_max_terr_growth = national_growth * max_growths * 100
+
+    # Capping growth
+    capped_flag = np.where(
+        growth_pct < cap_min_terr_growth, 1,
+        np.where(growth_pct > cap_max_terr_growth, 2, 0)
+    )
+    # Like Series.clip, inverted bounds are swapped
+    capped_growth_pct = np.clip(
+        growth_pct,
+        np.minimum(cap_min_terr_growth, cap_max_terr_growth),
+        np.maximum(cap_min_terr_growth, cap_max_terr_growth)
+    )
+    initial_capped_goal = np.where(
+        baseline_goal == 0,
+        adjusted_goal,
+        (1 + capped_growth_pct / 100) * baseline_goal
+    )
+
+    # Redistribute to the national goal while keeping every territory inside its cap.
+    # Territories without a baseline have no growth rate, so they are left uncapped.
+    lower = np.where(baseline_goal == 0, 0, (1 + np.minimum(cap_min_terr_growth, cap_max_terr_growth) / 100) * baseline_goal)
+    upper = np.where(baseline_goal == 0, np.inf, (1 + np.maximum(cap_min_terr_growth, cap_max_terr_growth) / 100) * baseline_goal)
+    allocation = solve_capped_allocation(adjusted_goal, lower, upper, national_goals[:, 0])
+    goal_delta = allocation.goals - initial_capped_goal
+
+    return {
+        "Market Index": market_index,
+        "Growth/Potential Goal": growth_goal,
+        "Preliminary Goal": preliminary_goal,
+        "Adjusted Preliminary Goal": adjusted_goal,
+        "Growth%": growth_pct,
+        "Capped Flag": capped_flag,
+        "Capped Growth%": capped_growth_pct,
+        "Initial Capped Goal": initial_capped_goal,
+        "Goal Difference (Delta)": goal_delta,
+        "Final Goal (cartons)": np.round(allocation.goals, 0),
+        "Solver Iterations": allocation.iterations,
+        "Solver Converged": allocation.converged,
+        "National Growth": national_growth[:, 0],
+    }
+
+
+def apply_goal_parameters(baseline: GoalBaseline, national_goal: float, min_growth: float, max_growth: float, product_weights: dict = None, fill_missing_weights: bool = False) -> pd.DataFrame:
+    """
+    Parameter-dependent stage of the goal calculation: market index, preliminary goal,
+    capping and redistribution to the national goal, computed on the cached baseline arrays.
+    Solver instrumentation is stored in df.attrs["capping"].
+
+    Args:
+        baseline (GoalBaseline): Output of prepare_goal_baseline.
+        national_goal (float): The national goal.
+        min_growth (float): Minimum territory growth as a multiple of national growth.
+        max_growth (float): Maximum territory growth as a multiple of national growth.
+        product_weights (dict): Weight per index product, e.g. {"Product 2": 60, "Product 3": 40}.
+            Must name every index product and sum to 100, otherwise ValueError is raised.
+        fill_missing_weights (bool): Give index products missing from product_weights a weight of 0
+            instead of raising.
+
+    Returns:
+        pd.DataFrame: A DataFrame containing the final goal calculation.
+    """
+    arrays = _goal_arrays(
+        baseline,
+        np.array([[national_goal]], dtype=float),
+        np.array([[min_growth]], dtype=float),
+        np.array([[max_growth]], dtype=float),
+        _weight_matrix(baseline, product_weights, 1, fill_missing_weights),
+    )
+    national_growth = arrays.pop("National Growth")
+    iterations = arrays.pop("Solver Iterations")
+    converged = arrays.pop("Solver Converged")
+
+    df = baseline.frame.copy()
+    for column, values in arrays.items():
+        df[column] = values[0]
+    df.attrs["capping"] = {
+        "national_growth": float(national_growth[0]),
+        "iterations": int(iterations[0]),
+        "converged": bool(converged[0]),
+    }
+    return df
+
+
+@dataclass(frozen=True)
+class GoalScenarioResult:
+    """
+    Output of calculate_goals_batch.
+
+    final_goals has shape (scenarios, territories) with territories in the order of
+    territories; summary has one row per scenario.
+    """
+    final_goals: np.ndarray
+    territories: np.ndarray
+    summary: pd.DataFrame
+
+
+def calculate_goals_batch(baseline: GoalBaseline, national_goals, min_growths, max_growths, product_weights=None, chunk_size: int = 512, fill_missing_weights: bool = False) -> GoalScenarioResult:
+    """
+    Evaluates many goal scenarios at once as a (scenarios x territories) NumPy computation.
+
+    Args:
+        baseline (GoalBaseline): Output of prepare_goal_baseline.
+        national_goals: National goal per scenario.
+        min_growths: Minimum growth multiple per scenario (scalar or array).
+        max_growths: Maximum growth multiple per scenario (scalar or array).
+        product_weights: One weight dict for all scenarios, a list of dicts, or an
+            array of shape (scenarios, index products). Validated as in apply_goal_parameters.
+        chunk_size (int): Scenarios evaluated per block, bounding peak memory.
+        fill_missing_weights (bool): Zero-fill index products missing from a weight dict.
+
+    Returns:
+        GoalScenarioResult: float32 final goal matrix plus per-scenario summary stats.
+    """
+    national_goals = np.atleast_1d(np.asarray(national_goals, dtype=float))
+    n_scenarios = len(national_goals)
+    min_growths = np.broadcast_to(np.asarray(min_growths, dtype=float), (n_scenarios,))
+    max_growths = np.broadcast_to(np.asarray(max_growths, dtype=float), (n_scenarios,))
+    weights = _weight_matrix(baseline, product_weights, n_scenarios, fill_missing_weights)
+
+    n_territories = len(baseline.baseline_goal)
+    final_goals = np.empty((n_scenarios, n_territories), dtype=np.float32)
+    national_growth = np.empty(n_scenarios)
+    capped_territories = np.empty(n_scenarios, dtype=np.int64)
+    solver_iterations = np.empty(n_scenarios, dtype=np.int64)
+    solver_converged = np.empty(n_scenarios, dtype=bool)
+    min_growth_pct = np.empty(n_scenarios)
+    max_growth_pct = np.empty(n_scenarios)
+    std_growth_pct = np.empty(n_scenarios)
+    zero_baseline = baseline.baseline_goal == 0
+
+    for start in range(0, n_scenarios, chunk_size):
+        block = slice(start, start + chunk_size)
+        arrays = _goal_arrays(
+            baseline,
+            national_goals[block, np.newaxis],
+            min_growths[block, np.newaxis],
+            max_growths[block, np.newaxis],
+            weights[block],
+        )
+        final_goals[block] = arrays["Final Goal (cartons)"]
+        national_growth[block] = arrays["National Growth"]
+        capped_territories[block] = (arrays["Capped Flag"] > 0).sum(axis=1)
+        solver_iterations[block] = arrays["Solver Iterations"]
+        solver_converged[block] = arrays["Solver Converged"]
+
+        # Growth stats per block, so no (scenarios x territories) float64 matrix is built
+        with np.errstate(divide="ignore", invalid="ignore"):
+            territory_growth = (arrays["Final Goal (cartons)"] / baseline.baseline_goal - 1) * 100
+        territory_growth[:, zero_baseline] = np.nan
+        min_growth_pct[block] = np.nanmin(territory_growth, axis=1)
+        max_growth_pct[block] = np.nanmax(territory_growth, axis=1)
+        std_growth_pct[block] = np.nanstd(territory_growth, axis=1)
+
+    summary = pd.DataFrame({
+        "National Goal": national_goals,
+        "Min Growth": min_growths,
+        "Max Growth": max_growths,
+        "National Growth%": national_growth * 100,
+        "Total Final Goal": final_goals.sum(axis=1, dtype=float),
+        "Min Territory Growth%": min_growth_pct,
+        "Max Territory Growth%": max_growth_pct,
+        "Std Territory Growth%": std_growth_pct,
+        "Capped Territories": capped_territories,
+        "Solver Iterations": solver_iterations,
+        "Solver Converged": solver_converged,
+    })
+    for i, product in enumerate(baseline.products[1:]):
+        summary[f"{product} Weight"] = weights[:, i]
+
+    return GoalScenarioResult(
+        final_goals=final_goals,
+        territories=baseline.frame["Territory"].to_numpy(),
+        summary=summary,
+    )
+
+
+def goals_from_baseline(baseline: GoalBaseline, national_goal: float, min_growth: float, max_growth: float, product_weights: dict = None, output_sink: OutputSink = None, baseline_months: int = None, exclude_months=None, fill_missing_weights: bool = False) -> pd.DataFrame:
+    """
+    Goal calculation on a prepared baseline: rebases it to the baseline window, applies the
+    parameters and hands the table to output_sink. The window is stored in df.attrs["baseline"]
+    and the capping solver in df.attrs["capping"]. Shared by calculate_goals and the goal Pipeline.
+
+    Args:
+        baseline (GoalBaseline): Output of prepare_goal_baseline.
+        Remaining arguments as in calculate_goals.
+
+    Returns:
+        pd.DataFrame: A DataFrame containing the final goal calculation.
+    """
+    baseline = rebase_goal_baseline(baseline, baseline_months, exclude_months)
+    df = apply_goal_parameters(baseline, national_goal, min_growth, max_growth, product_weights, fill_missing_weights)
+    df.attrs["baseline"] = {"months": int(baseline.baseline_months), "excluded_cells": int(baseline.excluded_cells)}
+    if output_sink is not None:
+        write_async(output_sink, df)
+    return df
+
+
+def calculate_goals(national_goal: int, sales_file_path: str, min_growth: int, max_growth: int,product_weights: dict = None, loader: WorkbookLoader = None, output_sink: OutputSink = None, streaming: bool = False, baseline_months: int = None, exclude_months=None, products: list = None, fill_missing_weights: bool = False) -> pd.DataFrame:
     """
     Calculates IC goals using the national goal and input Excel data.
+
+    The workbook-dependent stage is cached (see prepare_goal_baseline), so repeated
+    what-if calls with new parameters only rerun apply_goal_parameters.
     
     Args:
         national_goal (int): The national goal as a whole number.
         sales_file_path (str): Path to the input Excel file.
+        loader (WorkbookLoader): Optional shared loader so the workbook is opened once per request.
+        output_sink (OutputSink): Optional destination (see OutputSinks.make_sink). The write runs
+            on a background thread; call OutputSinks.flush_outputs() to wait for it.
+        streaming (bool): Stream the sales sheet in chunks with compact dtypes (large files).
+        baseline_months (int): Baseline period in months, 1–6 (default 6).
+        exclude_months: Months to drop from the baseline, e.g. disaster-matched Territory / Month
+            pairs (see baseline_month_mask).
+        products (list): Goal product followed by the index products (default PRODUCTS).
+        fill_missing_weights (bool): Zero-fill index products missing from product_weights
+            instead of raising ValueError.
         
     Returns:
         pd.DataFrame: A DataFrame containing the final goal calculation.
@@ -39,89 +619,11 @@ def calculate_goals(national_goal: int, sales_file_path: str, min_growth: int, m
     try:
         print(f"📌 National Goal received: {national_goal}")
 
-        r12_months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun"]
-        products = ["Product 1", "Product 2", "Product 3"]
-        if product_weights is None:
-            product_weights = {"Product 2": 60, "Product 3": 40}
-            
-        Region_name = {
-            101: "East Division",
-            201: "West Division",
-            301: "Central Division"
-        }
-       
-
-        # Load Excel data
-        df_sales = pd.read_excel(sales_file_path, sheet_name='Input Sales_Anomaly_Introduced')
-        df_mapping = pd.read_excel(sales_file_path, sheet_name='1c. Inputs - Mappings', skiprows=5, usecols="C:D")
-        df_mapping.drop_duplicates(inplace=True)
-
-        # Merge mappings
-        df = df_sales.merge(df_mapping, how="left", left_on="Territory", right_on="TS Territory")
-        df.drop("TS Territory", axis=1, inplace=True)
-        df["Region"] = df["Region"].astype(int)
-        df["Region Name"] = df["Region"].map(Region_name)
-        
-        #print(df.head())
-        
-
-        # Calculate R12 totals
-        for product in products:
-            df[f"{product} R12 Total"] = df[[f"{product} R12 {month}" for month in r12_months]].sum(axis=1)
-
-        df = df[["Region","Region Name", "Territory", "Territory Name"] + [f"{p} R12 Total" for p in products]]
-        df['Baseline Goal'] = df[f'{products[0]} R12 Total'] / 2
-        baseline_goal = df['Baseline Goal'].sum()
-        
-        for product in products[1:]:
-            df[f"{product} Index"] = np.round(
-                (df[f"{product} R12 Total"] / df[f"{product} R12 Total"].sum()) * 100, 1
-            )
-
-        df['Market Index'] = sum(df[f"{p} Index"] * product_weights[p] for p in products[1:])
-        df['Market Index'] = np.round(df['Market Index'] / 100, 1)
-
-        df["Growth/Potential Goal"] = np.round(abs(baseline_goal - national_goal) * df['Market Index'] / 100, 1)
-        df["Preliminary Goal"] = df['Baseline Goal'] + df["Growth/Potential Goal"]
-        df['Adjusted Preliminary Goal'] = np.round(
-            (df["Preliminary Goal"] / df["Preliminary Goal"].sum()) * national_goal, 1
+        baseline = prepare_goal_baseline(sales_file_path, loader=loader, streaming=streaming, products=products)
+        return goals_from_baseline(
+            baseline, national_goal, min_growth, max_growth, product_weights, output_sink,
+            baseline_months=baseline_months, exclude_months=exclude_months, fill_missing_weights=fill_missing_weights
         )
-        df['Growth%'] = (df['Adjusted Preliminary Goal'] / df['Baseline Goal'] - 1) * 100
-       
-        National_Growth=(df['Adjusted Preliminary Goal'].sum()/df['Baseline Goal'].sum())-1
-        
-        cap_min_terr_growth = National_Growth*min_growth*100
-        cap_max_terr_growth = National_Growth*max_growth*100
-        print(National_Growth, min_growth, max_growth)
-        print(cap_min_terr_growth,cap_max_terr_growth)
-        
-        # Capping growth
-        df['Capped Flag'] = np.where(
-            df['Growth%'] < cap_min_terr_growth, 1,
-            np.where(df['Growth%'] > cap_max_terr_growth, 2, 0)
-        )
-        df['Capped Growth%'] = df['Growth%'].clip(lower=cap_min_terr_growth, upper=cap_max_terr_growth)
-
-        df['Initial Capped Goal'] = np.where(
-            df['Baseline Goal'] == 0,
-            df['Growth%'],
-            (1 + df['Capped Growth%'] / 100) * df['Baseline Goal']
-        )
-        
-        
-        total_diff = max(0, df['Adjusted Preliminary Goal'].sum() - df['Initial Capped Goal'].sum())
-        df['Spare growth'] = np.where(
-            total_diff > 0,
-            (cap_max_terr_growth / 100 - df['Capped Growth%'] / 100) * df['Baseline Goal'],
-            (df['Capped Growth%'] / 100 - cap_min_terr_growth / 100) * df['Baseline Goal']
-        )
-
-        total_spare_growth = df['Spare growth'].sum()
-        df["% of Nation"] = df['Spare growth'] / total_spare_growth * 100
-        df["Goal Difference (Delta)"] = df["% of Nation"] * total_diff
-        df["Final Goal (cartons)"] = np.round(df["Goal Difference (Delta)"] + df['Initial Capped Goal'], 0)
-        df.to_excel("output\calculated_goals.xlsx",index=False)
-        return df
 
     except Exception as e:
         print(f"Error calculating goals: {str(e)}")
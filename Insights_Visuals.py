@@ -1,18 +1,21 @@
-import plotly.express as px
 import plotly.graph_objects as go
 import json
 import re
 import pandas as pd
 import streamlit as st
-import anthropic
 from dotenv import load_dotenv
 from GoalCalculationN import calculate_goals
+from WorkbookCache import WorkbookLoader, frame_hash
+from TerritoryTable import TerritoryTable
+from LLMCache import cached_stream
+from LLMGateway import IncrementalJSONParser, get_llm_gateway
+from MessageRenderer import figure_cache
 import os
 import numpy as np
 
 # Load API Key
 load_dotenv()
-client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+llm = get_llm_gateway()
 
 # Initialize session state
 if "Insights_messages" not in st.session_state:
@@ -22,8 +25,20 @@ if "Insights_messages" not in st.session_state:
 # if st.button("🧹 Clear chat"):
 #     st.session_state.messages = []
 
-def previous_quarter_sales():
-    df = pd.read_excel('Goal Setting sanitized Data.xlsx', sheet_name='Input Sales')  # Assuming header starts at row 4
+def previous_quarter_sales(loader: WorkbookLoader = None, table: TerritoryTable = None):
+    if table is not None:
+        # Sum Apr–Jun straight from the array-backed table, no frame copy
+        return pd.DataFrame({
+            "Territory": table.territory_ids.astype(np.int64),
+            "Territory Name": table.territory_names(),
+            "Product 1 Q2": table.r12_totals(["Apr", "May", "Jun"])[table.products.index("Product 1")],
+        })
+
+    if loader is None:
+        with WorkbookLoader('Goal Setting sanitized Data.xlsx') as loader:
+            df = loader.read('Input Sales')  # Assuming header starts at row 4
+    else:
+        df = loader.read('Input Sales')
 
     # Clean column names
     df.columns = df.columns
@@ -33,20 +48,36 @@ def previous_quarter_sales():
         "Product 1 R12 Jun"
     ]
 
-    df["Product 1 Q2"] = df[columns_to_sum].sum(axis=1)
+    df = df.assign(**{"Product 1 Q2": df[columns_to_sum].sum(axis=1)})
     df=df[["Territory", "Territory Name", "Product 1 Q2"]]
     
     return df
 
 
+def _parse_json_response(text: str) -> dict:
+    return json.loads(re.sub(r"[\x00-\x1F\x7F]", "", text.strip()))
+
+
+def _render_partial_field(placeholder, key: str, template: str):
+    # on_text callback: shows the string field as it streams in
+    parser = IncrementalJSONParser()
+
+    def on_text(text: str):
+        parser.feed(text[len(parser.text):])
+        value = parser.partial_string(key)
+        if value:
+            placeholder.markdown(template.format(value))
+    return on_text
+
+
 def run_goal_distribution_analysis(calculated_df):
     # Step 1: Summarize the dataset
     dataset_summary = (
         f"Columns: {list(calculated_df.columns)}\n"
         f"Shape: {calculated_df.shape}\n"
         f"Descriptive Statistics:\n{calculated_df.describe().to_string()}"
-        f"\nRegion by Goal:\n{calculated_df.groupby("Region Name")["Final Goal (cartons)"].sum().reset_index()}"
-        f"\nTerritory by Goal:\n{calculated_df.groupby("Territory Name")["Final Goal (cartons)"].sum().reset_index()}"
+        f"\nRegion by Goal:\n{calculated_df.groupby('Region Name')['Final Goal (cartons)'].sum().reset_index()}"
+        f"\nTerritory by Goal:\n{calculated_df.groupby('Territory Name')['Final Goal (cartons)'].sum().reset_index()}"
     )
 
     # Step 2: Generate question
@@ -71,13 +102,18 @@ def run_goal_distribution_analysis(calculated_df):
     {dataset_summary}
     """
 
+    question_placeholder = st.empty()
     try:
-        response = client.messages.create(
+        # Cached by a hash of the prompt, so an unchanged goal table skips the API call on rerun;
+        # on a miss the question is shown as it streams in
+        parsed = cached_stream(
+            llm,
+            parse=_parse_json_response,
+            on_text=_render_partial_field(question_placeholder, "question", "📊 **{}**"),
             model="claude-3-5-sonnet-20241022",
             messages=[{"role": "user", "content": prompt_q}],
             max_tokens=300
         )
-        parsed = json.loads(re.sub(r"[\x00-\x1F\x7F]", "", response.content[0].text.strip()))
         question = parsed.get("question", "")
     except Exception as e:
         st.session_state.Insights_messages.append(("bot", f"⚠️ Failed to generate the question: {e}"))
@@ -86,129 +122,49 @@ def run_goal_distribution_analysis(calculated_df):
     if not question:
         st.session_state.Insights_messages.append(("bot", "⚠️ Couldn't generate a question about goal distribution."))
         return
+    question_placeholder.markdown(f"📊 **{question}**")
 
-    # Step 3: Determine chart configuration
-    viz_prompt = f"""
-    You are a data visualization expert.
-
-    Your task is to analyze a dataset and suggest the best chart to **show how goals or targets are distributed across regions or territories**.
-
-    Here is the user's question:
-    "{question}"
-
-    Here are the available dataset columns:
-    {list(calculated_df.columns)}
-
-    Please output ONLY a JSON object with the following structure:
-    {{
-    "title": "A concise, human-readable chart title summarizing the question",
-    "chart_type": "Recommended chart type (e.g., 'bar', 'column', 'pie', etc.)",
-    "x": "Column name to use for the x-axis (e.g., 'Region', 'Territory')",
-    "y": "Column name to use for the y-axis (e.g., 'Final Goal (cartons)', 'Adjusted Preliminary Goal')"
-    }}
-
-    The goal is to help a business user understand how goals are allocated by region or territory. Choose fields that best represent this distribution.
-    """
-
-
-    try:
-        viz_response = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            messages=[{"role": "user", "content": viz_prompt}],
-            max_tokens=300
-        )
-        chart_cfg = json.loads(re.sub(r"[\x00-\x1F\x7F]", "", viz_response.content[0].text.strip()))
-    except Exception as e:
-        st.session_state.Insights_messages.append(("bot", f"⚠️ Failed to get chart config: {e}"))
-        return
-
-    # Step 4: Generate the chart
-    x_col = chart_cfg.get("x", calculated_df.columns[0])
-    y_col = chart_cfg.get("y", calculated_df.columns[1])
-    chart_type = chart_cfg.get("chart_type", "bar")
-    title = chart_cfg.get("title", "Goal Distribution Chart")
-    
+    # Step 3: Chart the capped growth of the top and bottom territories. This chart is
+    # always drawn, so no LLM chart suggestion is requested for it
     goal_col = "Final Goal (cartons)"
-    territory_col = "Territory Name"
-    
-    top_10 = calculated_df.nlargest(10, goal_col)
-    bottom_10 = calculated_df.nsmallest(10, goal_col)
-    calculated_df = pd.concat([top_10, bottom_10]).sort_values(by=goal_col, ascending=False).reset_index(drop=True)
-    
-    if x_col.lower()=="region":
-        x_col="Region Name"
-    elif x_col.lower()=="territory" or x_col.lower()=="territory id" or x_col.lower()=="territory_id":
-        x_col="Territory Name"    
-    
-    if y_col.lower()=="region":
-        y_col="Region Name"
-    elif y_col.lower()=="territory" or y_col.lower()=="territory id" or y_col.lower()=="territory_id":
-        y_col="Territory Name"        
-    
-    #st.write(chart_type)  
-    chart_type="bar"  
-    calculated_df['Capped Amount'] = calculated_df['Growth%'] - calculated_df['Capped Growth%']
 
-    if chart_type == "bar" or chart_type == "column":
-        previous_df = previous_quarter_sales()
-
-        # Optional merge with previous data if needed
-        # merged_df = calculated_df.merge(
-        #     previous_df[['Territory', 'Product 1 Q2']],
-        #     on='Territory',
-        #     how='inner'
-        # )
+    # The figure is cached as JSON per goal table, so reruns skip rebuilding it
+    def build_figure(calculated_df):
+        top_10 = calculated_df.nlargest(10, goal_col)
+        bottom_10 = calculated_df.nsmallest(10, goal_col)
+        calculated_df = pd.concat([top_10, bottom_10]).sort_values(by=goal_col, ascending=False).reset_index(drop=True)
+        calculated_df['Capped Amount'] = calculated_df['Growth%'] - calculated_df['Capped Growth%']
 
         # Stacked Bar using go for capped logic
-        if chart_type == "bar":
-            total_growth = (calculated_df['Capped Growth%'] + calculated_df['Capped Amount']).to_numpy().reshape(-1, 1)
-            fig = go.Figure(data=[
-                go.Bar(
-                    name='Capped Growth%',
-                    x=calculated_df['Territory Name'],
-                    y=calculated_df['Capped Growth%'],
-                    marker_color='blue',
-                    hovertemplate='Capped Growth: %{y:.2f}%<extra></extra>'
-                ),
-                go.Bar(
-                    name='Total Growth%',
-                    x=calculated_df['Territory Name'],
-                    y=calculated_df['Capped Amount'],
-                    marker_color='orange',
-                    customdata=total_growth,
-                    hovertemplate='Total Growth: %{customdata:.2f}%<extra></extra>'
-                )
-            ])
-            fig.update_layout(
-                title='Total vs Capped Growth % by Territory',
-                xaxis_title='Territory',
-                yaxis_title='Growth %',
-                barmode='stack'
-            )
-        elif chart_type == "column":
-            fig = go.Figure(data=[
-                go.Bar(name='Capped Growth%', y=calculated_df['Territory Name'], x=calculated_df['Capped Growth%'], marker_color='blue', orientation='h'),
-                go.Bar(name='Total Growth%', y=calculated_df['Territory Name'], x=calculated_df['Capped Amount'], marker_color='orange', orientation='h')
-            ])
-            fig.update_layout(
-                title='Total vs Capped Growth % by Territory',
-                xaxis_title='Growth %',
-                yaxis_title='Territory',
-                barmode='stack'
+        total_growth = (calculated_df['Capped Growth%'] + calculated_df['Capped Amount']).to_numpy().reshape(-1, 1)
+        fig = go.Figure(data=[
+            go.Bar(
+                name='Capped Growth%',
+                x=calculated_df['Territory Name'],
+                y=calculated_df['Capped Growth%'],
+                marker_color='blue',
+                hovertemplate='Capped Growth: %{y:.2f}%<extra></extra>'
+            ),
+            go.Bar(
+                name='Total Growth%',
+                x=calculated_df['Territory Name'],
+                y=calculated_df['Capped Amount'],
+                marker_color='orange',
+                customdata=total_growth,
+                hovertemplate='Total Growth: %{customdata:.2f}%<extra></extra>'
             )
+        ])
+        fig.update_layout(
+            title='Total vs Capped Growth % by Territory',
+            xaxis_title='Territory',
+            yaxis_title='Growth %',
+            barmode='stack'
+        )
+        return fig
 
-    elif chart_type == "pie":
-        fig = px.pie(calculated_df, names=x_col, values=y_col, title=title)
-
-    elif chart_type == "line":
-        fig = px.line(calculated_df, x=x_col, y=y_col, title=title)
-
-    else:
-        fig = px.bar(calculated_df, x=x_col, y=y_col, title=title)
-    #st.session_state.Insights_messages.append(("bot", f"📊 **{question}**"))
-    # if "notes" in chart_cfg:
-    #     st.session_state.Insights_messages.append(("bot", f"📌 *Note: {chart_cfg['notes']}*"))
-    st.plotly_chart(fig, use_container_width=True)
+    figure_key = (frame_hash(calculated_df), "capped_growth")
+    figure_json = figure_cache.get_or_build(figure_key, lambda: build_figure(calculated_df))
+    st.plotly_chart(json.loads(figure_json), use_container_width=True)
 
     # # Step 5: Generate insights
     # insight_prompt = f"""
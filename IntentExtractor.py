@@ -0,0 +1,382 @@
+import re
+import threading
+import time
+from LLMGateway import CONVERSATION_HEADING
+
+FAST_PATH_MIN_CONFIDENCE = 0.8
+DEFAULT_WEIGHTS = {"Product 2": 60, "Product 3": 40}
+DEFAULT_BASELINE_MONTHS = 6
+
+INTENT_FIELDS = (
+    "name", "quarter", "goal", "min_territory_growth", "max_territory_growth",
+    "product_weights", "baseline_period", "exclude_disaster_months", "intent", "suggestion",
+)
+
+# Suggested-question buttons with a fixed meaning (others go to the LLM)
+BUTTON_SLOTS = {
+    "calculate goal for q3?": {"quarter": "Q3"},
+}
+
+ASK_GOAL_FIELDS = "Please tell me your quarter, national goal, and territory growth range."
+ASK_WEIGHTS = "🧮 Please confirm product weights — default is Product 2: 60%, Product 3: 40%. Would you like to proceed with these or update them?"
+ASK_BASELINE = "🕒 Please confirm baseline period (3 or 6 months). For Q1/Q2, 6 months was used. Do you want to keep it or change it?"
+ASK_EXCLUDE = "⚠️ Would you like to exclude the disaster-affected months from the baseline calculation?"
+BASELINE_PERIOD_ERROR = "⚠️ Baseline period must be 6 months or less. Please provide a number from 1 to 6."
+
+# Extraction prompt for the LLM fallback; filled in by extraction_prompt
+EXTRACTION_PROMPT = """
+    You are a helpful assistant that helps users calculate quarterly sales goals.
+
+    Your job is to extract structured information from the conversation.
+
+    ### Required fields:
+    - name: the user's name (if mentioned)
+    - quarter: sales quarter (Q3 or Q4 only)
+    - goal: national goal amount (number)
+    - min_territory_growth: minimum expected territory growth percentage (number)
+    - max_territory_growth: maximum expected territory growth percentage (number)
+    - product_weights: e.g., {{ "Product 2": 60, "Product 3": 40 }}, or null if not confirmed
+    - baseline_period: a number between 1 and 6 (months), or null if not confirmed
+    - exclude_disaster_months: true, false, or null (depending on whether user confirmed to exclude FEMA-impacted months from baseline)
+    - intent: one of "goal_calculation", "general_greeting", "out_of_scope"
+    - suggestion: a friendly next message to the user
+
+    ### Behavior:
+    - Begin goal calculation only when these are present:
+        - quarter, goal, min/max territory growth
+        - product_weights, baseline_period
+        - exclude_disaster_months is either true or false
+    - If product_weights or baseline_period is missing, prompt like:
+        - 🧮 "Please confirm product weights — default is Product 2: 60%, Product 3: 40%. Would you like to proceed with these or update them?"
+        - 🕒 "Please confirm baseline period (3 or 6 months). For Q1/Q2, 6 months was used. Do you want to keep it or change it?"
+
+    - If FEMA-related disaster months were shown, wait for user's input about exclusion:
+        - If user says something like "Yes, exclude disaster months", set exclude_disaster_months = true
+        - If user says "No, include all months", set exclude_disaster_months = false
+        - If no decision yet, set it to null and ask:
+        - ⚠️ "Would you like to exclude the disaster-affected months from the baseline calculation?"
+
+    - If quarter is Q1 or Q2, respond with:
+    - "Sales data already exists for Q1 and Q2. Please calculate goals for Q3 or Q4."
+
+    - If user greets, respond politely and ask for required fields.
+
+    - If the topic is unrelated to sales goal calculation, respond:
+    - "This is outside of sales goal calculation. I can't help with that."
+
+    ### Respond ONLY with a valid JSON object:
+    {{
+    "name": "<name or null>",
+    "quarter": "<quarter or null>",
+    "goal": "<goal or null>",
+    "min_territory_growth": <number or null>,
+    "max_territory_growth": <number or null>,
+    "product_weights": {{ "Product 2": 60, "Product 3": 40 }} or null,
+    "baseline_period": <1–6 or null>,
+    "exclude_disaster_months": true | false | null,
+    "intent": "<goal_calculation | general_greeting | out_of_scope>",
+    "suggestion": "<next thing you want the user to do>"
+    }}
+
+    ### Already confirmed fields (keep these in your JSON unless the user changes them):
+    {known_fields}
+
+    {conversation_heading}
+    {recent_turns}
+    """
+
+_NUMBER = r"(-?\d[\d,]*(?:\.\d+)?)"
+_NAME_RE = re.compile(r"\b(?:i am|i'm|my name is|this is)\s+([A-Za-z][a-z]+)", re.IGNORECASE)
+_WEIGHT_RE = re.compile(r"product\s*(\d+)\s*[:=]?\s*(?:at\s*)?" + _NUMBER + r"\s*%?", re.IGNORECASE)
+_WEIGHT_SPLIT_RE = re.compile(r"weights?\D{0,20}?(\d+(?:\.\d+)?)\s*%?\s*/\s*(\d+(?:\.\d+)?)\s*%?", re.IGNORECASE)
+_BASELINE_RE = re.compile(r"(?:baseline\D{0,20}?(\d+)(?:\s*-?\s*months?)?|\b(\d+)\s*-?\s*months?)", re.IGNORECASE)
+_QUARTER_RE = re.compile(r"\b(?:q([1-4])|quarter\s*([1-4])|(first|second|third|fourth)\s+quarter)\b", re.IGNORECASE)
+_GROWTH_RE = re.compile(
+    r"(?:growth|range|between|from)\D{0,25}?" + _NUMBER + r"\s*%?\s*(?:to|-|–|and)\s*" + _NUMBER + r"\s*%?",
+    re.IGNORECASE,
+)
+_MIN_GROWTH_RE = re.compile(r"\bmin(?:imum)?\b\D{0,25}?" + _NUMBER + r"\s*%?", re.IGNORECASE)
+_MAX_GROWTH_RE = re.compile(r"\bmax(?:imum)?\b\D{0,25}?" + _NUMBER + r"\s*%?", re.IGNORECASE)
+_GROWTH_WORD_RE = re.compile(r"\b(growth|range)\b", re.IGNORECASE)
+_GOAL_RE = re.compile(r"(goal\D{0,20}?)?\b" + _NUMBER + r"\s*(k)?\b", re.IGNORECASE)
+_NUMBER_RE = re.compile(r"\d[\d,]*(?:\.\d+)?")
+_YEAR_RE = re.compile(r"(19|20)\d\d")
+_GREETING_RE = re.compile(r"^\s*(hi|hello|hey|good (morning|afternoon|evening))\b", re.IGNORECASE)
+_CONFIRM_RE = re.compile(r"\b(yes|yeah|yep|ok|okay|sure|proceed|continue|keep|default|go ahead|fine|sounds good|confirm(ed)?)\b", re.IGNORECASE)
+_DECLINE_RE = re.compile(r"\b(no|nope|don't|do not|dont|include all)\b", re.IGNORECASE)
+_EXCLUDE_RE = re.compile(r"\bexclud(e|ing)\b", re.IGNORECASE)
+_WORD_RE = re.compile(r"[a-z']+|\d+", re.IGNORECASE)
+
+_ORDINAL_QUARTERS = {"first": "1", "second": "2", "third": "3", "fourth": "4"}
+
+# Words that carry no slot information; anything else left unexplained lowers confidence
+_FILLER = set("""
+a an and the for with to of in on at by is are be it this that them those these please pls can could would you
+i i'm im me my we us our let's lets want need like set use using calculate calc compute run goal goals
+national territory territories growth range min max minimum maximum between from percent baseline
+period month months weight weights product products quarter q with default defaults
+yes yeah yep ok okay sure proceed continue keep go ahead fine sounds good confirm confirmed
+no nope don't dont do not include exclude excluding all disaster disasters affected impacted fema
+hi hello hey morning afternoon evening thanks thank
+""".split())
+
+
+def _number(text: str, thousands: bool = False) -> float:
+    value = float(text.replace(",", "")) * (1000 if thousands else 1)
+    return int(value) if value.is_integer() else value
+
+
+def _strip_html(text: str) -> str:
+    return re.sub(r"<[^>]+>", " ", text or "")
+
+
+def _parse_user_message(text: str, previous_bot: str) -> tuple:
+    """
+    Extracts slots from one user message. Returns (slots, confidence, greeting) where
+    confidence is the share of content words explained by the rules.
+    """
+    slots, spans = {}, []
+
+    def take(match):
+        spans.append(match.span())
+
+    button = BUTTON_SLOTS.get(text.strip().lower())
+    if button:
+        return dict(button), 1.0, False
+
+    for match in _NAME_RE.finditer(text):
+        slots["name"] = match.group(1).capitalize()
+        take(match)
+
+    weights = {}
+    for match in _WEIGHT_RE.finditer(text):
+        weights[f"Product {match.group(1)}"] = _number(match.group(2))
+        take(match)
+    split = _WEIGHT_SPLIT_RE.search(text)
+    if not weights and split:
+        weights = {"Product 2": _number(split.group(1)), "Product 3": _number(split.group(2))}
+        take(split)
+    if weights:
+        slots["product_weights"] = weights
+
+    for match in _BASELINE_RE.finditer(text):
+        if any(s <= match.start() < e for s, e in spans):
+            continue
+        slots["baseline_period"] = int(match.group(1) or match.group(2))
+        take(match)
+
+    for match in _QUARTER_RE.finditer(text):
+        number = match.group(1) or match.group(2) or _ORDINAL_QUARTERS[match.group(3).lower()]
+        slots["quarter"] = f"Q{number}"
+        take(match)
+
+    def unmatched() -> str:
+        return "".join(" " if any(s <= i < e for s, e in spans) else c for i, c in enumerate(text))
+
+    growth = _GROWTH_RE.search(unmatched())
+    if growth:
+        slots["min_territory_growth"] = _number(growth.group(1))
+        slots["max_territory_growth"] = _number(growth.group(2))
+        take(growth)
+    else:
+        # "min growth 1 and max growth 2"
+        low, high = _MIN_GROWTH_RE.search(unmatched()), _MAX_GROWTH_RE.search(unmatched())
+        if low and high:
+            slots["min_territory_growth"] = _number(low.group(1))
+            slots["max_territory_growth"] = _number(high.group(1))
+            take(low)
+            take(high)
+
+    # The goal is a number after "goal", or else the only remaining number >= 100;
+    # 4-digit years are never taken as the goal
+    candidates = []
+    for match in _GOAL_RE.finditer(unmatched()):
+        value = _number(match.group(2), thousands=bool(match.group(3)))
+        is_year = not match.group(3) and _YEAR_RE.fullmatch(match.group(2))
+        if abs(value) >= 100 and not is_year:
+            candidates.append((bool(match.group(1)), value, match))
+    in_context = [c for c in candidates if c[0]]
+    chosen = in_context[0] if in_context else (candidates[0] if len(candidates) == 1 else None)
+    if chosen:
+        slots["goal"] = chosen[1]
+        take(chosen[2])
+
+    # Yes / no answers apply to whatever the assistant asked last
+    asked = _strip_html(previous_bot).lower()
+    confirm, decline = _CONFIRM_RE.search(text), _DECLINE_RE.search(text)
+    if _EXCLUDE_RE.search(text) or "exclude" in asked:
+        if decline or re.search(r"\binclude all\b", text, re.IGNORECASE):
+            slots["exclude_disaster_months"] = False
+        elif _EXCLUDE_RE.search(text) or confirm:
+            slots["exclude_disaster_months"] = True
+    if confirm and not decline:
+        if "product weights" in asked and "product_weights" not in slots:
+            slots["product_weights"] = dict(DEFAULT_WEIGHTS)
+        if "baseline period" in asked and "baseline_period" not in slots:
+            slots["baseline_period"] = DEFAULT_BASELINE_MONTHS
+
+    masked = "".join(" " if any(s <= i < e for s, e in spans) else c for i, c in enumerate(text))
+    words = _WORD_RE.findall(text)
+    leftover = [w for w in _WORD_RE.findall(masked) if w.lower() not in _FILLER]
+    confidence = 1.0 - len(leftover) / max(len(words), 1)
+    # A name alone ("Hi, I am Priya") keeps the message a greeting
+    greeting = bool(_GREETING_RE.match(text)) and not set(slots) - {"name"}
+    if not slots and not greeting:
+        confidence = 0.0
+    # Numbers the rules could not place, or a growth range they could not read, go to the LLM
+    if len(_NUMBER_RE.findall(masked)) > 1:
+        confidence = 0.0
+    if _GROWTH_WORD_RE.search(text) and "min_territory_growth" not in slots:
+        confidence = 0.0
+    # "No" to a weights or baseline question means the user wants to change it: leave it to the LLM
+    if decline and "exclude_disaster_months" not in slots:
+        confidence = 0.0
+    return slots, confidence, greeting
+
+
+def coerce_baseline_period(value):
+    """
+    Reads the baseline period from the rules or the LLM, which may return it as a string (e.g. "6").
+
+    Returns:
+    - the period in whole months, or None when it is not given yet
+
+    Raises:
+    - ValueError when it is not a whole number of months from 1 to 6
+    """
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    try:
+        months = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Baseline period is not a number: {value!r}") from None
+    if not months.is_integer() or not 1 <= months <= 6:
+        raise ValueError(f"Baseline period must be 1 to 6 months: {value!r}")
+    return int(months)
+
+
+def extraction_prompt(known_fields: str, recent_turns: str) -> str:
+    """
+    Builds the LLM extraction prompt from the slot summary and recent turns
+    (see ConversationState.context).
+    """
+    return EXTRACTION_PROMPT.format(
+        known_fields=known_fields, recent_turns=recent_turns, conversation_heading=CONVERSATION_HEADING
+    )
+
+
+def _suggestion(state: dict) -> str:
+    if state["quarter"] in ("Q1", "Q2"):
+        return "Sales data already exists for Q1 and Q2. Please calculate goals for Q3 or Q4."
+    if not all(state[k] is not None for k in ("quarter", "goal", "min_territory_growth", "max_territory_growth")):
+        return ASK_GOAL_FIELDS
+    if state["baseline_period"] is None:
+        return ASK_BASELINE
+    if state["product_weights"] is None:
+        return ASK_WEIGHTS
+    if state["exclude_disaster_months"] is None:
+        return ASK_EXCLUDE
+    return "Calculating your goals now."
+
+
+def extract_slots(messages, known: dict = None) -> tuple:
+    """
+    Rule-based extraction over the chat, in the same JSON shape the LLM returns.
+
+    Parameters:
+    - messages: list of (sender, text) as kept in st.session_state.messages
+    - known: slots already confirmed on earlier turns (see ConversationState). When
+      given, only the latest user message is parsed, on top of these slots.
+
+    Returns:
+    - (data dict, confidence): confidence is the lowest per-message confidence, so a
+      single message the rules could not explain sends the turn to the LLM
+    """
+    state = dict.fromkeys(INTENT_FIELDS)
+    if known is not None:
+        state.update(known)
+        last_user = max((i for i, (sender, _) in enumerate(messages) if sender == "user"), default=None)
+        last_bot = max((i for i, (sender, _) in enumerate(messages[:last_user or 0]) if sender not in ("user", "DQ", "image")), default=None)
+        messages = [messages[i] for i in (last_bot, last_user) if i is not None]
+    confidence, greeting, previous_bot = 1.0, False, ""
+    seen_user = False
+    for sender, text in messages:
+        if sender in ("DQ", "image"):
+            continue
+        if sender != "user":
+            previous_bot = text
+            continue
+        seen_user = True
+        slots, message_confidence, greeting = _parse_user_message(text, previous_bot)
+        state.update(slots)
+        confidence = min(confidence, message_confidence)
+
+    if not seen_user:
+        return state, 0.0
+    if state["quarter"] in ("Q1", "Q2"):
+        confidence = 0.0  # the LLM phrases the Q1/Q2 refusal
+    has_goal_slots = any(state[k] is not None for k in ("quarter", "goal", "min_territory_growth", "max_territory_growth"))
+    state["intent"] = "goal_calculation" if has_goal_slots or not greeting else "general_greeting"
+    state["suggestion"] = _suggestion(state) if state["intent"] == "goal_calculation" else ASK_GOAL_FIELDS
+    return state, confidence
+
+
+class IntentExtractor:
+    """
+    Tries extract_slots first and only calls the LLM when the rules are not confident,
+    counting fast-path hits and the latency of both paths.
+    """
+
+    def __init__(self, min_confidence: float = FAST_PATH_MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self.fast_hits = 0
+        self.llm_calls = 0
+        self.fast_seconds = 0.0
+        self.llm_seconds = 0.0
+
+    def extract(self, messages, llm_fallback, known: dict = None) -> dict:
+        """
+        Parameters:
+        - messages: list of (sender, text) as kept in st.session_state.messages
+        - llm_fallback: zero-argument function returning the LLM's parsed JSON dict
+        - known: slots confirmed on earlier turns (see extract_slots)
+
+        Returns:
+        - dict with the INTENT_FIELDS keys
+        """
+        start = time.perf_counter()
+        data, confidence = extract_slots(messages, known)
+        fast_seconds = time.perf_counter() - start
+        if confidence >= self.min_confidence:
+            with self._lock:
+                self.fast_hits += 1
+                self.fast_seconds += fast_seconds
+            return data
+
+        start = time.perf_counter()
+        data = llm_fallback()
+        with self._lock:
+            self.llm_calls += 1
+            self.fast_seconds += fast_seconds
+            self.llm_seconds += time.perf_counter() - start
+        return data
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.fast_hits + self.llm_calls
+            return {
+                "requests": total,
+                "fast_path_hits": self.fast_hits,
+                "llm_calls": self.llm_calls,
+                "hit_rate": self.fast_hits / total if total else None,
+                "avg_fast_ms": self.fast_seconds / total * 1000 if total else None,
+                "avg_llm_ms": self.llm_seconds / self.llm_calls * 1000 if self.llm_calls else None,
+            }
+
+
+_extractor = IntentExtractor()
+
+
+def get_intent_extractor() -> IntentExtractor:
+    return _extractor
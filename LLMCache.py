@@ -0,0 +1,244 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from WorkbookCache import CACHE_DIR
+
+LLM_CACHE_PATH = os.path.join(CACHE_DIR, "llm_responses.json")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("IC_AGENT_LLM_CACHE_TTL", 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = 256
+LLM_CACHE_FLUSH_SECONDS = float(os.getenv("IC_AGENT_LLM_CACHE_FLUSH", 2.0))
+
+
+def request_key(**request) -> str:
+    """
+    Returns a content hash of an LLM request (model, messages, max_tokens, ...).
+    Prompts embed the dataset summary, so an unchanged goal table gives the same key.
+    """
+    payload = json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    LRU cache of LLM response texts with a TTL, persisted to a JSON file so it
+    survives Streamlit reruns and restarts.
+
+    Parameters:
+    - path: JSON file the entries are stored in (None keeps the cache in memory only)
+    - ttl_seconds: entries older than this are treated as missing
+    - max_entries: least recently used entries beyond this are evicted
+    - flush_seconds: writes are debounced by this long, so a burst of new entries is
+      saved once (0 writes on every set); pending entries are also flushed at exit
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl_seconds: float = LLM_CACHE_TTL_SECONDS, max_entries: int = LLM_CACHE_MAX_ENTRIES, flush_seconds: float = LLM_CACHE_FLUSH_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.flush_seconds = flush_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._dirty = False
+        self._flush_timer = None
+        self._load()
+        if self.path:
+            atexit.register(self.flush)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable LLM cache {self.path}: {e}")
+            return
+        now = time.time()
+        # Stored oldest-used first, so insertion order rebuilds the LRU order
+        for key, (created, text) in entries.items():
+            if now - created <= self.ttl_seconds:
+                self._entries[key] = (created, text)
+
+    def _mark_dirty(self) -> bool:
+        # Called with self._lock held; returns True when the caller should flush now
+        if not self.path:
+            return False
+        self._dirty = True
+        if self.flush_seconds <= 0:
+            return True
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_seconds, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+        return False
+
+    def flush(self):
+        """
+        Writes pending entries to path through a temp file and os.replace. Serialization
+        runs outside the entry lock, so lookups are not blocked by the write.
+        """
+        with self._write_lock:
+            with self._lock:
+                self._flush_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                # Oldest-used first, so _load rebuilds the LRU order
+                entries = dict(self._entries)
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"⚠️ Could not persist LLM cache {self.path}: {e}")
+                with self._lock:
+                    self._dirty = True
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, text: str):
+        with self._lock:
+            self._entries[key] = (time.time(), text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            flush_now = self._mark_dirty()
+        if flush_now:
+            self.flush()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            flush_now = self._mark_dirty()
+        if flush_now:
+            self.flush()
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_call(self, key: str, call, parse=None):
+        """
+        Returns the cached response for key, or runs call() once and caches its text.
+
+        Concurrent callers with the same key wait for the first call instead of
+        issuing their own. A response is only cached when parse(text) succeeds, so a
+        malformed reply is retried on the next request rather than replayed.
+
+        Parameters:
+        - key: request_key of the request
+        - call: zero-argument function returning the response text
+        - parse: optional function applied to the text (e.g. json.loads)
+
+        Returns:
+        - parse(text), or text when parse is None
+        """
+        parse = parse or (lambda text: text)
+        text = self.get(key)
+        if text is not None:
+            self._count(hit=True)
+            return parse(text)
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+
+        if not owner:
+            self._count(hit=True)
+            return parse(future.result())
+
+        self._count(hit=False)
+        try:
+            text = call()
+            parsed = parse(text)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            self.set(key, text)
+            future.set_result(text)
+            return parsed
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+_cache_lock = threading.Lock()
+_cache = None
+
+
+def get_llm_cache() -> LLMResponseCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMResponseCache()
+        return _cache
+
+
+def cached_message(gateway, parse=None, cache: LLMResponseCache = None, **request):
+    """
+    gateway.complete(**request) through the shared response cache.
+
+    Parameters:
+    - gateway: LLMGateway (see LLMGateway.get_llm_gateway)
+    - parse: optional function applied to the response text (the parsed value is returned)
+    - cache: LLMResponseCache to use (default: the shared on-disk cache)
+    - request: model, messages, max_tokens, ... as for messages.create
+
+    Returns:
+    - parse(text), or the response text when parse is None
+    """
+    if cache is None:
+        cache = get_llm_cache()
+
+    return cache.get_or_call(request_key(**request), lambda: gateway.complete(**request), parse)
+
+
+def cached_stream(gateway, parse=None, on_text=None, cache: LLMResponseCache = None, **request):
+    """
+    Like cached_message, but a cache miss streams the response through gateway.stream and
+    calls on_text with the text received so far after every chunk (for live rendering).
+    A hit returns at once without calling on_text.
+    """
+    if cache is None:
+        cache = get_llm_cache()
+
+    def call():
+        text = ""
+        for chunk in gateway.stream(**request):
+            text += chunk
+            if on_text is not None:
+                on_text(text)
+        return text
+
+    return cache.get_or_call(request_key(**request), call, parse)
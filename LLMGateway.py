@@ -0,0 +1,393 @@
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "anthropic")
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 30))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_STUB_LATENCY_SECONDS = float(os.getenv("LLM_STUB_LATENCY_SECONDS", 0.05))
+LLM_STUB_CHUNK_CHARS = 16
+
+# Line that introduces the conversation turns in a prompt; the stub backend only reads
+# the user turns after it
+CONVERSATION_HEADING = "### Recent conversation:"
+
+
+class AnthropicBackend:
+    """
+    Sends requests through one shared AsyncAnthropic client, so HTTP connections are
+    reused across calls. Retries are left to the gateway.
+    """
+    name = "anthropic"
+
+    def __init__(self, api_key: str = None):
+        import anthropic
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        self._anthropic = anthropic
+        self._api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
+        self._client = None
+        self.retryable_errors = (
+            anthropic.APIConnectionError,
+            anthropic.RateLimitError,
+            anthropic.InternalServerError,
+        )
+
+    def _get_client(self):
+        if self._client is None:
+            # Created on the gateway loop, which owns its connection pool
+            self._client = self._anthropic.AsyncAnthropic(api_key=self._api_key, max_retries=0)
+        return self._client
+
+    async def complete(self, **request) -> str:
+        response = await self._get_client().messages.create(**request)
+        return response.content[0].text
+
+    async def stream(self, **request):
+        async with self._get_client().messages.stream(**request) as stream:
+            async for text in stream.text_stream:
+                yield text
+
+
+class StubBackend:
+    """
+    Deterministic offline stand-in for load tests (LLM_BACKEND=stub).
+
+    It recognises the app's three prompts (intent extraction, distribution question,
+    chart config) and answers with well-formed JSON derived only from the prompt, so
+    the same conversation always gets the same reply.
+    """
+    name = "stub"
+    retryable_errors = ()
+
+    def __init__(self, latency_seconds: float = LLM_STUB_LATENCY_SECONDS, chunk_delay_seconds: float = 0.005):
+        self.latency_seconds = latency_seconds
+        self.chunk_delay_seconds = chunk_delay_seconds
+
+    async def complete(self, **request) -> str:
+        await asyncio.sleep(self.latency_seconds)
+        prompt = "\n".join(str(m.get("content", "")) for m in request.get("messages", []))
+        return json.dumps(self.respond(prompt))
+
+    async def stream(self, **request):
+        text = await self.complete(**request)
+        for i in range(0, len(text), LLM_STUB_CHUNK_CHARS):
+            yield text[i:i + LLM_STUB_CHUNK_CHARS]
+            await asyncio.sleep(self.chunk_delay_seconds)
+
+    def respond(self, prompt: str) -> dict:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        if '"chart_type"' in prompt:
+            return {"title": "Final Goal by Territory", "chart_type": "bar", "x": "Territory Name", "y": "Final Goal (cartons)"}
+        if '"question"' in prompt:
+            return {"question": f"Which territories carry the largest share of the final goal? (#{digest[:6]})"}
+        if '"intent"' in prompt:
+            return self._intent(prompt)
+        return {"text": f"stub-{digest[:12]}"}
+
+    @staticmethod
+    def _intent(prompt: str) -> dict:
+        conversation = prompt.split(CONVERSATION_HEADING, 1)[-1]
+        users = re.findall(r'"role": "user",\s*"content": "((?:[^"\\]|\\.)*)"', conversation)
+        text = " ".join(users)
+        quarter = re.search(r"\bQ([1-4])\b", text, re.IGNORECASE)
+        numbers = [float(n.replace(",", "")) for n in re.findall(r"\d[\d,]*(?:\.\d+)?", re.sub(r"\bQ[1-4]\b", "", text, flags=re.IGNORECASE))]
+        goal = next((n for n in numbers if n >= 100), None)
+        growths = [n for n in numbers if n < 100]
+        ready = quarter is not None and goal is not None and len(growths) >= 2
+        return {
+            "name": None,
+            "quarter": f"Q{quarter.group(1)}" if quarter else None,
+            "goal": goal,
+            "min_territory_growth": growths[0] if len(growths) >= 2 else None,
+            "max_territory_growth": growths[1] if len(growths) >= 2 else None,
+            "product_weights": {"Product 2": 60, "Product 3": 40} if ready else None,
+            "baseline_period": 6 if ready else None,
+            "exclude_disaster_months": False if ready else None,
+            "intent": "goal_calculation" if quarter or goal else "general_greeting",
+            "suggestion": "Please tell me your quarter, national goal, and territory growth range.",
+        }
+
+
+BACKENDS = {
+    "anthropic": AnthropicBackend,
+    "stub": StubBackend,
+}
+
+
+class GatewayMetrics:
+    """
+    Counters and a rolling latency window for gateway calls.
+    """
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.latencies = deque(maxlen=window)
+        self.first_token_latencies = deque(maxlen=window)
+
+    def record(self, seconds: float = None, error: bool = False, retry: bool = False, timeout: bool = False, ttft: float = None):
+        with self._lock:
+            if seconds is not None:
+                self.calls += 1
+                self.latencies.append(seconds)
+            if ttft is not None:
+                self.first_token_latencies.append(ttft)
+            self.errors += error
+            self.retries += retry
+            self.timeouts += timeout
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+            first_token = sorted(self.first_token_latencies)
+            calls, errors, retries, timeouts = self.calls, self.errors, self.retries, self.timeouts
+
+        def percentile(q, values=latencies):
+            return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+        return {
+            "calls": calls,
+            "errors": errors,
+            "retries": retries,
+            "timeouts": timeouts,
+            "p50_seconds": percentile(0.50),
+            "p95_seconds": percentile(0.95),
+            "max_seconds": latencies[-1] if latencies else None,
+            "p50_ttft_seconds": percentile(0.50, first_token),
+            "p95_ttft_seconds": percentile(0.95, first_token),
+        }
+
+
+class LLMGateway:
+    """
+    Shared LLM client: runs every request on one background asyncio loop with a
+    per-call timeout, bounded concurrency, retries with exponential backoff and
+    latency metrics. Sync callers (the Streamlit script thread) use complete() and
+    complete_many(); async callers await acomplete().
+
+    Parameters:
+    - backend: AnthropicBackend, StubBackend or any object with async complete(**request) -> str
+    - timeout_seconds: limit for a single attempt
+    - max_concurrency: requests in flight at once
+    - max_retries: extra attempts after a timeout or retryable backend error
+    - backoff_seconds: first retry delay, doubled per attempt (with jitter)
+    """
+
+    def __init__(self, backend, timeout_seconds: float = LLM_TIMEOUT_SECONDS, max_concurrency: int = LLM_MAX_CONCURRENCY, max_retries: int = LLM_MAX_RETRIES, backoff_seconds: float = 0.5):
+        self.backend = backend
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.metrics = GatewayMetrics()
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-gateway", daemon=True)
+        self._thread.start()
+
+    async def acomplete(self, **request) -> str:
+        """
+        Sends one request (model, messages, max_tokens, ...) and returns the response text.
+        Must be awaited on the gateway loop; use complete() from other threads.
+        """
+        retryable = (asyncio.TimeoutError,) + tuple(self.backend.retryable_errors)
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                async with self._semaphore:
+                    text = await asyncio.wait_for(self.backend.complete(**request), self.timeout_seconds)
+                self.metrics.record(seconds=time.perf_counter() - start)
+                return text
+            except retryable as e:
+                timed_out = isinstance(e, asyncio.TimeoutError)
+                if attempt == self.max_retries:
+                    self.metrics.record(error=True, timeout=timed_out)
+                    raise
+                self.metrics.record(retry=True, timeout=timed_out)
+                delay = self.backoff_seconds * (2 ** attempt)
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+            except Exception:
+                self.metrics.record(error=True)
+                raise
+
+    async def astream(self, **request):
+        """
+        Yields response text chunks as they arrive. The timeout applies to each chunk, and
+        retries only happen before the first chunk (nothing has been shown yet).
+        Time to first token and total latency are recorded in metrics.
+        """
+        retryable = (asyncio.TimeoutError,) + tuple(self.backend.retryable_errors)
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            first_token = None
+            try:
+                async with self._semaphore:
+                    chunks = self.backend.stream(**request).__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout_seconds)
+                        except StopAsyncIteration:
+                            break
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        yield chunk
+                self.metrics.record(seconds=time.perf_counter() - start, ttft=first_token)
+                return
+            except (asyncio.CancelledError, GeneratorExit):
+                # Consumer stopped early (e.g. the JSON object was complete): still count the call
+                if first_token is not None:
+                    self.metrics.record(seconds=time.perf_counter() - start, ttft=first_token)
+                raise
+            except retryable as e:
+                timed_out = isinstance(e, asyncio.TimeoutError)
+                if first_token is not None or attempt == self.max_retries:
+                    self.metrics.record(error=True, timeout=timed_out)
+                    raise
+                self.metrics.record(retry=True, timeout=timed_out)
+                delay = self.backoff_seconds * (2 ** attempt)
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+            except Exception:
+                self.metrics.record(error=True)
+                raise
+
+    def stream(self, **request):
+        """
+        Blocking iterator over response text chunks for sync code. Stopping early
+        cancels the request.
+        """
+        chunks = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for chunk in self.astream(**request):
+                    chunks.put(chunk)
+            except Exception as e:
+                chunks.put(e)
+            else:
+                chunks.put(done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._loop)
+        try:
+            while True:
+                item = chunks.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    def complete(self, **request) -> str:
+        """
+        Blocking wrapper around acomplete for sync code.
+        """
+        return asyncio.run_coroutine_threadsafe(self.acomplete(**request), self._loop).result()
+
+    def complete_many(self, requests: list, return_exceptions: bool = False) -> list:
+        """
+        Runs several independent requests concurrently and returns their texts in order.
+        """
+        async def gather():
+            return await asyncio.gather(*(self.acomplete(**r) for r in requests), return_exceptions=return_exceptions)
+        return asyncio.run_coroutine_threadsafe(gather(), self._loop).result()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+
+class IncrementalJSONParser:
+    """
+    Accumulates streamed text and parses the first top-level JSON object as soon as its
+    closing brace arrives, so callers can stop reading without waiting for trailing text.
+    Partial string fields can be read before the object is complete (for live display).
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.value = None
+        self._scanned = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def complete(self) -> bool:
+        return self.value is not None
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Adds a chunk; returns True once the object is complete (parsed into value).
+        """
+        if self.complete:
+            return True
+        self.text += chunk
+        for i in range(self._scanned, len(self.text)):
+            c = self.text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"' and self._start is not None:
+                self._in_string = True
+            elif c == "{":
+                if self._start is None:
+                    self._start = i
+                self._depth += 1
+            elif c == "}" and self._start is not None:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._scanned = i + 1
+                    self.value = json.loads(self.text[self._start:i + 1], strict=False)
+                    return True
+        self._scanned = len(self.text)
+        return False
+
+    def partial_string(self, key: str):
+        """
+        Returns the (possibly unfinished) string value of key, or None if it has not started.
+        """
+        match = re.search(r'"' + re.escape(key) + r'"\s*:\s*"((?:[^"\\]|\\.)*)', self.text)
+        if match is None:
+            return None
+        raw = match.group(1)
+        try:
+            return json.loads(f'"{raw}"', strict=False)
+        except ValueError:
+            return raw
+
+
+_gateway_lock = threading.Lock()
+_gateway = None
+
+
+def get_llm_gateway() -> LLMGateway:
+    """
+    Returns the process-wide gateway, using the backend named by LLM_BACKEND.
+    """
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            if LLM_BACKEND not in BACKENDS:
+                raise ValueError(f"Unknown LLM_BACKEND: {LLM_BACKEND} (expected one of {list(BACKENDS)})")
+            _gateway = LLMGateway(BACKENDS[LLM_BACKEND]())
+            print(f"🔌 LLM gateway started with the {LLM_BACKEND} backend")
+        return _gateway
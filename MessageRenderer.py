@@ -0,0 +1,236 @@
+import html
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from Assets import image_message_html, is_asset_reference
+
+_HTML_RE = re.compile(r'<[^>]+>')
+
+# IC_AGENT_TIMINGS=1 prints the timing report of every rerun and goal request
+TIMINGS_LOG = os.getenv("IC_AGENT_TIMINGS", "0") == "1"
+
+# Card used for HTML bot and disaster messages (rendered in an iframe)
+BOT_CARD_TEMPLATE = """
+            <div style="
+                max-width: 78%;
+                background-color: #fff8dc;
+                border-radius: 10px;
+                padding: 1rem;
+                margin: 0.5rem 0;
+                display: flex;
+                align-items: flex-start;
+                box-shadow: 0px 1px 4px rgba(0, 0, 0, 0.1);
+            ">
+                <div style="
+                    width: 30px;
+                    height: 30px;
+                    margin-right: 10px;
+                    background-color: #ffc107;
+                    border-radius: 50%;
+                    font-weight: bold;
+                    color: black;
+                    display: flex;
+                    align-items: center;
+                    justify-content: center;
+                ">🤖</div>
+                <div style="flex: 1;">{message}</div>
+            </div>
+            """
+
+# iframe sizes per sender for HTML messages: (height, width)
+IFRAME_SIZES = {
+    "disaster": (700, None),
+    "bot": (300, None),
+    "DQ": (300, 1000),
+    "image": (200, 1000),
+}
+
+
+def contains_html(text):
+    return bool(_HTML_RE.search(text))
+
+
+@dataclass(frozen=True)
+class RenderedMessage:
+    """
+    Pre-rendered form of one chat message.
+
+    - kind: "iframe" (components.html) or "markdown" (st.markdown with HTML)
+    - body: the HTML to emit
+    - height / width: iframe size (iframe only)
+    """
+    kind: str
+    body: str
+    height: int = None
+    width: int = None
+
+
+def render_message(sender: str, message: str) -> RenderedMessage:
+    """
+    Builds the HTML for one message once, with the same layout the chat has always used.
+    """
+    if sender == "image" and is_asset_reference(message):
+        message = image_message_html(message)
+    if contains_html(message) and sender in IFRAME_SIZES:
+        height, width = IFRAME_SIZES[sender]
+        body = BOT_CARD_TEMPLATE.format(message=message) if sender in ("disaster", "bot") else message
+        return RenderedMessage("iframe", body, height, width)
+
+    role_class = "user-msg" if sender == "user" else "bot-msg"
+    icon = "🙎‍♂️" if sender == "user" else "🤖"
+    icon_class = "user-icon" if sender == "user" else "bot-icon"
+    safe_message = html.escape(message)
+    body = f'<div class="{role_class}">\n<div class="icon {icon_class}">{icon}</div>\n{safe_message}\n</div>'
+    return RenderedMessage("markdown", body)
+
+
+class MessageLog(list):
+    """
+    The chat history: a list of (sender, message) that renders each message when it
+    is appended, so reruns only re-emit stored HTML.
+    """
+
+    def __init__(self, items=()):
+        super().__init__()
+        self.rendered = []
+        for item in items:
+            self.append(item)
+
+    def append(self, item):
+        super().append(item)
+        self.rendered.append(render_message(*item))
+
+    def rendered_messages(self) -> list:
+        # Resync if the list was changed without append (e.g. cleared or sliced in place)
+        if len(self.rendered) != len(self):
+            self.rendered = [render_message(*item) for item in self]
+        return self.rendered
+
+
+def emit_messages(messages: MessageLog, markdown, iframe):
+    """
+    Emits the pre-rendered history. Consecutive markdown messages are joined into one
+    markdown element; iframe messages keep their own component.
+
+    Parameters:
+    - messages: MessageLog
+    - markdown: function(body) emitting HTML markdown (e.g. st.markdown with unsafe_allow_html)
+    - iframe: function(body, height, width) emitting an HTML component (e.g. components.html)
+    """
+    pending = []
+    for rendered in messages.rendered_messages():
+        if rendered.kind == "markdown":
+            pending.append(rendered.body)
+            continue
+        if pending:
+            markdown("\n\n".join(pending))
+            pending = []
+        iframe(rendered.body, rendered.height, rendered.width)
+    if pending:
+        markdown("\n\n".join(pending))
+
+
+class FigureCache:
+    """
+    Process-wide LRU cache of serialized Plotly figures, keyed by the goal table
+    hash and chart settings.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._figures = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key: tuple, build):
+        """
+        Returns the figure JSON for key, calling build() -> plotly Figure on a miss.
+        """
+        with self._lock:
+            figure_json = self._figures.get(key)
+            if figure_json is not None:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                return figure_json
+        figure_json = build().to_json()
+        with self._lock:
+            self.misses += 1
+            self._figures[key] = figure_json
+            while len(self._figures) > self.max_entries:
+                self._figures.popitem(last=False)
+        return figure_json
+
+
+figure_cache = FigureCache()
+
+
+class RerunMetrics:
+    """
+    Rolling window of Streamlit rerun timings, shared by all sessions of the process.
+    """
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self.reruns = 0
+        self.totals = deque(maxlen=window)
+        self.stage_totals = {}
+
+    def record(self, total_seconds: float, stages: list):
+        with self._lock:
+            self.reruns += 1
+            self.totals.append(total_seconds)
+            for name, seconds in stages:
+                self.stage_totals.setdefault(name, deque(maxlen=self.totals.maxlen)).append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            totals = sorted(self.totals)
+            stages = {name: sum(values) / len(values) for name, values in self.stage_totals.items()}
+            reruns = self.reruns
+
+        def percentile(q):
+            return totals[min(len(totals) - 1, int(q * len(totals)))] * 1000 if totals else None
+
+        return {
+            "reruns": reruns,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "max_ms": totals[-1] * 1000 if totals else None,
+            "avg_stage_ms": {name: round(seconds * 1000, 2) for name, seconds in stages.items()},
+        }
+
+
+rerun_metrics = RerunMetrics()
+
+
+class RerunTimer:
+    """
+    Times the stages of one Streamlit script run (mark after each stage, finish at the end).
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.stages = []
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def finish(self, metrics: RerunMetrics = None):
+        """
+        Records this run into metrics (default rerun_metrics); prints the report when
+        IC_AGENT_TIMINGS=1.
+        """
+        (metrics or rerun_metrics).record(time.perf_counter() - self.start, self.stages)
+        if TIMINGS_LOG:
+            print(self.report())
+
+    def report(self) -> str:
+        stages = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.stages)
+        return f"⏱️ Rerun {(time.perf_counter() - self.start) * 1000:.1f} ms ({stages})"
@@ -0,0 +1,126 @@
+import os
+import queue
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+import pandas as pd
+
+DEFAULT_OUTPUT_PATH = os.path.join("output", "calculated_goals.xlsx")
+
+
+class OutputSink(ABC):
+    """
+    Destination for a calculated goal table. Subclasses implement _write.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, df: pd.DataFrame):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._write(df)
+
+    @abstractmethod
+    def _write(self, df: pd.DataFrame):
+        ...
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.path!r})"
+
+
+class ExcelSink(OutputSink):
+    def _write(self, df: pd.DataFrame):
+        df.to_excel(self.path, index=False)
+
+
+class CsvSink(OutputSink):
+    def _write(self, df: pd.DataFrame):
+        df.to_csv(self.path, index=False)
+
+
+class ParquetSink(OutputSink):
+    def _write(self, df: pd.DataFrame):
+        df.to_parquet(self.path, index=False)
+
+
+SINKS_BY_EXTENSION = {
+    ".xlsx": ExcelSink,
+    ".csv": CsvSink,
+    ".parquet": ParquetSink,
+}
+
+
+def make_sink(path: str = DEFAULT_OUTPUT_PATH) -> OutputSink:
+    """
+    Returns the sink matching the file extension of path (.xlsx, .csv or .parquet).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SINKS_BY_EXTENSION:
+        raise ValueError(f"Unsupported output format: {extension}")
+    return SINKS_BY_EXTENSION[extension](path)
+
+
+class BackgroundWriter:
+    """
+    Runs sink writes on a single daemon thread so callers return before the file is written.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="goal-output-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            sink, df, future = self._queue.get()
+            try:
+                sink.write(df)
+                future.set_result(sink.path)
+            except Exception as e:
+                print(f"⚠️ Failed to write {sink}: {e}")
+                future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, sink: OutputSink, df: pd.DataFrame) -> Future:
+        """
+        Queues df for writing and returns a Future resolving to the written path.
+        """
+        future = Future()
+        self._queue.put((sink, df, future))
+        return future
+
+    def flush(self):
+        """
+        Blocks until every queued write has finished.
+        """
+        self._queue.join()
+
+
+_writer_lock = threading.Lock()
+_writer = None
+
+
+def get_background_writer() -> BackgroundWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = BackgroundWriter()
+        return _writer
+
+
+def write_async(sink: OutputSink, df: pd.DataFrame) -> Future:
+    """
+    Writes a snapshot of df to sink on the shared background writer.
+    """
+    return get_background_writer().submit(sink, df.copy())
+
+
+def flush_outputs():
+    """
+    Waits for all pending background writes (use at the end of batch jobs).
+    """
+    if _writer is not None:
+        _writer.flush()
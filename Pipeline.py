@@ -0,0 +1,422 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from Anomaly import cross_verify_anomalies_with_fema, detect_product1_anomalies_dynamic, format_disaster_impact_summary_html
+from GoalCalculationN import REGION_NAMES, goals_from_baseline, prepare_goal_baseline
+from OutputSinks import write_async
+from TerritoryTable import TerritoryTable
+from WorkbookCache import WorkbookLoader, frame_hash
+
+PIPELINE_THREADS = 8
+PIPELINE_MAX_CACHED = 64
+PIPELINE_RUN_WINDOW = 500
+# Worker processes for the "process" stages of the goal pipeline; 0 runs them on threads
+PIPELINE_PROCESSES = int(os.getenv("IC_AGENT_PIPELINE_PROCESSES", 0))
+STAGE_KINDS = ("inline", "thread", "process")
+
+
+def input_hash(value) -> str:
+    """
+    Content key of an external pipeline input.
+
+    DataFrames and arrays are hashed by content, objects with source-file fingerprints
+    (DataContext) by those, plain values by their JSON form. Anything else is keyed by
+    identity, so the same object gives the same key.
+    """
+    if isinstance(value, pd.DataFrame):
+        return frame_hash(value)
+    if isinstance(value, np.ndarray):
+        return hashlib.sha256(value.tobytes()).hexdigest()
+    if hasattr(value, "fingerprints"):
+        return hashlib.sha256(json.dumps(value.fingerprints, default=str).encode("utf-8")).hexdigest()
+    if value is None or isinstance(value, (bool, int, float, str, list, tuple, dict)):
+        return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"id:{type(value).__name__}:{id(value)}"
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    One node of a Pipeline.
+
+    - name: key of the stage's output
+    - fn: called with the values of inputs, in order
+    - inputs: names of upstream stages or external inputs
+    - kind: "inline" (cheap), "thread" (I/O, LLM calls, numpy) or "process" (CPU-bound;
+      fn and its inputs must be picklable; runs on a thread when the pipeline has no pool)
+    - memoize: keep the output for the same input keys (outputs are shared: read-only)
+    """
+    name: str
+    fn: object
+    inputs: tuple = ()
+    kind: str = "thread"
+    memoize: bool = True
+
+
+@dataclass(frozen=True)
+class StageTiming:
+    name: str
+    kind: str
+    start: float
+    end: float
+    cached: bool
+
+    @property
+    def seconds(self) -> float:
+        return self.end - self.start
+
+
+class PipelineRun:
+    """
+    Outputs and per-stage wall times of one Pipeline.run.
+    """
+
+    def __init__(self, pipeline, values: dict, timings: dict, start: float, end: float):
+        self.pipeline = pipeline
+        self.values = values
+        self.timings = timings
+        self.start = start
+        self.end = end
+
+    def __getitem__(self, name: str):
+        return self.values[name]
+
+    @property
+    def seconds(self) -> float:
+        return self.end - self.start
+
+    def critical_path(self) -> list:
+        """
+        Stages on the longest dependency chain: from the last stage to finish, follow the
+        upstream stage that finished last.
+        """
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda n: self.timings[n].end)
+        path = [name]
+        while True:
+            upstream = [n for n in self.pipeline.stages[name].inputs if n in self.timings]
+            if not upstream:
+                return path[::-1]
+            name = max(upstream, key=lambda n: self.timings[n].end)
+            path.append(name)
+
+    def stage_ms(self) -> dict:
+        return {name: round(t.seconds * 1000, 2) for name, t in self.timings.items()}
+
+    def report(self) -> str:
+        lines = [f"⏱️ Pipeline {self.seconds * 1000:.1f} ms, critical path: {' → '.join(self.critical_path())}"]
+        for name, t in sorted(self.timings.items(), key=lambda item: item[1].start):
+            note = " (cached)" if t.cached else ""
+            lines.append(f"   {name:<20} {t.kind:<7} {(t.start - self.start) * 1000:8.1f} → {(t.end - self.start) * 1000:8.1f} ms{note}")
+        return "\n".join(lines)
+
+
+def _timed(fn, args):
+    start = time.perf_counter()
+    value = fn(*args)
+    return value, start, time.perf_counter()
+
+
+class Pipeline:
+    """
+    Small DAG executor: each stage starts as soon as its inputs are ready, so independent
+    stages run concurrently, and outputs are memoized by a hash of the stage's inputs.
+
+    Stage keys chain (a stage's key hashes its name and its inputs' keys), so large
+    intermediate outputs are never re-hashed and only external inputs are.
+
+    Parameters:
+    - stages: list of Stage
+    - threads: thread pool size for "thread" stages (and "process" stages without a pool)
+    - process_pool: optional executor for "process" stages
+    - max_cached: memoized outputs kept, least recently used evicted
+
+    stats() reports memo hits, failed stages and a rolling window of run and stage times.
+    """
+
+    def __init__(self, stages: list, threads: int = PIPELINE_THREADS, process_pool=None, max_cached: int = PIPELINE_MAX_CACHED):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            if stage.kind not in STAGE_KINDS:
+                raise ValueError(f"Unknown stage kind {stage.kind!r} for {stage.name}")
+        self.threads = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="pipeline")
+        self.process_pool = process_pool
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        self._memo = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.runs = 0
+        self._run_seconds = deque(maxlen=PIPELINE_RUN_WINDOW)
+        self._stage_seconds = {}
+        self._failures = {}
+
+    def _plan(self, targets, inputs: dict) -> list:
+        # Stages needed for targets, upstream first
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done or name in inputs:
+                return
+            if name not in self.stages:
+                raise KeyError(f"Pipeline input or stage not provided: {name}")
+            if name in visiting:
+                raise ValueError(f"Pipeline cycle at stage {name}")
+            visiting.add(name)
+            for upstream in self.stages[name].inputs:
+                visit(upstream)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for target in targets:
+            visit(target)
+        return order
+
+    def _memo_get(self, key):
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                self.hits += 1
+                return True, self._memo[key]
+            self.misses += 1
+            return False, None
+
+    def _memo_set(self, key, value):
+        with self._lock:
+            self._memo[key] = value
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.max_cached:
+                self._memo.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._memo.clear()
+
+    def _record(self, run: "PipelineRun"):
+        with self._lock:
+            self.runs += 1
+            self._run_seconds.append(run.seconds)
+            for name, timing in run.timings.items():
+                if not timing.cached:
+                    self._stage_seconds.setdefault(name, deque(maxlen=PIPELINE_RUN_WINDOW)).append(timing.seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            seconds = sorted(self._run_seconds)
+            stages = {name: sum(values) / len(values) for name, values in self._stage_seconds.items()}
+            runs, hits, misses = self.runs, self.hits, self.misses
+            failures = dict(self._failures)
+
+        def percentile(q):
+            return seconds[min(len(seconds) - 1, int(q * len(seconds)))] * 1000 if seconds else None
+
+        return {
+            "runs": runs,
+            "memo_hits": hits,
+            "memo_misses": misses,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "avg_stage_ms": {name: round(value * 1000, 2) for name, value in stages.items()},
+            "failures": failures,
+        }
+
+    def run(self, inputs: dict, targets=None) -> PipelineRun:
+        """
+        Runs the stages needed for targets.
+
+        Parameters:
+        - inputs: external input values by name
+        - targets: stage names to compute (default: every stage)
+
+        Returns:
+        - PipelineRun with the outputs of every stage that ran or was memoized
+        """
+        targets = list(targets or self.stages)
+        plan = self._plan(targets, inputs)
+        run_start = time.perf_counter()
+
+        keys = {name: input_hash(value) for name, value in inputs.items()}
+        for name in plan:
+            stage = self.stages[name]
+            material = json.dumps([name] + [keys[n] for n in stage.inputs])
+            keys[name] = hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+        values, timings = dict(inputs), {}
+        remaining = list(plan)
+        running = {}
+
+        def start_ready():
+            for name in list(remaining):
+                stage = self.stages[name]
+                if any(n not in values for n in stage.inputs):
+                    continue
+                remaining.remove(name)
+                if stage.memoize:
+                    hit, value = self._memo_get((name, keys[name]))
+                    if hit:
+                        now = time.perf_counter()
+                        values[name] = value
+                        timings[name] = StageTiming(name, stage.kind, now, now, True)
+                        return True
+                args = [values[n] for n in stage.inputs]
+                if stage.kind == "inline":
+                    value, start, end = _timed(stage.fn, args)
+                    self._finish(stage, keys[name], value, start, end, values, timings)
+                    return True
+                if stage.kind == "process" and self.process_pool is not None:
+                    running[self.process_pool.submit(stage.fn, *args)] = (name, time.perf_counter())
+                else:
+                    running[self.threads.submit(_timed, stage.fn, args)] = (name, None)
+            return False
+
+        try:
+            while remaining or running:
+                # Inline and memoized stages can unblock others at once
+                while start_ready():
+                    pass
+                if not running:
+                    if remaining:
+                        raise RuntimeError(f"Pipeline stages never became ready: {remaining}")
+                    break
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, submitted = running.pop(future)
+                    stage = self.stages[name]
+                    try:
+                        result = future.result()
+                    except Exception:
+                        # The caller reports the error; stats() counts it per stage
+                        with self._lock:
+                            self._failures[name] = self._failures.get(name, 0) + 1
+                        raise
+                    if submitted is None:
+                        value, start, end = result
+                    else:
+                        value, start, end = result, submitted, time.perf_counter()
+                    self._finish(stage, keys[name], value, start, end, values, timings)
+        finally:
+            for future in running:
+                future.cancel()
+
+        run = PipelineRun(self, values, timings, run_start, time.perf_counter())
+        self._record(run)
+        return run
+
+    def _finish(self, stage: Stage, key: str, value, start: float, end: float, values: dict, timings: dict):
+        values[stage.name] = value
+        timings[stage.name] = StageTiming(stage.name, stage.kind, start, end, False)
+        if stage.memoize:
+            self._memo_set((stage.name, key), value)
+
+    def close(self):
+        self.threads.shutdown(wait=False, cancel_futures=True)
+
+
+# ---------------------------------------------------------------------------
+# Goal pipeline: anomaly detection and the goal baseline run side by side
+# ---------------------------------------------------------------------------
+
+SALES_SHEET = "Input Sales_Anomaly_Introduced"
+MAPPING_SHEET = ("1c. Inputs - Mappings", {"skiprows": 5, "usecols": "C:D"})
+
+
+def _sales_table(context, dataset_path: str) -> TerritoryTable:
+    if not dataset_path:
+        return context.territory_table
+    # Uploads (content-addressed paths) must use the goal workbook layout; the loader is
+    # closed here so memoized outputs never hold an open workbook
+    sheet_name, read_kwargs = MAPPING_SHEET
+    with WorkbookLoader(dataset_path) as loader:
+        return TerritoryTable.from_frame(loader.read(SALES_SHEET), loader.read(sheet_name, **read_kwargs), REGION_NAMES)
+
+
+def _fema_index(context):
+    if context.fema_index is None:
+        raise FileNotFoundError("ZIP_to_Territory_with_FEMA_Data.xlsx")
+    return context.fema_index
+
+
+def _goal_baseline(context, dataset_path: str, sales_file_path: str):
+    # Without a loader prepare_goal_baseline opens and closes the workbook itself
+    return prepare_goal_baseline(sales_file_path, loader=None if dataset_path else context)
+
+
+def _exclude_months(verified_anomalies: pd.DataFrame, params: dict):
+    # Only the disaster-hit month of each territory, and only when the user chose to exclude
+    if params.get("exclude_disaster_months") is not True:
+        return None
+    matched = verified_anomalies["Disaster Match"] == True
+    return verified_anomalies.loc[matched, ["Territory", "Month"]] if matched.any() else None
+
+
+def _goal_table(goal_baseline, exclude_months, params: dict) -> pd.DataFrame:
+    return goals_from_baseline(
+        goal_baseline, params["goal"], params["min_growth"], params["max_growth"], params.get("product_weights"),
+        baseline_months=params.get("baseline_period"), exclude_months=exclude_months,
+    )
+
+
+def _goals(goal_table: pd.DataFrame, output_sink) -> pd.DataFrame:
+    # The sink is written from this process, so OutputSinks.flush_outputs can wait for it
+    if output_sink is not None:
+        write_async(output_sink, goal_table)
+    return goal_table
+
+
+def build_goal_pipeline(**kwargs) -> Pipeline:
+    """
+    Stages of one goal request.
+
+    Inputs:
+    - context: DataContext
+    - sales_file_path: workbook path (GOAL_DATA_PATH or the uploaded dataset)
+    - dataset_path: uploaded workbook, or None for the default data
+    - params: goal, min_growth, max_growth, product_weights, baseline_period,
+      exclude_disaster_months
+    - output_sink: OutputSink for the goal table, or None (needed by the "goals" target)
+
+    Targets: "verified_anomalies", "disaster_summary", "goal_baseline", "goals".
+    The goal baseline does not depend on the anomaly stages, so the two run concurrently.
+    Anomaly detection and the goal table are "process" stages (see PIPELINE_PROCESSES);
+    the goal baseline stays on a thread because it reads through the DataContext, which
+    cannot be pickled. The goal stages are not memoized: they are cheap, and like
+    calculate_goals the goals stage writes to output_sink on every request.
+    """
+    return Pipeline([
+        Stage("sales_table", _sales_table, ("context", "dataset_path")),
+        Stage("fema_index", _fema_index, ("context",), kind="inline"),
+        Stage("anomalies", detect_product1_anomalies_dynamic, ("sales_table",), kind="process"),
+        Stage("verified_anomalies", cross_verify_anomalies_with_fema, ("anomalies", "fema_index")),
+        Stage("disaster_summary", format_disaster_impact_summary_html, ("verified_anomalies", "sales_table")),
+        Stage("goal_baseline", _goal_baseline, ("context", "dataset_path", "sales_file_path")),
+        Stage("exclude_months", _exclude_months, ("verified_anomalies", "params"), kind="inline"),
+        Stage("goal_table", _goal_table, ("goal_baseline", "exclude_months", "params"), kind="process", memoize=False),
+        Stage("goals", _goals, ("goal_table", "output_sink"), kind="inline", memoize=False),
+    ], **kwargs)
+
+
+_goal_pipeline_lock = threading.Lock()
+_goal_pipeline = None
+
+
+def get_goal_pipeline(processes: int = None) -> Pipeline:
+    """
+    Process-wide goal pipeline. processes (default PIPELINE_PROCESSES) only applies to
+    the first call, which builds it.
+    """
+    global _goal_pipeline
+    with _goal_pipeline_lock:
+        if _goal_pipeline is None:
+            processes = PIPELINE_PROCESSES if processes is None else processes
+            process_pool = ProcessPoolExecutor(max_workers=processes) if processes > 0 else None
+            _goal_pipeline = build_goal_pipeline(process_pool=process_pool)
+        return _goal_pipeline
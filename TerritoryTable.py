@@ -0,0 +1,172 @@
+import re
+import numpy as np
+import pandas as pd
+
+R12_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun"]
+SALES_COLUMN_RE = re.compile(r"^(.*) R12 (\w+)$")
+
+
+def sales_column_products(columns) -> list:
+    """
+    Returns the product prefixes that have "{product} R12 {month}" columns, in column order.
+    """
+    products = []
+    for col in columns:
+        match = SALES_COLUMN_RE.match(str(col))
+        if match and match.group(1) not in products:
+            products.append(match.group(1))
+    return products
+
+
+class TerritoryTable:
+    """
+    Compact, array-backed territory sales model shared by the goal, anomaly and visual modules.
+
+    - territory_ids: int32 territory IDs, one per row
+    - name_codes / names: int32 codes into a tuple of unique territory names
+    - region_ids: int32 region IDs (-1 when unmapped)
+    - region_codes / region_names: int16 codes into a tuple of region names (-1 when unnamed)
+    - sales: contiguous float32 array of shape (products, territories, months)
+    - sales_dtype: dtype of the source sales columns (e.g. int64), for reporting values as read
+
+    Filters compare integer codes instead of strings, and frames built from the table
+    share no per-row string objects.
+    """
+    __slots__ = (
+        "territory_ids", "name_codes", "names", "region_ids", "region_codes", "region_names",
+        "products", "months", "sales", "sales_dtype", "_row_lookup",
+    )
+
+    def __init__(self, territory_ids, name_codes, names, region_ids, region_codes, region_names, products, months, sales, sales_dtype=np.float32):
+        self.territory_ids = np.asarray(territory_ids, dtype=np.int32)
+        self.name_codes = np.asarray(name_codes, dtype=np.int32)
+        self.names = tuple(names)
+        self.region_ids = np.asarray(region_ids, dtype=np.int32)
+        self.region_codes = np.asarray(region_codes, dtype=np.int16)
+        self.region_names = tuple(region_names)
+        self.products = tuple(products)
+        self.months = tuple(months)
+        self.sales = np.ascontiguousarray(sales, dtype=np.float32)
+        self.sales_dtype = np.dtype(sales_dtype)
+        self._row_lookup = np.argsort(self.territory_ids, kind="stable")
+
+    @classmethod
+    def from_frame(cls, sales_df: pd.DataFrame, mapping_df: pd.DataFrame = None, region_names: dict = None, products: list = None, months: list = None) -> "TerritoryTable":
+        """
+        Builds the table from a wide sales frame ("{product} R12 {month}" columns).
+
+        Parameters:
+        - sales_df: frame with Territory, Territory Name and the R12 month columns
+        - mapping_df: optional ['TS Territory', 'Region'] mapping
+        - region_names: optional {region ID: region name}
+        - products: product prefixes (default: every product with R12 columns)
+        - months: months (default Jan–Jun)
+        """
+        if products is None:
+            products = sales_column_products(sales_df.columns)
+        months = list(months or R12_MONTHS)
+        product_cols = [f"{product} R12 {m}" for product in products for m in months]
+
+        missing = [col for col in product_cols if col not in sales_df.columns]
+        if missing:
+            raise ValueError(f"Missing columns: {missing}")
+
+        territory_ids = sales_df["Territory"].to_numpy(dtype=np.int64)
+        name_codes, names = pd.factorize(sales_df["Territory Name"].astype(str))
+
+        region_ids = np.full(len(sales_df), -1, dtype=np.int64)
+        if mapping_df is not None:
+            regions = mapping_df.drop_duplicates("TS Territory").set_index("TS Territory")["Region"]
+            region_ids = regions.reindex(territory_ids).fillna(-1).to_numpy(dtype=np.int64)
+
+        region_labels = pd.Series(region_ids).map(region_names or {})
+        region_codes, unique_region_names = pd.factorize(region_labels)
+
+        values = sales_df[product_cols].to_numpy(dtype=np.float32)
+        sales = values.reshape(len(sales_df), len(products), len(months)).transpose(1, 0, 2)
+        sales_dtype = np.result_type(*sales_df[product_cols].dtypes) if product_cols else np.float32
+
+        return cls(territory_ids, name_codes, names, region_ids, region_codes, unique_region_names, products, months, sales, sales_dtype)
+
+    def __len__(self):
+        return len(self.territory_ids)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.territory_ids, self.name_codes, self.region_ids, self.region_codes, self.sales, self._row_lookup)
+        return sum(a.nbytes for a in arrays) + sum(len(n) for n in self.names + self.region_names)
+
+    def product_matrix(self, product: str, months: list = None) -> np.ndarray:
+        """
+        Returns the (territories x months) sales block for one product (a view when months is None).
+        """
+        block = self.sales[self.products.index(product)]
+        if months is None:
+            return block
+        return block[:, [self.months.index(m) for m in months]]
+
+    def select_products(self, products: list) -> "TerritoryTable":
+        """
+        Returns a table holding only the given products, in the given order.
+        """
+        return TerritoryTable(
+            self.territory_ids, self.name_codes, self.names, self.region_ids, self.region_codes,
+            self.region_names, products, self.months, self.sales[[self.products.index(p) for p in products]],
+            self.sales_dtype,
+        )
+
+    def r12_totals(self, months: list = None) -> np.ndarray:
+        """
+        Returns per-product sales totals over months (default all), shape (products, territories), float64.
+        """
+        cube = self.sales if months is None else self.sales[:, :, [self.months.index(m) for m in months]]
+        return cube.sum(axis=2, dtype=np.float64)
+
+    def rows_for(self, territory_ids) -> np.ndarray:
+        """
+        Returns row positions for territory IDs (-1 for unknown IDs).
+        """
+        territory_ids = np.asarray(territory_ids, dtype=np.int64)
+        if len(self) == 0:
+            return np.full(len(territory_ids), -1, dtype=np.int64)
+        sorted_ids = self.territory_ids[self._row_lookup]
+        pos = np.minimum(np.searchsorted(sorted_ids, territory_ids), len(self) - 1)
+        return np.where(sorted_ids[pos] == territory_ids, self._row_lookup[pos], -1)
+
+    def region_mask(self, region_name: str) -> np.ndarray:
+        """
+        Returns a boolean row mask for a region name, comparing integer codes only.
+        """
+        if region_name not in self.region_names:
+            return np.zeros(len(self), dtype=bool)
+        return self.region_codes == self.region_names.index(region_name)
+
+    def territory_names(self, rows=None) -> np.ndarray:
+        """
+        Decodes territory names (all rows, or the given row positions).
+        """
+        codes = self.name_codes if rows is None else self.name_codes[rows]
+        return np.asarray(self.names, dtype=object)[codes]
+
+    def region_labels(self, rows=None) -> np.ndarray:
+        """
+        Decodes region names; NaN where the region has no name.
+        """
+        codes = self.region_codes if rows is None else self.region_codes[rows]
+        labels = np.asarray(self.region_names + (np.nan,), dtype=object)
+        return labels[codes]
+
+    def to_frame(self, products: list = None) -> pd.DataFrame:
+        """
+        Expands the table into the wide frame layout used by the original sheet, with
+        categorical names and float32 sales.
+        """
+        data = {
+            "Territory": self.territory_ids,
+            "Territory Name": pd.Categorical.from_codes(self.name_codes, self.names),
+        }
+        for product in products or self.products:
+            block = self.product_matrix(product)
+            for j, month in enumerate(self.months):
+                data[f"{product} R12 {month}"] = block[:, j]
+        return pd.DataFrame(data)
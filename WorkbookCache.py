@@ -0,0 +1,309 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    CACHE_FORMAT = "parquet"
+except ImportError:
+    CACHE_FORMAT = "pkl"
+
+CACHE_DIR = os.getenv("IC_AGENT_CACHE_DIR", ".ic_cache")
+
+_hash_lock = threading.Lock()
+_content_hashes = {}
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    Returns a content hash for a source file, recomputed only when its mtime or size changes.
+
+    Parameters:
+    - path: path to the source file
+
+    Returns:
+    - str: hex digest identifying the current file contents
+    """
+    abs_path = os.path.abspath(path)
+    stat = os.stat(abs_path)
+    key = (abs_path, stat.st_mtime_ns, stat.st_size)
+
+    with _hash_lock:
+        cached = _content_hashes.get(abs_path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+    digest = hashlib.sha1()
+    with open(abs_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    content_hash = digest.hexdigest()
+
+    with _hash_lock:
+        _content_hashes[abs_path] = (key, content_hash)
+    return content_hash
+
+
+def frame_hash(df: pd.DataFrame) -> str:
+    """
+    Content hash of a DataFrame (values, index and column names).
+    """
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(repr(list(df.columns)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _cache_prefix(path: str, sheet_name: str, read_kwargs: dict) -> str:
+    # Sheet + read options identify the slot; the content hash is appended per version
+    options = json.dumps(read_kwargs, sort_keys=True, default=str)
+    slot = hashlib.sha1(f"{os.path.abspath(path)}|{sheet_name}|{options}".encode("utf-8")).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(path))[0].replace(" ", "_")
+    return f"{stem}-{slot}-"
+
+
+def _write_cache(df: pd.DataFrame, cache_path: str):
+    tmp_path = cache_path + ".tmp"
+    if cache_path.endswith(".parquet"):
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, cache_path)
+
+
+def _read_cache(cache_path: str) -> pd.DataFrame:
+    if cache_path.endswith(".parquet"):
+        return pd.read_parquet(cache_path)
+    return pd.read_pickle(cache_path)
+
+
+def _read_through_cache(sales_file_path: str, sheet_name: str, read_kwargs: dict, parse) -> pd.DataFrame:
+    content_hash = file_fingerprint(sales_file_path)
+    prefix = _cache_prefix(sales_file_path, sheet_name, read_kwargs)
+    cache_path = os.path.join(CACHE_DIR, f"{prefix}{content_hash[:16]}.{CACHE_FORMAT}")
+
+    if os.path.exists(cache_path):
+        try:
+            return _read_cache(cache_path)
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable cache {cache_path}: {e}")
+
+    df = parse()
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Drop entries for previous versions of the same sheet
+        for name in os.listdir(CACHE_DIR):
+            if name.startswith(prefix):
+                os.remove(os.path.join(CACHE_DIR, name))
+        _write_cache(df, cache_path)
+    except Exception as e:
+        print(f"⚠️ Could not write workbook cache: {e}")
+
+    return df
+
+
+def read_excel_cached(sales_file_path: str, sheet_name: str, **read_kwargs) -> pd.DataFrame:
+    """
+    Reads an Excel sheet through a columnar on-disk cache.
+
+    The first read of a sheet parses the workbook with openpyxl and stores the result
+    as Parquet (or pickle when pyarrow is not installed). Later reads load the cached
+    file directly. Cache entries are keyed by file path, sheet, read options and the
+    workbook content hash, so editing the workbook invalidates them automatically.
+
+    Parameters:
+    - sales_file_path: path to the Excel workbook
+    - sheet_name: sheet to read
+    - read_kwargs: extra pd.read_excel options (e.g. skiprows, usecols)
+
+    Returns:
+    - pd.DataFrame with the sheet contents
+    """
+    return _read_through_cache(
+        sales_file_path, sheet_name, read_kwargs,
+        lambda: pd.read_excel(sales_file_path, sheet_name=sheet_name, **read_kwargs)
+    )
+
+
+class WorkbookLoader:
+    """
+    Opens a workbook at most once and serves every requested sheet from that single handle.
+
+    Sheets are looked up in the on-disk cache first; the workbook itself (zip container
+    and shared-strings table) is only opened, in openpyxl read-only mode, on the first
+    cache miss. Use one loader per request and pass it to every consumer.
+
+    Usage:
+        with WorkbookLoader(GOAL_DATA_PATH) as loader:
+            sales_df = loader.read("Input Sales_Anomaly_Introduced")
+            mapping_df = loader.read("1c. Inputs - Mappings", skiprows=5, usecols="C:D")
+    """
+
+    def __init__(self, sales_file_path: str, use_cache: bool = True):
+        self.sales_file_path = sales_file_path
+        self.use_cache = use_cache
+        self._excel_file = None
+        self._frames = {}
+
+    def _workbook(self) -> pd.ExcelFile:
+        if self._excel_file is None:
+            self._excel_file = pd.ExcelFile(
+                self.sales_file_path, engine="openpyxl",
+                engine_kwargs={"read_only": True, "data_only": True}
+            )
+        return self._excel_file
+
+    def read(self, sheet_name: str, **read_kwargs) -> pd.DataFrame:
+        """
+        Returns one sheet as a DataFrame, honouring pd.read_excel options such as
+        usecols, skiprows, nrows and dtype.
+        """
+        key = (sheet_name, json.dumps(read_kwargs, sort_keys=True, default=str))
+        if key not in self._frames:
+            parse = lambda: self._workbook().parse(sheet_name, **read_kwargs)
+            if self.use_cache:
+                self._frames[key] = _read_through_cache(self.sales_file_path, sheet_name, read_kwargs, parse)
+            else:
+                self._frames[key] = parse()
+        return self._frames[key]
+
+    def read_many(self, sheets: dict) -> dict:
+        """
+        Reads several sheets in one pass.
+
+        Parameters:
+        - sheets: mapping of result name -> (sheet_name, read_kwargs)
+
+        Returns:
+        - dict of result name -> pd.DataFrame
+        """
+        return {name: self.read(sheet_name, **read_kwargs) for name, (sheet_name, read_kwargs) in sheets.items()}
+
+    def close(self):
+        if self._excel_file is not None:
+            self._excel_file.close()
+            self._excel_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def iter_sheet_chunks(sales_file_path: str, sheet_name: str, columns: list, chunk_size: int = 10_000, dtypes: dict = None):
+    """
+    Streams a sheet in row chunks, keeping only the requested columns.
+
+    The workbook is read with openpyxl in read-only mode, so rows are parsed lazily and
+    at most chunk_size rows of the projected columns are held at once.
+
+    Parameters:
+    - sales_file_path: path to the Excel workbook
+    - sheet_name: sheet to read (first row is the header)
+    - columns: header names to keep
+    - chunk_size: rows per yielded chunk
+    - dtypes: optional {column: dtype} applied to each chunk
+
+    Yields:
+    - pd.DataFrame chunks with the projected columns
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(sales_file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = list(next(rows))
+        missing = [col for col in columns if col not in header]
+        if missing:
+            raise ValueError(f"Missing columns: {missing}")
+        positions = [header.index(col) for col in columns]
+
+        buffer = []
+        for row in rows:
+            if row[positions[0]] is None:
+                continue
+            buffer.append([row[i] for i in positions])
+            if len(buffer) == chunk_size:
+                yield pd.DataFrame(buffer, columns=columns).astype(dtypes or {})
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns).astype(dtypes or {})
+    finally:
+        workbook.close()
+
+
+def read_territory_sales_streaming(sales_file_path: str, sheet_name: str, products: list, months: list, keep_months: bool = True, chunk_size: int = 10_000) -> pd.DataFrame:
+    """
+    Reads territory sales chunk by chunk with compact dtypes and R12 totals built incrementally.
+
+    Only Territory, Territory Name and the "{product} R12 {month}" columns are read.
+    Each chunk is copied into growing int32 / float32 arrays and territory names are kept
+    as codes into a running name dictionary, so no chunk frames or per-row name strings
+    are retained. Beyond one chunk, memory is the compact output itself: one float per
+    product per territory with keep_months=False, one per product and month with
+    keep_months=True (which therefore grows with the number of months read).
+
+    Parameters:
+    - sales_file_path: path to the Excel workbook
+    - sheet_name: sheet with the wide territory sales
+    - products: product prefixes to read
+    - months: R12 months to read
+    - keep_months: keep the monthly columns; when False only the "{product} R12 Total"
+      columns are kept, so memory per territory is one float per product
+    - chunk_size: rows per chunk
+
+    Returns:
+    - pd.DataFrame with Territory, Territory Name, optional month columns and "{product} R12 Total"
+    """
+    month_cols = {product: [f"{product} R12 {m}" for m in months] for product in products}
+    columns = ["Territory", "Territory Name"] + [col for cols in month_cols.values() for col in cols]
+    dtypes = {"Territory": "int32", "Territory Name": "str"}
+    dtypes.update({col: "float32" for col in columns[2:]})
+    total_cols = [f"{product} R12 Total" for product in products]
+    value_cols = (columns[2:] if keep_months else []) + total_cols
+
+    names = {}
+    n_rows = 0
+    territories = np.empty(chunk_size, dtype=np.int32)
+    name_codes = np.empty(chunk_size, dtype=np.int32)
+    values = np.empty((chunk_size, len(value_cols)), dtype=np.float32)
+    for chunk in iter_sheet_chunks(sales_file_path, sheet_name, columns, chunk_size, dtypes):
+        end = n_rows + len(chunk)
+        if end > len(territories):
+            # Grow geometrically so copying stays linear in the number of rows
+            capacity = max(2 * len(territories), end)
+            territories = _grow(territories, capacity)
+            name_codes = _grow(name_codes, capacity)
+            values = _grow(values, capacity)
+
+        territories[n_rows:end] = chunk["Territory"].to_numpy()
+        name_codes[n_rows:end] = [names.setdefault(name, len(names)) for name in chunk["Territory Name"]]
+        sales = chunk[columns[2:]].to_numpy()
+        totals = [chunk[cols].to_numpy().sum(axis=1) for cols in month_cols.values()]
+        values[n_rows:end] = np.column_stack(([sales] if keep_months else []) + totals)
+        n_rows = end
+
+    if not n_rows:
+        return pd.DataFrame(columns=columns)
+    # Same sorted categories as astype("category") on the name strings
+    categories = sorted(names)
+    order = np.empty(len(categories), dtype=np.int32)
+    order[[names[name] for name in categories]] = np.arange(len(categories), dtype=np.int32)
+    df = pd.DataFrame({
+        "Territory": territories[:n_rows],
+        "Territory Name": pd.Categorical.from_codes(order[name_codes[:n_rows]], categories),
+    })
+    for i, col in enumerate(value_cols):
+        df[col] = values[:n_rows, i]
+    return df
+
+
+def _grow(array: np.ndarray, capacity: int) -> np.ndarray:
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
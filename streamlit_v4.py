@@ -1,32 +1,36 @@
 import streamlit as st
 import html
 import re
-import base64
 from dotenv import load_dotenv
-from GoalCalculationN import calculate_goals
 from Insights_Visuals import run_goal_distribution_analysis
 import pandas as pd
 import numpy as np
-from Anomaly import detect_product1_anomalies_dynamic
-from Anomaly import cross_verify_anomalies_with_fema
-from Anomaly import format_disaster_impact_summary_html
 import streamlit.components.v1 as components
 import json
-import anthropic
 import os
 from KPI import get_kpi_html_block
+from DataContext import get_data_context, GOAL_DATA_PATH
+from LLMGateway import IncrementalJSONParser, get_llm_gateway
+from IntentExtractor import BASELINE_PERIOD_ERROR, coerce_baseline_period, extraction_prompt, get_intent_extractor
+from ConversationState import ConversationState
+from MessageRenderer import TIMINGS_LOG, MessageLog, RerunTimer, emit_messages, rerun_metrics
+from Pipeline import get_goal_pipeline
+from Assets import image_reference
 import time
 
 load_dotenv()
-client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+# Shared async client: connection reuse, timeouts, retries (LLM_BACKEND=stub runs offline)
+llm = get_llm_gateway()
 
 st.set_page_config(page_title="ICAgents Goal Assistant", layout="wide")
-GOAL_DATA_PATH = r"Goal Setting sanitized Data.xlsx"
+rerun_timer = RerunTimer()
+# Workbook, FEMA data and images are loaded once per process and shared by all sessions
+data_context = get_data_context()
 
 
-# Session state init
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# Session state init: messages are rendered to HTML once, when appended
+if not isinstance(st.session_state.get("messages"), MessageLog):
+    st.session_state.messages = MessageLog(st.session_state.get("messages") or [])
 
 for key in ["name", "quarter", "goal", "min_territory_growth", "max_territory_growth", "calculated_df"]:
     if key not in st.session_state:
@@ -35,6 +39,9 @@ for key in ["name", "quarter", "goal", "min_territory_growth", "max_territory_gr
 
 if "Insights_messages" not in st.session_state:
     st.session_state.Insights_messages = []
+
+if "conversation_state" not in st.session_state:
+    st.session_state["conversation_state"] = ConversationState()
     
     
 st.markdown("""
@@ -112,39 +119,10 @@ html, body {
 </style>
 """, unsafe_allow_html=True)
 
-# 🏢 Centered Company Logo
-def image_to_base64(path):
-    with open(path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode()
-
-
-def image_file_to_base64(image_path):
-    with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
-    
-img_path = "TimeSeriesDia.png"  # or use the full path if needed
-TimeSeries = image_file_to_base64(img_path)
-unknown_unknown=image_file_to_base64("UnknownUnknown.png")
-
-
-Timeseries_html = f"""
-<div class="bot-msg">
-    <div>
-        <p><strong>📈 DQ Summary Visual:</strong> Here's a recent trend analysis for Brand2.</p>
-        <img src="data:image/png;base64,{TimeSeries}" width="1000" style="border-radius:10px; margin-top:10px;" />
-    </div>
-</div>
-"""
-
+# DQ images are stored in the chat as asset references and resolved to a static URL when rendered
+Timeseries_image = image_reference("TimeSeriesDia.png")
+unknown_unknown_image = image_reference("UnknownUnknown.png")
 
-unknown_unknown_html = f"""
-<div class="bot-msg">
-    <div>
-        <img src="data:image/png;base64,{unknown_unknown}" width="1000" style="border-radius:10px; margin-top:10px;" />
-    </div>
-</div>
-"""
-    
 # 🏢 Centered Local Image
 # encoded_logo = image_to_base64("logoo-removebg-preview.png")
 # st.markdown(
@@ -209,87 +187,13 @@ st.markdown("---")
 # Chat message container
 st.markdown('<div class="chat-container">', unsafe_allow_html=True)
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-
-def contains_html(text):
-    return bool(re.search(r'<[^>]+>', text))
-
-for sender, message in st.session_state.messages:
-    if contains_html(message) and sender in ["disaster"]:
-        styled_html = f"""
-            <div style="
-                max-width: 78%;
-                background-color: #fff8dc;
-                border-radius: 10px;
-                padding: 1rem;
-                margin: 0.5rem 0;
-                display: flex;
-                align-items: flex-start;
-                box-shadow: 0px 1px 4px rgba(0, 0, 0, 0.1);
-            ">
-                <div style="
-                    width: 30px;
-                    height: 30px;
-                    margin-right: 10px;
-                    background-color: #ffc107;
-                    border-radius: 50%;
-                    font-weight: bold;
-                    color: black;
-                    display: flex;
-                    align-items: center;
-                    justify-content: center;
-                ">🤖</div>
-                <div style="flex: 1;">{message}</div>
-            </div>
-            """
-        components.html(styled_html, height=700)
-    elif contains_html(message) and sender in ["bot"]:
-        styled_html = f"""
-            <div style="
-                max-width: 78%;
-                background-color: #fff8dc;
-                border-radius: 10px;
-                padding: 1rem;
-                margin: 0.5rem 0;
-                display: flex;
-                align-items: flex-start;
-                box-shadow: 0px 1px 4px rgba(0, 0, 0, 0.1);
-            ">
-                <div style="
-                    width: 30px;
-                    height: 30px;
-                    margin-right: 10px;
-                    background-color: #ffc107;
-                    border-radius: 50%;
-                    font-weight: bold;
-                    color: black;
-                    display: flex;
-                    align-items: center;
-                    justify-content: center;
-                ">🤖</div>
-                <div style="flex: 1;">{message}</div>
-            </div>
-            """
-        components.html(styled_html, height=300)
-    elif contains_html(message) and sender in ["DQ"]:
-        components.html(message, width=1000,height=300)    
-    elif contains_html(message) and sender == "image":
-       components.html(message, height=200, width=1000)
-    else:
-        role_class = "user-msg" if sender == "user" else "bot-msg"
-        icon = "🙎‍♂️" if sender == "user" else "🤖"
-        icon_class = "user-icon" if sender == "user" else "bot-icon"
-
-        # Render standard escaped message
-        safe_message = html.escape(message)
-        st.markdown(f"""
-            <div class="{role_class}">
-                <div class="icon {icon_class}">{icon}</div>
-                {safe_message}
-            </div>
-        """, unsafe_allow_html=True)
-        
+emit_messages(
+    st.session_state.messages,
+    markdown=lambda body: st.markdown(body, unsafe_allow_html=True),
+    iframe=lambda body, height, width: components.html(body, height=height, width=width),
+)
+rerun_timer.mark("history")
+
 if "suggestion_used" not in st.session_state:
     st.session_state.suggestion_used = False
             
@@ -301,6 +205,7 @@ if df is not None and not df.empty:
 
     with st.spinner("🤖 Analyzing data and generating insights..."):
         run_goal_distribution_analysis(df)
+rerun_timer.mark("goals")
         
 st.markdown("""
     <style>
@@ -374,85 +279,51 @@ with st.container(border=True):
 #     st.rerun()
 
 
+rerun_timer.mark("input")
+rerun_timer.finish()
+
 # On user submit
 if submitted and user_input:
     st.session_state.messages.append(("user", user_input))
 
-    claude_messages = [
-        {"role": "user" if sender == "user" else "assistant", "content": msg}
-        for sender, msg in st.session_state.messages
-        if sender not in ["DQ","image"]
-    ]
-
-    claude_prompt = f"""
-    You are a helpful assistant that helps users calculate quarterly sales goals.
-
-    Your job is to extract structured information from the conversation.
-
-    ### Required fields:
-    - name: the user's name (if mentioned)
-    - quarter: sales quarter (Q3 or Q4 only)
-    - goal: national goal amount (number)
-    - min_territory_growth: minimum expected territory growth percentage (number)
-    - max_territory_growth: maximum expected territory growth percentage (number)
-    - product_weights: e.g., {{ "Product 2": 60, "Product 3": 40 }}, or null if not confirmed
-    - baseline_period: a number between 1 and 6 (months), or null if not confirmed
-    - exclude_disaster_months: true, false, or null (depending on whether user confirmed to exclude FEMA-impacted months from baseline)
-    - intent: one of "goal_calculation", "general_greeting", "out_of_scope"
-    - suggestion: a friendly next message to the user
-
-    ### Behavior:
-    - Begin goal calculation only when these are present:
-        - quarter, goal, min/max territory growth
-        - product_weights, baseline_period
-        - exclude_disaster_months is either true or false
-    - If product_weights or baseline_period is missing, prompt like:
-        - 🧮 "Please confirm product weights — default is Product 2: 60%, Product 3: 40%. Would you like to proceed with these or update them?"
-        - 🕒 "Please confirm baseline period (3 or 6 months). For Q1/Q2, 6 months was used. Do you want to keep it or change it?"
-
-    - If FEMA-related disaster months were shown, wait for user's input about exclusion:
-        - If user says something like "Yes, exclude disaster months", set exclude_disaster_months = true
-        - If user says "No, include all months", set exclude_disaster_months = false
-        - If no decision yet, set it to null and ask:
-        - ⚠️ "Would you like to exclude the disaster-affected months from the baseline calculation?"
-
-    - If quarter is Q1 or Q2, respond with:
-    - "Sales data already exists for Q1 and Q2. Please calculate goals for Q3 or Q4."
-
-    - If user greets, respond politely and ask for required fields.
-
-    - If the topic is unrelated to sales goal calculation, respond:
-    - "This is outside of sales goal calculation. I can't help with that."
-
-    ### Respond ONLY with a valid JSON object:
-    {{
-    "name": "<name or null>",
-    "quarter": "<quarter or null>",
-    "goal": "<goal or null>",
-    "min_territory_growth": <number or null>,
-    "max_territory_growth": <number or null>,
-    "product_weights": {{ "Product 2": 60, "Product 3": 40 }} or null,
-    "baseline_period": <1–6 or null>,
-    "exclude_disaster_months": true | false | null,
-    "intent": "<goal_calculation | general_greeting | out_of_scope>",
-    "suggestion": "<next thing you want the user to do>"
-    }}
-
-    ### Conversation:
-    {json.dumps(claude_messages, indent=2)}
-    """
+    # Confirmed fields are carried as slot state; only the last few turns are sent, as plain text
+    conversation_state = st.session_state["conversation_state"]
+    known_fields, recent_turns = conversation_state.context(st.session_state.messages)
 
-    try:
-        response = client.messages.create(
+    claude_prompt = extraction_prompt(known_fields, recent_turns)
+
+    stream_placeholder = st.empty()
+
+    def extract_with_llm():
+        # Stream the reply: show the suggestion as it arrives and stop as soon as the JSON object closes
+        parser = IncrementalJSONParser()
+        stream_placeholder.markdown('<div class="bot-msg"><div class="icon bot-icon">🤖</div>⏳</div>', unsafe_allow_html=True)
+        for chunk in llm.stream(
             model="claude-3-haiku-20240307",
             max_tokens=512,
             temperature=0,
             messages=[{"role": "user", "content": claude_prompt}]
-        )
+        ):
+            if parser.feed(chunk):
+                break
+            suggestion = parser.partial_string("suggestion")
+            if suggestion:
+                stream_placeholder.markdown(
+                    f'<div class="bot-msg"><div class="icon bot-icon">🤖</div>{html.escape(suggestion)}</div>',
+                    unsafe_allow_html=True
+                )
+        if not parser.complete:
+            raise json.JSONDecodeError("Incomplete JSON object in streamed response", parser.text, len(parser.text))
+        return parser.value
 
-        raw_output = response.content[0].text.strip()
-        clean_json = re.sub(r'[\x00-\x1F\x7F]', '', raw_output)
-        data = json.loads(clean_json)
+    try:
+        # Structured inputs are parsed locally; the LLM is only called when the rules are unsure
+        intent_extractor = get_intent_extractor()
+        data = intent_extractor.extract(st.session_state.messages, extract_with_llm, known=conversation_state.known_slots())
+        conversation_state.update(data)
+        data.update(conversation_state.known_slots())
+        if TIMINGS_LOG:
+            print(f"Intent extraction: {intent_extractor.stats()}, prompt context: {conversation_state.metrics()}, LLM: {llm.metrics.snapshot()}, reruns: {rerun_metrics.snapshot()}, goal pipeline: {get_goal_pipeline().stats()}")
         #st.json(clean_json)
         #print(clean_json)
 
@@ -488,13 +359,18 @@ if submitted and user_input:
                 "(e.g., Product 2: 60%, Product 3: 40%). "
                 "**Proceed with the default, or would you like to update them?**"
             )
-            if parsed.get("baseline_period") is not None and 1 <= parsed["baseline_period"] <= 6:
-                st.session_state["proposed_baseline"] = parsed["baseline_period"]
+            try:
+                baseline_period, baseline_error = coerce_baseline_period(parsed.get("baseline_period")), False
+            except ValueError:
+                baseline_period, baseline_error = None, True
+                conversation_state.clear("baseline_period")
+            if baseline_period is not None:
+                st.session_state["proposed_baseline"] = baseline_period
                 st.session_state["baseline_confirmed"] = True
             else:
                 st.session_state["baseline_confirmed"] = False
-                if parsed.get("baseline_period") and parsed["baseline_period"] > 6:
-                    bot_response = "⚠️ Baseline period must be 6 months or less. Please provide a number from 1 to 6."
+                if baseline_error:
+                    bot_response = BASELINE_PERIOD_ERROR
                 else:
                     bot_response = "🕒 While calculating the goal for Q1 and Q2, a 6-month baseline period was considered. Would you like to change it or proceed with this?"
             
@@ -508,11 +384,11 @@ if submitted and user_input:
                     st.session_state.messages.append(("DQ", kpi_html_block))
                     st.session_state["kpi_snapshot_shown"] = True
                 if "dq_image_shown" not in st.session_state:
-                    st.session_state.messages.append(("image", Timeseries_html))
+                    st.session_state.messages.append(("image", Timeseries_image))
                     st.session_state["dq_image_shown"] = True
                     
                 if "unknown_unknown_shown" not in st.session_state:
-                    st.session_state.messages.append(("image", unknown_unknown_html))
+                    st.session_state.messages.append(("image", unknown_unknown_image))
                     st.session_state["unknown_unknown_shown"] = True          
 
             if st.session_state.get("product_weights_confirmed") and st.session_state.get("baseline_confirmed"):
@@ -524,39 +400,39 @@ if submitted and user_input:
                     baseline = st.session_state["proposed_baseline"]
                     
                     
-                    # ✅ Load and verify anomalies before calculating goals
-                    sales_df=pd.read_excel("Goal Setting sanitized Data.xlsx", sheet_name='Input Sales_Anomaly_Introduced')
-                    fema_df=pd.read_excel("ZIP_to_Territory_with_FEMA_Data.xlsx",sheet_name="2025_ZIP_to_Territory")
-                    anomalies_df = detect_product1_anomalies_dynamic(sales_df)
-                    verified_anomalies = cross_verify_anomalies_with_fema(anomalies_df, fema_df)
-                    
-
-                    if verified_anomalies["Disaster Match"].any():
-                        if parsed["exclude_disaster_months"] is None:
-                            # Ask for confirmation only once
-                            if not st.session_state.get("disaster_message_shown"):
-                                disaster_summary = format_disaster_impact_summary_html(verified_anomalies, sales_df)
-                                st.session_state.messages.append(("disaster", disaster_summary))
-                                st.session_state["disaster_message_shown"] = True
-                                st.rerun()
-
-                        # Set exclude_months based on user response
-                        if parsed["exclude_disaster_months"] is True:
-                            exclude_months =  verified_anomalies[verified_anomalies['Disaster Match']==True]["Month"].unique().tolist()
-                        else:
-                            exclude_months = None
-                    else:
-                        exclude_months = None
-                    #st.write(exclude_months)
-                    df = calculate_goals(
-                        goal_value,
-                        GOAL_DATA_PATH,
-                        min_growth,
-                        max_growth,
-                        product_weights=weights
-                        # baseline_months=baseline
-                    )
+                    # ✅ Verify anomalies and build the goal baseline side by side, then calculate goals
+                    goal_pipeline = get_goal_pipeline()
+                    pipeline_inputs = {
+                        "context": data_context,
+                        "sales_file_path": GOAL_DATA_PATH,
+                        "dataset_path": None,
+                        "output_sink": None,
+                        "params": {
+                            "goal": goal_value,
+                            "min_growth": min_growth,
+                            "max_growth": max_growth,
+                            "product_weights": weights,
+                            "baseline_period": baseline,
+                            "exclude_disaster_months": parsed["exclude_disaster_months"],
+                        },
+                    }
+                    verified_anomalies = goal_pipeline.run(pipeline_inputs, ["verified_anomalies", "goal_baseline"])["verified_anomalies"]
+
+                    if verified_anomalies["Disaster Match"].any() and parsed["exclude_disaster_months"] is None:
+                        # Ask for confirmation only once
+                        if not st.session_state.get("disaster_message_shown"):
+                            disaster_summary = goal_pipeline.run(pipeline_inputs, ["disaster_summary"])["disaster_summary"]
+                            st.session_state.messages.append(("disaster", disaster_summary))
+                            st.session_state["disaster_message_shown"] = True
+                            st.rerun()
+
+                    # Only the disaster-hit month of each territory is excluded, and only if the user chose to
+                    # Stage times are kept in goal_pipeline.stats(), logged with the metrics above
+                    df = goal_pipeline.run(pipeline_inputs, ["goals"])["goals"]
                     st.session_state["calculated_df"] = df
+                    # The goal is done: the next request starts from a clean slate
+                    conversation_state.reset()
+                    st.session_state.pop("disaster_message_shown", None)
                     name = parsed.get("name", "User") or "User"
                     formatted_weights = ', '.join([f"{k}: {v}%" for k, v in weights.items()])
                     
@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Keep sheet caches and uploads of the test run out of the working tree
+os.environ.setdefault("IC_AGENT_CACHE_DIR", os.path.join(tempfile.mkdtemp(prefix="ic_test_"), ".ic_cache"))
+os.environ.setdefault("LLM_BACKEND", "stub")
+
+GOAL_WORKBOOK = os.path.join(ROOT, "Goal Setting sanitized Data.xlsx")
+
+
+def sales_frame(n_territories: int = 40, seed: int = 3, dtype=np.int64) -> pd.DataFrame:
+    """
+    Wide synthetic sales for Product 1 and 2 (Jan–Jun) with three planted drops:
+    Product 1 at 100006/Mar and 100018/Jun, Product 2 at 100010/Feb.
+    """
+    from TerritoryTable import R12_MONTHS
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "Territory": np.arange(100001, 100001 + n_territories),
+        "Territory Name": [f"Territory {i}" for i in range(n_territories)],
+    })
+    for product, level in [("Product 1", 300), ("Product 2", 150)]:
+        for month in R12_MONTHS:
+            df[f"{product} R12 {month}"] = rng.normal(level, 20, n_territories).round().astype(dtype)
+    # Planted drops
+    df.loc[5, "Product 1 R12 Mar"] = 40
+    df.loc[17, "Product 1 R12 Jun"] = 60
+    df.loc[9, "Product 2 R12 Feb"] = 5
+    return df
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import pytest
+import AgentService
+from IntentExtractor import ASK_BASELINE, BASELINE_PERIOD_ERROR
+
+
+@pytest.fixture
+def service(monkeypatch):
+    # Routes up to the slot questions never reach the worker pool
+    service = AgentService.AgentService(max_workers=1, max_queue=1)
+    monkeypatch.setattr(AgentService, "_service", service)
+    yield service
+    service.close()
+
+
+def _call(method, path, content_type=None, body=b""):
+    sent = []
+    messages = [
+        {"type": "http.request", "body": body[:len(body) // 2], "more_body": True},
+        {"type": "http.request", "body": body[len(body) // 2:], "more_body": False},
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    headers = [(b"content-type", content_type.encode())] if content_type else []
+    asyncio.run(AgentService.app({"type": "http", "path": path, "method": method, "headers": headers}, receive, send))
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+def _chat(text, **fields):
+    body = "&".join(f"{k}={v}" for k, v in dict(goal=text, **fields).items()).encode()
+    return _call("POST", "/agent", "application/x-www-form-urlencoded", body)
+
+
+def test_health_and_routing_errors(service):
+    status, stats = _call("GET", "/health")
+    assert status == 200 and stats["requests"] == 0
+
+    assert _call("GET", "/nope") == (404, {"error": "Not found: /nope"})
+    assert _call("GET", "/agent")[0] == 405
+    assert _call("POST", "/agent", "application/json", b"{}") == (400, {"error": "Missing 'goal' field"})
+    assert _call("GET", "/health")[1]["errors"] == 1
+
+
+def test_dataset_upload_is_content_addressed(service):
+    status, first = _call("POST", "/datasets", "application/octet-stream", b"workbook bytes")
+    assert status == 200 and first["created"]
+    assert _call("POST", "/datasets", "application/octet-stream", b"workbook bytes")[1]["created"] is False
+
+    assert _call("GET", f"/datasets/{first['dataset_id']}") == (200, {"dataset_id": first["dataset_id"], "bytes": 14})
+    status, error = _call("GET", "/datasets/../etc")
+    assert status == 404 and error["error"].startswith("Unknown dataset_id")
+    status, error = _chat("hi", dataset_id="0" * 64)
+    assert status == 404 and error["error"].startswith("Unknown dataset_id")
+
+
+def test_agent_asks_for_missing_slots(service):
+    status, reply = _chat("Hi, I am Priya")
+    assert status == 200 and reply["intent"] == "general_greeting"
+    session_id = reply["session_id"]
+
+    status, reply = _chat("Q3 goal 5600 growth 1 to 2", session_id=session_id)
+    assert reply["response"] == ASK_BASELINE
+    assert reply["slots"] == {"name": "Priya", "quarter": "Q3", "goal": 5600, "min_territory_growth": 1, "max_territory_growth": 2}
+
+    # An out-of-range period is rejected and forgotten, so it is asked for again
+    status, reply = _chat("baseline 9 months", session_id=session_id)
+    assert reply["response"] == BASELINE_PERIOD_ERROR
+    assert "baseline_period" not in reply["slots"]
+    assert service.stats()["sessions"] == 1
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+from Anomaly import TARGET_MONTHS, detect_anomalies_wide, detect_product1_anomalies_dynamic
+from conftest import sales_frame
+
+
+def _melt_merge_reference(sales_df: pd.DataFrame, z_thresh: float = -2.0) -> pd.DataFrame:
+    # The original long-format implementation, kept as the parity reference
+    cols = [f"Product 1 R12 {m}" for m in TARGET_MONTHS]
+    df_long = sales_df.melt(id_vars=["Territory", "Territory Name"], value_vars=cols, var_name="Month", value_name="Sales")
+    df_long["Month"] = df_long["Month"].str.extract(r'R12 (\w+)', expand=False)
+    stats = df_long.groupby("Month")["Sales"].agg(["mean", "std"]).reset_index()
+    df_merged = df_long.merge(stats, on="Month")
+    df_merged["z_score"] = (df_merged["Sales"] - df_merged["mean"]) / df_merged["std"]
+    anomalies = df_merged[df_merged["z_score"] < z_thresh].copy()
+    return anomalies[["Territory", "Territory Name", "Month", "Sales", "z_score"]].reset_index(drop=True)
+
+
+@pytest.mark.parametrize("z_thresh", [-2.0, -1.0])
+def test_wide_detector_matches_melt_merge(z_thresh):
+    sales = sales_frame()
+    expected = _melt_merge_reference(sales, z_thresh)
+    result = detect_product1_anomalies_dynamic(sales, z_thresh)
+
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    assert result["Sales"].dtype == sales["Product 1 R12 Jan"].dtype
+
+
+def test_wide_detector_supports_other_products_and_months():
+    sales = sales_frame()
+    result = detect_anomalies_wide(sales, "Product 2", ["Jan", "Feb", "Mar"], z_thresh=-3.0)
+
+    assert result[["Territory", "Month"]].values.tolist() == [[100010, "Feb"]]
+
+
+def test_flat_month_is_not_flagged():
+    sales = sales_frame()
+    sales[[f"Product 1 R12 {m}" for m in TARGET_MONTHS]] = 100
+    with np.errstate(all="raise"):
+        assert detect_product1_anomalies_dynamic(sales).empty
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from Anomaly import ANOMALY_DETECTORS, ANOMALY_RESULT_COLUMNS, TARGET_MONTHS, detect_anomalies_wide, run_anomaly_engine
+from conftest import sales_frame
+
+
+def test_engine_zscore_agrees_with_wide_detector():
+    sales = sales_frame(dtype=np.float64)
+    engine = run_anomaly_engine(sales, ["zscore"], ["Product 1"])
+    wide = detect_anomalies_wide(sales, "Product 1")
+
+    assert list(engine.columns) == ANOMALY_RESULT_COLUMNS
+    engine_cells = set(zip(engine["Territory"], engine["Month"]))
+    assert engine_cells == set(zip(wide["Territory"], wide["Month"]))
+    assert sorted(engine["Score"]) == pytest.approx(sorted(wide["z_score"]))
+
+
+@pytest.mark.parametrize("detector", sorted(ANOMALY_DETECTORS))
+def test_every_detector_handles_flat_series(detector):
+    sales = sales_frame()
+    for month in TARGET_MONTHS:
+        sales[f"Product 2 R12 {month}"] = 50
+    result = run_anomaly_engine(sales, [detector])
+
+    assert list(result.columns) == ANOMALY_RESULT_COLUMNS
+    assert not (result["Product"] == "Product 2").any()
+
+
+@pytest.mark.parametrize("detector", ["mad", "iqr", "seasonal"])
+def test_robust_detectors_find_planted_drops(detector):
+    result = run_anomaly_engine(sales_frame(), [detector])
+    cells = set(zip(result["Product"], result["Territory"], result["Month"]))
+
+    assert ("Product 1", 100006, "Mar") in cells
+    assert ("Product 2", 100010, "Feb") in cells
+
+
+def test_unknown_detector_is_rejected():
+    with pytest.raises(ValueError, match="Unknown anomaly detectors"):
+        run_anomaly_engine(sales_frame(), ["prophet"])
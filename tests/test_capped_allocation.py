@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from GoalCalculationN import solve_capped_allocation
+
+
+def test_uncapped_allocation_is_proportional():
+    weights = np.array([1.0, 2.0, 3.0, 4.0])
+    result = solve_capped_allocation(weights, 0.0, np.inf, 100.0)
+
+    assert result.converged.all()
+    assert result.goals[0] == pytest.approx([10, 20, 30, 40])
+
+
+def test_capped_territories_stay_at_bounds_and_total_is_met():
+    weights = np.array([1.0, 1.0, 1.0, 10.0])
+    lower = np.array([20.0, 0.0, 0.0, 0.0])
+    upper = np.array([np.inf, np.inf, np.inf, 30.0])
+    result = solve_capped_allocation(weights, lower, upper, 100.0)
+
+    goals = result.goals[0]
+    assert result.converged[0]
+    assert goals.sum() == pytest.approx(100.0, abs=1e-6)
+    assert goals[3] == pytest.approx(30.0)
+    assert goals[0] >= 20.0
+    # The free territories share the remainder in proportion to their weight
+    assert goals[1] == pytest.approx(goals[2])
+
+
+def test_scenarios_are_solved_independently():
+    rng = np.random.default_rng(7)
+    weights = rng.uniform(0.5, 2.0, size=(50, 200))
+    lower = weights * 0.9 * 10
+    upper = weights * 1.2 * 10
+    totals = (weights * 10).sum(axis=1) * rng.uniform(0.95, 1.15, size=50)
+    result = solve_capped_allocation(weights, lower, upper, totals)
+
+    assert result.converged.all()
+    assert result.goals.sum(axis=1) == pytest.approx(totals, abs=1e-5)
+    assert (result.goals >= lower - 1e-9).all() and (result.goals <= upper + 1e-9).all()
+    assert result.iterations.max() < 100
+
+    single = solve_capped_allocation(weights[3], lower[3], upper[3], totals[3])
+    assert single.goals[0] == pytest.approx(result.goals[3])
+
+
+def test_infeasible_total_is_reported_not_converged():
+    weights = np.ones(3)
+    result = solve_capped_allocation(weights, 0.0, 10.0, 100.0)
+
+    assert not result.converged[0]
+    assert result.goals[0] == pytest.approx([10, 10, 10])
+    assert result.residual[0] == pytest.approx(70.0)
+
+
+def test_zero_weights_fall_back_to_the_floor():
+    result = solve_capped_allocation(np.zeros(3), np.array([1.0, 2.0, 3.0]), np.inf, 6.0)
+
+    assert result.converged[0]
+    assert result.goals[0] == pytest.approx([1, 2, 3])
+
+
+def test_goal_table_meets_the_national_goal():
+    from conftest import GOAL_WORKBOOK
+    from GoalCalculationN import apply_goal_parameters, prepare_goal_baseline
+
+    baseline = prepare_goal_baseline(GOAL_WORKBOOK)
+    df = apply_goal_parameters(baseline, 5600, 1.0, 2.0)
+
+    assert df.attrs["capping"]["converged"]
+    # Final goals are rounded to whole cartons per territory
+    assert df["Final Goal (cartons)"].sum() == pytest.approx(5600, abs=len(df))
@@ -0,0 +1,41 @@
+import pytest
+from ConversationState import ConversationState
+
+GOAL = {"name": "Priya", "quarter": "Q3", "goal": 5600, "min_territory_growth": 1, "max_territory_growth": 2}
+
+
+def test_null_fields_keep_previous_values():
+    state = ConversationState()
+    state.update(GOAL)
+    state.update({"quarter": "Q3", "goal": None, "baseline_period": 6})
+
+    assert state.known_slots() == dict(GOAL, baseline_period=6)
+
+
+def test_clear_forgets_one_slot():
+    state = ConversationState()
+    state.update(dict(GOAL, baseline_period=6))
+    state.clear("baseline_period")
+
+    assert state.known_slots() == GOAL
+    with pytest.raises(KeyError):
+        state.clear("not_a_slot")
+
+
+def test_reset_keeps_the_name():
+    state = ConversationState()
+    state.update(dict(GOAL, product_weights={"Product 2": 60, "Product 3": 40}, exclude_disaster_months=True))
+    state.reset()
+
+    assert state.known_slots() == {"name": "Priya"}
+
+
+def test_new_quarter_starts_a_new_goal():
+    state = ConversationState()
+    state.update(dict(GOAL, baseline_period=3))
+    state.update({"quarter": "Q4", "goal": 7000})
+
+    assert state.known_slots() == {"name": "Priya", "quarter": "Q4", "goal": 7000}
+    # Same quarter in another spelling is not a new goal
+    state.update({"quarter": "q4", "baseline_period": 6})
+    assert state.known_slots()["baseline_period"] == 6
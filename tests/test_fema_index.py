@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+from Anomaly import FemaIndex, cross_verify_anomalies_with_fema, load_fema_index
+
+
+def _fema_frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        "TS Territory ID": [101001, 101001, 101001, 201002, 201002, 301001],
+        "IncidentBeginDate": ["2025-01-20", "2025-03-10", "2025-03-10", "2025-05-01", "2025-02-25", "2024-03-01"],
+        "IncidentEndDate": ["2025-03-05", "2025-03-30", "2025-03-30", None, "2025-02-26", "2024-03-31"],
+        "IncidentType": ["Flood", "Fire", "Fire", "Storm", "Snow", "Hurricane"],
+        "DeclarationTitle": ["Winter Flood", "Spring Fire", "Spring Fire", "May Storm", "Snow", "Old Hurricane"],
+    })
+
+
+def _month(year_month: str):
+    start = np.datetime64(year_month, "M")
+    return start.astype("datetime64[D]"), (start + 1).astype("datetime64[D]") - 1
+
+
+def test_incident_spanning_months_matches_every_month_it_covers():
+    index = FemaIndex.from_frame(_fema_frame())
+    months = ["2025-01", "2025-02", "2025-03", "2025-04"]
+    starts, ends = zip(*[_month(m) for m in months])
+    matches = index.overlaps([101001] * 4, starts, ends)
+
+    assert list(matches.index) == [0, 1, 2]
+    assert matches.loc[1, "IncidentType"] == "Flood"
+    # March overlaps both incidents: earliest begin, latest end
+    assert matches.loc[2, "IncidentBeginDate"] == pd.Timestamp("2025-01-20")
+    assert matches.loc[2, "IncidentEndDate"] == pd.Timestamp("2025-03-30")
+
+
+def test_overlap_respects_year_and_territory():
+    index = FemaIndex.from_frame(_fema_frame())
+    start, end = _month("2025-03")
+    matches = index.overlaps([301001, 999999, 201002], [start] * 3, [end] * 3)
+
+    assert matches.empty
+
+
+def test_missing_end_date_is_a_one_day_incident():
+    index = FemaIndex.from_frame(_fema_frame())
+    may, april = _month("2025-05"), _month("2025-04")
+    matches = index.overlaps([201002, 201002], [may[0], april[0]], [may[1], april[1]])
+
+    assert list(matches.index) == [0]
+    assert matches.loc[0, "IncidentEndDate"] == pd.Timestamp("2025-05-01")
+
+
+def test_duplicate_zip_rows_are_dropped():
+    assert len(FemaIndex.from_frame(_fema_frame())) == 5
+
+
+def test_index_round_trips_through_npz(tmp_path):
+    index = FemaIndex.from_frame(_fema_frame())
+    path = tmp_path / "fema-index.npz"
+    index.save(str(path))
+    loaded = FemaIndex.load(str(path))
+
+    start, end = _month("2025-03")
+    pd.testing.assert_frame_equal(loaded.overlaps([101001], [start], [end]), index.overlaps([101001], [start], [end]))
+
+
+def test_load_fema_index_keeps_one_index_per_sheet(tmp_path):
+    path = tmp_path / "fema.xlsx"
+    with pd.ExcelWriter(path) as writer:
+        _fema_frame().to_excel(writer, sheet_name="2025_ZIP_to_Territory", index=False)
+        _fema_frame().iloc[:1].to_excel(writer, sheet_name="Other", index=False)
+
+    assert len(load_fema_index(str(path))) == 5
+    assert len(load_fema_index(str(path), sheet_name="Other")) == 1
+
+
+def test_cross_verify_flags_matching_anomalies():
+    anomalies = pd.DataFrame({
+        "Territory": [101001, 101001, 201002],
+        "Territory Name": ["East", "East", "West"],
+        "Month": ["Feb", "Jun", "Feb"],
+        "Sales": [10, 12, 8],
+        "z_score": [-2.5, -2.1, -3.0],
+    })
+    verified = cross_verify_anomalies_with_fema(anomalies, FemaIndex.from_frame(_fema_frame()), year=2025)
+
+    # Only incidents longer than 12 days are kept, so the unmatched Jun anomaly and the
+    # one-day February snow are both dropped
+    assert verified["Territory"].tolist() == [101001]
+    assert verified["Disaster Match"].tolist() == [True]
+    assert verified["IncidentType"].tolist() == ["Flood"]
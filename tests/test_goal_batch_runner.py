@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+from conftest import GOAL_WORKBOOK
+from GoalBatchRunner import SharedTerritoryTable, attach_shared_table, build_jobs, job_weights, run_goal_batch
+from GoalCalculationN import calculate_goals, prepare_goal_baseline
+
+
+def test_default_weights_only_apply_to_product_1():
+    assert job_weights(None, "Product 1") == {"Product 2": 60, "Product 3": 40}
+    with pytest.raises(ValueError, match="No product weights"):
+        build_jobs(["Product 2"], ["Q3"], [5600], [1.0], [2.0])
+
+
+def test_weights_must_name_the_jobs_index_products():
+    with pytest.raises(ValueError, match="not index products"):
+        build_jobs(["Product 2"], ["Q3"], [5600], [1.0], [2.0], {"Product 2": {"Product 2": 60, "Product 3": 40}})
+
+
+def test_quarters_do_not_multiply_jobs():
+    jobs = build_jobs(["Product 1"], ["Q3", "Q4"], [5600, 6000], [1.0], [2.0])
+
+    assert len(jobs) == 2
+    assert all(job.quarters == ("Q3", "Q4") for job in jobs)
+
+
+def test_shared_table_round_trips():
+    table = prepare_goal_baseline(GOAL_WORKBOOK).table
+    with SharedTerritoryTable(table) as shared:
+        attached, blocks = attach_shared_table(shared.spec)
+        assert np.array_equal(attached.sales, table.sales)
+        assert attached.sales_dtype == table.sales_dtype
+        assert attached.territory_names().tolist() == table.territory_names().tolist()
+        del attached
+        for block in blocks:
+            block.close()
+
+
+def test_shared_table_releases_blocks_when_creation_fails(monkeypatch):
+    table = prepare_goal_baseline(GOAL_WORKBOOK).table
+    created = []
+    real = shared_memory.SharedMemory
+
+    def failing(*args, **kwargs):
+        if len(created) == 2:
+            raise OSError("no space left on device")
+        block = real(*args, **kwargs)
+        created.append(block.name)
+        return block
+
+    monkeypatch.setattr(shared_memory, "SharedMemory", failing)
+    with pytest.raises(OSError):
+        SharedTerritoryTable(table)
+    monkeypatch.setattr(shared_memory, "SharedMemory", real)
+
+    for name in created:
+        with pytest.raises(FileNotFoundError):
+            real(name=name)
+
+
+def test_batch_matches_calculate_goals():
+    jobs = build_jobs(["Product 1"], ["Q3", "Q4"], [5600], [1.0], [2.0])
+    results, timings = run_goal_batch(jobs, GOAL_WORKBOOK, max_workers=2)
+    expected = calculate_goals(5600, GOAL_WORKBOOK, 1.0, 2.0)
+
+    assert len(timings) == 1
+    for quarter in ["Q3", "Q4"]:
+        rows = results[results["Quarter"] == quarter]
+        assert rows["Final Goal (cartons)"].tolist() == expected["Final Goal (cartons)"].tolist()
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from conftest import GOAL_WORKBOOK
+from GoalCalculationN import DEFAULT_PRODUCT_WEIGHTS, apply_goal_parameters, calculate_goals_batch, prepare_goal_baseline, product_weight_row
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    return prepare_goal_baseline(GOAL_WORKBOOK)
+
+
+def test_weight_row_follows_index_product_order():
+    assert product_weight_row({"Product 3": 40, "Product 2": 60}, ["Product 2", "Product 3"]) == [60, 40]
+
+
+@pytest.mark.parametrize("weights, message", [
+    ({"Product 2": 100}, "Missing weights"),
+    ({"Product 2": 60, "Product 3": 30, "Product 4": 10}, "not index products"),
+    ({"Product 2": 50, "Product 3": 40}, "sum to 100"),
+])
+def test_invalid_weights_are_rejected(weights, message):
+    with pytest.raises(ValueError, match=message):
+        product_weight_row(weights, ["Product 2", "Product 3"])
+
+
+def test_missing_weights_are_zero_filled_only_on_request():
+    assert product_weight_row({"Product 2": 100}, ["Product 2", "Product 3"], fill_missing=True) == [100, 0]
+    with pytest.raises(ValueError, match="sum to 100"):
+        product_weight_row({"Product 2": 60}, ["Product 2", "Product 3"], fill_missing=True)
+
+
+def test_apply_goal_parameters_validates_weights(baseline):
+    with pytest.raises(ValueError):
+        apply_goal_parameters(baseline, 5600, 1.0, 2.0, {"Product 2": 100})
+    df = apply_goal_parameters(baseline, 5600, 1.0, 2.0, {"Product 2": 100}, fill_missing_weights=True)
+    assert df["Market Index"].tolist() == df["Product 2 Index"].tolist()
+
+
+def test_batch_rejects_weight_arrays_that_do_not_sum_to_100(baseline):
+    with pytest.raises(ValueError, match="sum to 100"):
+        calculate_goals_batch(baseline, [5600], 1.0, 2.0, np.array([[50, 40]]))
+
+
+def test_batch_matches_single_scenario(baseline):
+    weights = [DEFAULT_PRODUCT_WEIGHTS, {"Product 2": 30, "Product 3": 70}]
+    result = calculate_goals_batch(baseline, [5600, 6000], 1.0, 2.0, weights)
+
+    for row, (goal, w) in enumerate(zip([5600, 6000], weights)):
+        df = apply_goal_parameters(baseline, goal, 1.0, 2.0, w)
+        assert result.final_goals[row] == pytest.approx(df["Final Goal (cartons)"].to_numpy())
+    assert result.summary["Product 3 Weight"].tolist() == [40, 70]
+
+
+def test_goal_product_order_and_baseline_window():
+    baseline = prepare_goal_baseline(GOAL_WORKBOOK, products=["Product 2", "Product 1", "Product 3"], baseline_months=3)
+
+    assert baseline.products == ("Product 2", "Product 1", "Product 3")
+    assert baseline.baseline_months == 3
+    df = apply_goal_parameters(baseline, 5600, 1.0, 2.0, {"Product 1": 50, "Product 3": 50})
+    assert "Product 1 Index" in df.columns
+    with pytest.raises(ValueError, match="not index products"):
+        apply_goal_parameters(baseline, 5600, 1.0, 2.0, DEFAULT_PRODUCT_WEIGHTS)
@@ -0,0 +1,94 @@
+import pytest
+from IntentExtractor import (
+    ASK_BASELINE, ASK_EXCLUDE, ASK_WEIGHTS, DEFAULT_WEIGHTS, FAST_PATH_MIN_CONFIDENCE, IntentExtractor,
+    coerce_baseline_period, extract_slots,
+)
+
+
+def _chat(*turns):
+    return [("user" if i % 2 == 0 else "bot", text) for i, text in enumerate(turns)]
+
+
+def test_year_is_not_taken_as_the_goal():
+    state, confidence = extract_slots(_chat("I want 2025 Q3 goals of 5600 growth 1 to 2"))
+
+    assert state["goal"] == 5600
+    assert state["quarter"] == "Q3"
+    assert (state["min_territory_growth"], state["max_territory_growth"]) == (1, 2)
+    assert confidence >= FAST_PATH_MIN_CONFIDENCE
+
+
+def test_separate_min_and_max_growth():
+    state, confidence = extract_slots(_chat("goal for Q3 is 5600 with min growth 1 and max growth 2"))
+
+    assert state["goal"] == 5600
+    assert (state["min_territory_growth"], state["max_territory_growth"]) == (1, 2)
+    assert confidence >= FAST_PATH_MIN_CONFIDENCE
+
+
+def test_thousands_suffix_after_goal():
+    state, _ = extract_slots(_chat("Q4 goal 5.6k, growth -1% to 3%"))
+
+    assert state["goal"] == 5600
+    assert (state["min_territory_growth"], state["max_territory_growth"]) == (-1, 3)
+
+
+def test_ambiguous_numbers_go_to_the_llm():
+    # Two goal-sized numbers and no "goal" next to either
+    state, confidence = extract_slots(_chat("Q3 5,600 and 7000 growth 1 to 2"))
+
+    assert state["goal"] is None
+    assert confidence < FAST_PATH_MIN_CONFIDENCE
+
+
+def test_growth_without_a_readable_range_goes_to_the_llm():
+    state, confidence = extract_slots(_chat("Q3 goal 5600 growth between 1"))
+
+    assert state["min_territory_growth"] is None
+    assert confidence < FAST_PATH_MIN_CONFIDENCE
+
+
+def test_greeting_with_a_name_stays_a_greeting():
+    state, confidence = extract_slots(_chat("Hi, I am Priya"))
+
+    assert state["name"] == "Priya"
+    assert state["intent"] == "general_greeting"
+    assert confidence >= FAST_PATH_MIN_CONFIDENCE
+
+
+def test_button_slots():
+    state, confidence = extract_slots(_chat("Calculate goal for Q3?"))
+
+    assert state["quarter"] == "Q3"
+    assert state["intent"] == "goal_calculation"
+    assert confidence == 1.0
+
+
+def test_confirmations_apply_to_the_last_question():
+    known = {"quarter": "Q3", "goal": 5600, "min_territory_growth": 1, "max_territory_growth": 2}
+
+    state, confidence = extract_slots(_chat("Q3 goal 5600 growth 1 to 2", ASK_WEIGHTS, "yes"), known)
+    assert state["product_weights"] == DEFAULT_WEIGHTS
+    assert state["suggestion"] == ASK_BASELINE
+    assert confidence >= FAST_PATH_MIN_CONFIDENCE
+
+    state, _ = extract_slots(_chat("Q3 goal 5600 growth 1 to 2", ASK_EXCLUDE, "no, include all months"), known)
+    assert state["exclude_disaster_months"] is False
+
+
+def test_declining_weights_goes_to_the_llm():
+    extractor = IntentExtractor()
+    data = extractor.extract(_chat("Q3 goal 5600 growth 1 to 2", ASK_WEIGHTS, "no"), lambda: {"intent": "llm"})
+
+    assert data == {"intent": "llm"}
+    assert extractor.stats()["llm_calls"] == 1
+
+
+def test_coerce_baseline_period():
+    assert coerce_baseline_period(None) is None
+    assert coerce_baseline_period(" ") is None
+    assert coerce_baseline_period("3") == 3
+    assert coerce_baseline_period(6.0) == 6
+    for value in ("three", "9", 0, 4.5):
+        with pytest.raises(ValueError):
+            coerce_baseline_period(value)
@@ -0,0 +1,76 @@
+import json
+import threading
+import time
+import pytest
+from LLMCache import LLMResponseCache, request_key
+
+
+def test_request_key_ignores_argument_order():
+    assert request_key(model="m", max_tokens=10) == request_key(max_tokens=10, model="m")
+
+
+def test_writes_are_debounced_and_flushed(tmp_path):
+    path = tmp_path / "llm.json"
+    cache = LLMResponseCache(str(path), flush_seconds=60)
+    for i in range(50):
+        cache.set(f"k{i}", f"v{i}")
+    assert not path.exists()
+
+    cache.flush()
+    assert len(json.loads(path.read_text())) == 50
+    assert LLMResponseCache(str(path)).get("k7") == "v7"
+
+
+def test_debounce_timer_writes_once(tmp_path):
+    path = tmp_path / "llm.json"
+    cache = LLMResponseCache(str(path), flush_seconds=0.05)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    deadline = time.time() + 5
+    while not path.exists() and time.time() < deadline:
+        time.sleep(0.01)
+    assert set(json.loads(path.read_text())) == {"a", "b"}
+
+
+def test_lru_order_survives_reload(tmp_path):
+    path = tmp_path / "llm.json"
+    cache = LLMResponseCache(str(path), max_entries=2, flush_seconds=0)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    reloaded = LLMResponseCache(str(path), max_entries=2)
+    assert reloaded.get("b") is None
+    assert reloaded.get("a") == "1" and reloaded.get("c") == "3"
+
+
+def test_concurrent_callers_share_one_call_and_counters_add_up():
+    cache = LLMResponseCache(None)
+    calls = []
+    release = threading.Event()
+
+    def call():
+        calls.append(1)
+        release.wait(5)
+        return '{"ok": true}'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_call("k", call, json.loads))) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"ok": True}] * 16
+    assert cache.hits + cache.misses == 16 and cache.misses == 1
+
+
+def test_unparseable_response_is_not_cached():
+    cache = LLMResponseCache(None)
+    with pytest.raises(ValueError):
+        cache.get_or_call("k", lambda: "not json", json.loads)
+    assert cache.get_or_call("k", lambda: "[1]", json.loads) == [1]
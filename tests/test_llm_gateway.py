@@ -0,0 +1,40 @@
+import json
+from IntentExtractor import extraction_prompt
+from LLMGateway import CONVERSATION_HEADING, IncrementalJSONParser, LLMGateway, StubBackend
+
+
+def _turns(*user_messages) -> str:
+    return json.dumps([{"role": "user", "content": text} for text in user_messages], indent=1)
+
+
+def test_extraction_prompt_uses_the_gateway_heading():
+    assert CONVERSATION_HEADING in extraction_prompt("{}", _turns("hi"))
+
+
+def test_stub_only_reads_turns_after_the_heading():
+    # Known fields above the heading must not leak into the stub's reading of the user turns
+    prompt = extraction_prompt('{"role": "user", "content": "goal 9999"}', _turns("Q3 goal 5600 growth 1 to 2"))
+    intent = StubBackend._intent(prompt)
+
+    assert intent["goal"] == 5600
+    assert intent["quarter"] == "Q3"
+
+
+def test_gateway_completes_through_the_stub():
+    gateway = LLMGateway(StubBackend(latency_seconds=0, chunk_delay_seconds=0))
+    try:
+        request = {"model": "m", "max_tokens": 10, "messages": [{"role": "user", "content": '"question"'}]}
+        text = gateway.complete(**request)
+        assert "question" in json.loads(text)
+        assert "".join(gateway.stream(**request)) == text
+        assert gateway.metrics.snapshot()["calls"] == 2
+    finally:
+        gateway.close()
+
+
+def test_incremental_parser_stops_at_the_first_object():
+    parser = IncrementalJSONParser()
+    assert not parser.feed('noise {"question": "Which terr')
+    assert parser.partial_string("question") == "Which terr"
+    assert parser.feed('itory?", "n": {"a": "}"}} trailing')
+    assert parser.value == {"question": "Which territory?", "n": {"a": "}"}}
@@ -0,0 +1,84 @@
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+from conftest import GOAL_WORKBOOK
+from DataContext import get_data_context
+from GoalCalculationN import calculate_goals
+from Pipeline import Pipeline, Stage, build_goal_pipeline
+
+PARAMS = {"goal": 5600, "min_growth": 1, "max_growth": 2, "product_weights": {"Product 2": 60, "Product 3": 40}, "baseline_period": 3}
+
+
+def _double(x):
+    return 2 * x
+
+
+def _add(a, b):
+    return a + b
+
+
+def _fail(x):
+    raise ValueError(f"bad input {x}")
+
+
+def _toy_pipeline(**kwargs) -> Pipeline:
+    return Pipeline([
+        Stage("a", _double, ("x",)),
+        Stage("b", _double, ("x",), kind="process"),
+        Stage("c", _add, ("a", "b"), kind="inline"),
+        Stage("broken", _fail, ("a",)),
+    ], **kwargs)
+
+
+def test_stages_are_memoized_by_input_content():
+    pipeline = _toy_pipeline()
+    try:
+        assert pipeline.run({"x": 3}, ["c"])["c"] == 12
+        run = pipeline.run({"x": 3}, ["c"])
+        assert run["c"] == 12 and all(t.cached for t in run.timings.values())
+        assert pipeline.run({"x": 4}, ["c"])["c"] == 16
+        assert run.critical_path()[-1] == "c"
+        stats = pipeline.stats()
+        assert (stats["runs"], stats["memo_hits"], stats["memo_misses"]) == (3, 3, 6)
+    finally:
+        pipeline.close()
+
+
+def test_failed_stage_raises_and_is_counted():
+    pipeline = _toy_pipeline()
+    try:
+        with pytest.raises(ValueError, match="bad input 6"):
+            pipeline.run({"x": 3}, ["broken"])
+        assert pipeline.stats()["failures"] == {"broken": 1}
+    finally:
+        pipeline.close()
+
+
+def test_process_stages_run_on_the_pool():
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        pipeline = _toy_pipeline(process_pool=pool)
+        try:
+            run = pipeline.run({"x": 5}, ["c"])
+            assert run["c"] == 20
+            assert run.timings["b"].kind == "process"
+        finally:
+            pipeline.close()
+
+
+def test_goal_pipeline_matches_calculate_goals():
+    # exclude_months given as an input skips the FEMA stages, which need the FEMA workbook
+    inputs = {
+        "context": get_data_context(), "sales_file_path": GOAL_WORKBOOK, "dataset_path": None,
+        "output_sink": None, "exclude_months": None, "params": PARAMS,
+    }
+    expected = calculate_goals(5600, GOAL_WORKBOOK, 1, 2, PARAMS["product_weights"], baseline_months=3)
+
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        for process_pool in (None, pool):
+            pipeline = build_goal_pipeline(process_pool=process_pool)
+            try:
+                goals = pipeline.run(inputs, ["goals"])["goals"]
+            finally:
+                pipeline.close()
+            assert goals.equals(expected)
+            assert goals.attrs["baseline"] == {"months": 3, "excluded_cells": 0}
+            assert goals.attrs == expected.attrs
@@ -0,0 +1,26 @@
+import pandas as pd
+import pytest
+from conftest import GOAL_WORKBOOK
+from TerritoryTable import R12_MONTHS
+from WorkbookCache import read_territory_sales_streaming
+
+PRODUCTS = ["Product 1", "Product 2", "Product 3"]
+
+
+@pytest.mark.parametrize("keep_months", [True, False])
+def test_streaming_result_does_not_depend_on_chunk_size(keep_months):
+    small = read_territory_sales_streaming(GOAL_WORKBOOK, "Input Sales", PRODUCTS, R12_MONTHS, keep_months, chunk_size=4)
+    whole = read_territory_sales_streaming(GOAL_WORKBOOK, "Input Sales", PRODUCTS, R12_MONTHS, keep_months, chunk_size=10_000)
+    pd.testing.assert_frame_equal(small, whole)
+
+
+def test_streaming_matches_pandas_read():
+    df = read_territory_sales_streaming(GOAL_WORKBOOK, "Input Sales", PRODUCTS, R12_MONTHS, keep_months=False, chunk_size=5)
+    source = pd.read_excel(GOAL_WORKBOOK, sheet_name="Input Sales").dropna(subset=["Territory"])
+
+    assert list(df.columns) == ["Territory", "Territory Name"] + [f"{p} R12 Total" for p in PRODUCTS]
+    assert df["Territory"].dtype == "int32"
+    assert isinstance(df["Territory Name"].dtype, pd.CategoricalDtype)
+    assert df["Territory Name"].astype(str).tolist() == source["Territory Name"].astype(str).tolist()
+    expected = source[[f"Product 1 R12 {m}" for m in R12_MONTHS]].sum(axis=1).to_numpy()
+    assert df["Product 1 R12 Total"].to_numpy() == pytest.approx(expected)